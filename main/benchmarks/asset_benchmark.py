@@ -0,0 +1,79 @@
+"""
+Compares report sizes before and after image optimisation, using the run_subscriptions benchmark stand-ins.
+For each report it renders the HTML (and the PDF when wkhtmltopdf is installed) with the previous settings
+(300 DPI chart, images inlined as rendered) and with the current IMAGE_* / PDF_IMAGE_* settings, and reports
+the HTML, PDF and HTML email sizes in bytes:
+
+    python -m main.benchmarks.asset_benchmark --reports 3
+"""
+import os
+import json
+import shutil
+import argparse
+import tempfile
+from http.server import ThreadingHTTPServer
+
+from main.benchmarks.run_subscriptions_benchmark import (MAIN_DIR, FakeRagHandler, start_server, install_fakes,
+                                                         synthetic_codes)
+
+BEFORE = {"IMAGE_OPTIMISE": "false", "CHART_DPI": "300"}
+AFTER = {"IMAGE_OPTIMISE": "true", "CHART_DPI": os.environ.get("CHART_DPI", "100")}
+
+
+def measure(pipeline_module, details, include_pdf):
+    """Renders every report in details with a fresh generator and returns {report: sizes}."""
+    report_generator = pipeline_module.ReportGenerator(pipeline_module.S3Utils(), pipeline_module.DbUtils(),
+                                                       pipeline_module.RagUtils(),
+                                                       market_data=pipeline_module.MarketDataUtils())
+    report_sender = pipeline_module.ReportSender()
+    sizes = {}
+    for report_type, subscription_value in details:
+        report_function = getattr(report_generator, pipeline_module.REPORT_TYPES[report_type]['report_function'])
+        artifact, report_html = report_function(subscription_value, include_pdf=include_pdf)
+        sizes[f"{report_type} {subscription_value}"] = {
+            "html_bytes": len(report_html.encode("utf-8")),
+            "pdf_bytes": len(artifact.read()) if artifact else None,
+            "html_email_bytes": len(report_sender.build_html_body(report_html).as_bytes()),
+        }
+    return sizes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--reports", type=int, default=3, help="Companies to render each report type for.")
+    args = parser.parse_args()
+
+    temp_dir = tempfile.mkdtemp(prefix="insight_assets_")
+    rag_port = start_server(ThreadingHTTPServer(("127.0.0.1", 0), FakeRagHandler))
+    os.environ.update({
+        "RAG_ENDPOINT": f"http://127.0.0.1:{rag_port}/rag",
+        "CACHE_DIR": os.path.join(temp_dir, "cache"),
+        "ARTIFACT_DIR": os.path.join(temp_dir, "artifacts"),
+        "ARTIFACT_MODE": "memory",
+        "LOGGING_MODE": os.environ.get("LOGGING_MODE", "none"),
+    })
+    os.chdir(MAIN_DIR)
+
+    import main.report_pipeline as pipeline_module
+
+    install_fakes((pipeline_module,), args.reports * 5, temp_dir)
+    details = [(report_type, json.dumps({"asx_code": code, "frequency": 7}))
+               for code in synthetic_codes(args.reports) for report_type in ("daily_report", "director_trades")]
+    include_pdf = shutil.which("wkhtmltopdf") is not None
+
+    results = {}
+    for label, settings in (("before", BEFORE), ("after", AFTER)):
+        os.environ.update(settings)
+        results[label] = measure(pipeline_module, details, include_pdf)
+
+    for report, before in results["before"].items():
+        after = results["after"][report]
+        print(f"{report:<60} " + ", ".join(
+            f"{name} {before[name]} -> {after[name]}" for name in before if before[name] is not None))
+    if not include_pdf:
+        print("wkhtmltopdf is not installed; PDF sizes were not measured.")
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
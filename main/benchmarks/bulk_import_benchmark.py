@@ -0,0 +1,55 @@
+"""
+Compares single-row subscription inserts (DbUtils.insert_new_subscription) with the bulk path
+(DbUtils.bulk_insert_subscriptions) against the database configured by DB_HOST/DB_NAME/DB_USER/DB_PASS.
+
+A temporary benchmark customer is created and removed, along with all of its preferences:
+
+    python -m main.benchmarks.bulk_import_benchmark --rows 1000
+"""
+import json
+import time
+import argparse
+from main.utils.db_utils import DbUtils
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1000, help="Number of subscriptions to insert per path.")
+    args = parser.parse_args()
+
+    db = DbUtils()
+    email = f"bulk-benchmark-{int(time.time())}@example.com"
+    result = db.add_customer("Bulk", "Benchmark", email)
+    if not result['success']:
+        raise SystemExit(result['message'])
+    customer_id = str(db.select_all("SELECT customer_id FROM insights.customers WHERE email = %s;", (email,))[0][0])
+
+    rows = [(customer_id, 'email', f"recipient{i}@example.com", 'daily_report', json.dumps({"asx_code": f"B{i % 500:03d}"}),
+             False, 'pdf') for i in range(args.rows)]
+
+    try:
+        start = time.perf_counter()
+        for row in rows:
+            db.insert_new_subscription(*row)
+        single_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        inserted, errors = db.bulk_insert_subscriptions(list(enumerate(rows, start=1)))
+        bulk_seconds = time.perf_counter() - start
+    finally:
+        db.execute("DELETE FROM insights.distribution_preferences WHERE customer_id = %s;", (customer_id,))
+        db.execute("DELETE FROM insights.customers WHERE customer_id = %s;", (customer_id,))
+
+    print(json.dumps({
+        "rows": args.rows,
+        "single_row_seconds": round(single_seconds, 3),
+        "single_row_rows_per_second": round(args.rows / single_seconds, 1),
+        "bulk_seconds": round(bulk_seconds, 3),
+        "bulk_rows_per_second": round(inserted / bulk_seconds, 1),
+        "bulk_errors": len(errors),
+        "speedup": round(single_seconds / bulk_seconds, 1),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""
+Measures the logging overhead per report. Each logging configuration runs in its own process (logging is
+configured at import) and renders the same daily and director trades reports as HTML with the
+run_subscriptions benchmark stand-ins; the overhead is the time per report above LOGGING_MODE=none.
+Chart rendering dominates a report, so each process also times the caller's cost of single log calls:
+an INFO line, and the DEBUG line holding the rendered HTML that is dropped unless LOG_LEVEL=DEBUG.
+Log output goes to /dev/null or a temporary file, so the numbers exclude terminal rendering:
+
+    python -m main.benchmarks.logging_benchmark --reports 20
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import subprocess
+from http.server import ThreadingHTTPServer
+
+from main.benchmarks.run_subscriptions_benchmark import (MAIN_DIR, REPO_DIR, FakeRagHandler, start_server,
+                                                         install_fakes, synthetic_codes)
+
+# (label, environment) per configuration; LOG_FILE is filled in with a temporary path
+CONFIGURATIONS = (
+    ("none", {"LOGGING_MODE": "none"}),
+    ("stdout", {"LOGGING_MODE": "stdout"}),
+    ("queue json", {"LOGGING_MODE": "queue", "LOG_FORMAT": "json", "LOG_FILE": ""}),
+    ("queue json debug", {"LOGGING_MODE": "queue", "LOG_FORMAT": "json", "LOG_FILE": "", "LOG_LEVEL": "DEBUG"}),
+)
+
+
+def run_child(reports, repeat, output):
+    """Renders the reports in this process and writes the timings to output."""
+    temp_dir = tempfile.mkdtemp(prefix="insight_logging_")
+    rag_port = start_server(ThreadingHTTPServer(("127.0.0.1", 0), FakeRagHandler))
+    os.environ.update({
+        "RAG_ENDPOINT": f"http://127.0.0.1:{rag_port}/rag",
+        "CACHE_DIR": os.path.join(temp_dir, "cache"),
+        "ARTIFACT_MODE": "memory",
+    })
+    os.chdir(MAIN_DIR)
+
+    import logging
+    import main.report_pipeline as pipeline_module
+    from main.utils import logger_utils
+
+    install_fakes((pipeline_module,), reports, temp_dir)
+    codes = synthetic_codes(reports)
+    details = [(report_type, json.dumps({"asx_code": code, "frequency": 7}))
+               for code in codes for report_type in ("daily_report", "director_trades")]
+
+    def render_all():
+        # A fresh generator per pass, so every pass fetches its components (from the warm caches)
+        report_generator = pipeline_module.ReportGenerator(pipeline_module.S3Utils(), pipeline_module.DbUtils(),
+                                                           pipeline_module.RagUtils(),
+                                                           market_data=pipeline_module.MarketDataUtils())
+        for report_type, subscription_value in details:
+            report_function = getattr(report_generator,
+                                      pipeline_module.REPORT_TYPES[report_type]['report_function'])
+            report_function(subscription_value, include_pdf=False)
+
+    # The first pass warms the RAG and chart caches and imports the plotting stack
+    render_all()
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        render_all()
+        timings.append(time.perf_counter() - start)
+    elapsed = min(timings)
+
+    def time_calls(log, *args, calls=5000):
+        start = time.perf_counter()
+        for _ in range(calls):
+            log(*args)
+        return (time.perf_counter() - start) / calls * 1e6
+
+    logger = logging.getLogger("main.report_pipeline")
+    info_us = time_calls(logger.info, "Returning cached answer for %s", "tpl:key_updates|asx_code=B000")
+    debug_html_us = time_calls(logger.debug, "Final HTML content:\n%s", "<p>report</p>" * 2000)
+    if logger_utils.queue_listener is not None:
+        drain_start = time.perf_counter()
+        logger_utils.queue_listener.stop()
+        drain = time.perf_counter() - drain_start
+    else:
+        drain = 0.0
+    logging.shutdown()
+
+    with open(output, "w") as f:
+        json.dump({"reports": len(details), "seconds_per_report": elapsed / len(details),
+                   "info_call_us": round(info_us, 2), "debug_html_call_us": round(debug_html_us, 2),
+                   "queue_drain_seconds": drain}, f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--reports", type=int, default=20, help="Companies to render each report type for.")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed passes per configuration; the fastest is kept.")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.reports, args.repeat, args.child)
+        return
+
+    temp_dir = tempfile.mkdtemp(prefix="insight_logging_")
+    results = {}
+    for label, settings in CONFIGURATIONS:
+        output = os.path.join(temp_dir, f"{label.replace(' ', '_')}.json")
+        env = {**os.environ, **settings}
+        if "LOG_FILE" in settings:
+            env["LOG_FILE"] = os.path.join(temp_dir, f"{label.replace(' ', '_')}.log")
+        subprocess.run([sys.executable, "-m", "main.benchmarks.logging_benchmark", "--reports", str(args.reports),
+                        "--repeat", str(args.repeat), "--child", output], cwd=REPO_DIR, env=env, check=True,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        with open(output) as f:
+            results[label] = json.load(f)
+
+    baseline = results["none"]["seconds_per_report"]
+    for label, result in results.items():
+        result["overhead_ms_per_report"] = round((result["seconds_per_report"] - baseline) * 1000, 3)
+        print(f"{label:<20} {result['seconds_per_report'] * 1000:8.2f} ms/report, "
+              f"logging overhead {result['overhead_ms_per_report']:7.2f} ms/report, "
+              f"INFO call {result['info_call_us']:.2f}us, HTML DEBUG call {result['debug_html_call_us']:.2f}us")
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,252 @@
+"""
+End-to-end benchmark for run_subscriptions and the /report view, using local stand-ins for every external service:
+synthetic customers and preferences instead of Postgres, a fake RAG SSE server, a stub S3 logo store,
+a recorded price series instead of yfinance and a local SMTP sink.
+
+Each scale runs in its own process so peak RSS is measured per scale:
+
+    python -m main.benchmarks.run_subscriptions_benchmark --scales 10,50,200 --rag-latency 0.05
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import resource
+import tempfile
+import threading
+import subprocess
+import socketserver
+from urllib.parse import quote
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+MAIN_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+REPO_DIR = os.path.dirname(MAIN_DIR)
+
+
+class FakeRagHandler(BaseHTTPRequestHandler):
+    """Streams a RAG answer as several SSE events followed by an end event."""
+    latency = 0.0
+    chunks = 4
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+        answer = ""
+        for i in range(self.chunks):
+            time.sleep(self.latency / self.chunks)
+            answer += f"- **Update {i}**: synthetic disclosure summary.\n"
+            event = json.dumps({"answer": answer, "conversation_id": "bench"})
+            self.wfile.write(f"data: {event}\n\n".encode("utf-8"))
+            self.wfile.flush()
+        self.wfile.write(b"event: end\ndata: {}\n\n")
+
+    def log_message(self, format, *args):
+        pass
+
+
+class SmtpSinkHandler(socketserver.StreamRequestHandler):
+    """Accepts and discards SMTP messages, counting them."""
+    messages = 0
+    lock = threading.Lock()
+
+    def reply(self, line):
+        self.wfile.write(f"{line}\r\n".encode("ascii"))
+
+    def handle(self):
+        self.reply("220 smtp-sink ready")
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode("utf-8", "replace").strip().upper()
+            if command.startswith("DATA"):
+                self.reply("354 end data with <CR><LF>.<CR><LF>")
+                while self.rfile.readline() not in (b".\r\n", b""):
+                    pass
+                with SmtpSinkHandler.lock:
+                    SmtpSinkHandler.messages += 1
+                self.reply("250 queued")
+            elif command.startswith("QUIT"):
+                self.reply("221 bye")
+                return
+            else:
+                self.reply("250 ok")
+
+
+def start_server(server):
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server.server_address[1]
+
+
+def synthetic_codes(count):
+    return [f"B{i:03d}" for i in range(count)]
+
+
+def install_fakes(modules, customers, temp_dir):
+    """Swaps the DB, S3 and market data classes used by main.app and main.report_pipeline for local stand-ins."""
+    import pandas as pd
+    from PIL import Image
+    from main.utils.db_utils import DbUtils, RecipientGroup
+    from main.utils.s3_utils import S3Utils
+    from main.utils.rag_utils import RagUtils
+    from main.utils.market_data_utils import MarketDataUtils
+
+    codes = synthetic_codes(max(1, customers // 5))
+
+    class BenchDbUtils(DbUtils):
+        def get_recipient_groups(self, subscription_types=None, preference_types=None):
+            daily, trades = {}, {}
+            for i in range(customers):
+                code = codes[i % len(codes)]
+                daily.setdefault(json.dumps({"asx_code": code}), []).append(f"customer{i}@example.com")
+                if i % 3 == 0:
+                    trades.setdefault(json.dumps({"asx_code": code, "frequency": 7}), []).append(f"customer{i}@example.com")
+            return [RecipientGroup("email", subscription_type, subscription_value, tuple(recipients))
+                    for subscription_type, values in (("daily_report", daily), ("director_trades", trades))
+                    if subscription_types is None or subscription_type in subscription_types
+                    for subscription_value, recipients in values.items()]
+
+        def get_delivery_formats(self):
+            # Every fourth customer takes the inline HTML email, every eighth both formats
+            delivery_formats = {}
+            for i in range(0, customers, 4):
+                code = codes[i % len(codes)]
+                delivery_formats.setdefault(("daily_report", json.dumps({"asx_code": code})), {})[
+                    f"customer{i}@example.com"] = "both" if i % 8 == 0 else "html"
+            return delivery_formats
+
+        def get_company_summary(self, asx_code):
+            return {"asx_code": asx_code, "company_name": f"Benchmark {asx_code} Ltd",
+                    "company_summary": "Synthetic company used for benchmarking. " * 5}
+
+        def get_companies(self, asx_codes=None):
+            return [(code, f"Benchmark {code} Ltd", "Synthetic company used for benchmarking. " * 5, "Benchmarks", code)
+                    for code in codes if asx_codes is None or code in asx_codes]
+
+        def get_company_fingerprints(self):
+            return {code: code for code in codes}
+
+        def get_director_trades(self, asx_code=None, date_from=None, date_to=None):
+            rows = [{"external_id": f"{asx_code}-{n}", "Director Name": f"Director {n}",
+                     "Date Of Change": f"2024-01-{n + 1:02d}", "Number Acquired": n * 100,
+                     "Indirect Interest Nature": "", "ABN": "", "Change Nature": "On-market trade"}
+                    for n in range(8)]
+            return pd.DataFrame(rows)
+
+    class BenchS3Utils(S3Utils):
+        def fetch_logo_from_s3(self, asx_code):
+            logo_path = os.path.join(temp_dir, f"{asx_code}.png")
+            if not os.path.exists(logo_path):
+                Image.new("RGB", (100, 50), (30, 90, 160)).save(logo_path, format="PNG")
+            return logo_path
+
+        def fetch_logo_bytes(self, asx_code):
+            with open(self.fetch_logo_from_s3(asx_code), "rb") as f:
+                return f.read()
+
+    class BenchMarketDataUtils(MarketDataUtils):
+        def get_stock_history(self, asx_code, period="5d", interval="1d", as_of=None):
+            index = pd.date_range(end=pd.Timestamp.today().normalize(), periods=5, freq="D")
+            return pd.DataFrame({"Close": [10.0, 10.4, 10.1, 10.6, 10.9]}, index=index)
+
+    for module in modules:
+        module.DbUtils = BenchDbUtils
+        module.S3Utils = BenchS3Utils
+        module.MarketDataUtils = BenchMarketDataUtils
+        module.RagUtils = lambda: RagUtils(cache_file=os.path.join(temp_dir, "rag_cache.pkl"))
+    return codes
+
+
+def run_scale(customers, rag_latency, view_hits):
+    """Runs one benchmark scale in this process and returns its measurements."""
+    temp_dir = tempfile.mkdtemp(prefix="insight_bench_")
+    FakeRagHandler.latency = rag_latency
+    rag_port = start_server(ThreadingHTTPServer(("127.0.0.1", 0), FakeRagHandler))
+    smtp_port = start_server(socketserver.ThreadingTCPServer(("127.0.0.1", 0), SmtpSinkHandler))
+
+    os.environ.update({
+        "RAG_ENDPOINT": f"http://127.0.0.1:{rag_port}/rag",
+        "EMAIL_PROVIDER": "mailhog",
+        "EMAIL_SENDER": "reports@example.com",
+        "LOCAL_SMTP_SERVER": "127.0.0.1",
+        "LOCAL_SMTP_PORT": str(smtp_port),
+        "CACHE_DIR": os.path.join(temp_dir, "cache"),
+        "ARTIFACT_DIR": os.path.join(temp_dir, "artifacts"),
+        "TRACING_MODE": "log",
+        "LOGGING_MODE": os.environ.get("LOGGING_MODE", "none"),
+    })
+    os.chdir(MAIN_DIR)
+    os.makedirs("output", exist_ok=True)
+
+    import main.app as app_module
+    import main.report_pipeline as pipeline_module
+    from main.utils.trace_utils import tracer
+
+    codes = install_fakes((app_module, pipeline_module), customers, temp_dir)
+    records = []
+    tracer.emit = records.append
+
+    start = time.perf_counter()
+    pipeline_module.run_subscriptions()
+    elapsed = time.perf_counter() - start
+    run_summary = next(record for record in records if record["event"] == "run_summary")
+
+    client = app_module.app.test_client()
+    view_timings = []
+    for i in range(view_hits):
+        hit_start = time.perf_counter()
+        client.get(f'/report/daily_report/{quote(json.dumps({"asx_code": codes[i % len(codes)]}))}')
+        view_timings.append(time.perf_counter() - hit_start)
+    view_timings.sort()
+
+    return {
+        "customers": customers,
+        "reports": run_summary["reports"],
+        "emails_delivered": SmtpSinkHandler.messages,
+        "elapsed_seconds": round(elapsed, 3),
+        "reports_per_minute": round(run_summary["reports"] / elapsed * 60, 1) if elapsed else None,
+        "report_p50_seconds": run_summary["report_p50_seconds"],
+        "report_p95_seconds": run_summary["report_p95_seconds"],
+        "view_p50_seconds": round(view_timings[len(view_timings) // 2], 4) if view_timings else None,
+        "stages": {name: {"p50": stage["p50_seconds"], "p95": stage["p95_seconds"]}
+                   for name, stage in run_summary["stages"].items()},
+        # ru_maxrss is reported in kilobytes on Linux
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scales", default="10,50,200", help="Comma separated customer counts to benchmark.")
+    parser.add_argument("--rag-latency", type=float, default=0.05, help="Seconds the fake RAG server takes per answer.")
+    parser.add_argument("--view-hits", type=int, default=5, help="Number of /report requests to time per scale.")
+    parser.add_argument("--child", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child is not None:
+        print(json.dumps(run_scale(args.child, args.rag_latency, args.view_hits)))
+        return
+
+    results = []
+    for customers in [int(scale) for scale in args.scales.split(",")]:
+        output = subprocess.run(
+            [sys.executable, "-m", "main.benchmarks.run_subscriptions_benchmark", "--child", str(customers),
+             "--rag-latency", str(args.rag_latency), "--view-hits", str(args.view_hits)],
+            cwd=REPO_DIR, capture_output=True, text=True, check=True
+        )
+        result = json.loads(output.stdout.strip().splitlines()[-1])
+        results.append(result)
+        print(f"{customers:>6} customers: {result['reports']} reports in {result['elapsed_seconds']}s "
+              f"({result['reports_per_minute']} reports/min), report p50/p95 "
+              f"{result['report_p50_seconds']}/{result['report_p95_seconds']}s, peak RSS {result['peak_rss_mb']} MB")
+        for name, stage in sorted(result["stages"].items()):
+            print(f"        {name:<32} p50 {stage['p50']:.4f}s  p95 {stage['p95']:.4f}s")
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""
+Tracks cold-start cost of the entry points using `python -X importtime`.
+For each entry module it reports the total import time, the slowest imports and the wall-clock time
+of a fresh interpreter importing it:
+
+    python -m main.benchmarks.startup_benchmark --repeat 3
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+
+REPO_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+ENTRY_MODULES = ("main.cli", "main.report_pipeline", "main.app")
+
+
+def import_profile(module):
+    """Returns (cumulative_us, [(module, cumulative_us), ...]) from -X importtime for one fresh interpreter."""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            cwd=REPO_DIR, capture_output=True, text=True,
+                            env={**os.environ, "LOGGING_MODE": "none"})
+    timings = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = (part.strip() for part in line[len("import time:"):].split("|"))
+        timings[name.strip()] = int(cumulative)
+    return timings.get(module, 0), sorted(timings.items(), key=lambda item: item[1], reverse=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=3, help="Fresh interpreters per entry module.")
+    parser.add_argument("--top", type=int, default=8, help="Slowest imports to list per entry module.")
+    args = parser.parse_args()
+
+    results = {}
+    for module in ENTRY_MODULES:
+        import_times, wall_times, slowest = [], [], []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            cumulative, slowest = import_profile(module)
+            wall_times.append(time.perf_counter() - start)
+            import_times.append(cumulative / 1e6)
+        results[module] = {
+            "import_seconds": round(min(import_times), 3),
+            "interpreter_wall_seconds": round(min(wall_times), 3),
+            "slowest_imports": [(name, round(us / 1e6, 3)) for name, us in slowest[1:args.top + 1]],
+        }
+        print(f"{module:<24} import {results[module]['import_seconds']:.3f}s, "
+              f"process {results[module]['interpreter_wall_seconds']:.3f}s")
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
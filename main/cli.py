@@ -0,0 +1,139 @@
+"""
+Command line entry point. Each command imports only what it needs, so a cron run or a dashboard start
+doesn't pay for pandas, matplotlib, yfinance, pdfkit and boto3 until a report is actually rendered.
+
+    python -m main.cli serve [--port 5000]
+    python -m main.cli migrate
+    python -m main.cli run [--workers N]
+    python -m main.cli warm [--run-date YYYY-MM-DD]
+    python -m main.cli listen
+    python -m main.cli render daily_report '{"asx_code": "BHP"}'
+    python -m main.cli artifacts [--sweep]
+
+Run from the main/ directory (or set it as the working directory) so templates and static files resolve.
+"""
+import os
+import sys
+import argparse
+
+
+def serve(args):
+    from main.app import app, prepare_database
+    from main.utils.worker_utils import WorkerRecycler, serve_recycled
+
+    prepare_database()
+    flask_port = args.port or int(os.environ.get("FLASK_PORT", "5000"))
+    recycler = WorkerRecycler("VIEW")
+    if recycler.enabled and not args.debug:
+        # VIEW_MAX_TASKS / VIEW_MAX_RSS_MB: serve from worker processes that are replaced as they grow
+        return 0 if serve_recycled(app, args.host, flask_port) else 1
+    app.run(debug=args.debug, host=args.host, port=flask_port)
+
+
+def migrate(args):
+    from main.app import prepare_database
+
+    return 0 if prepare_database() else 1
+
+
+def run(args):
+    from main.report_pipeline import run_subscriptions, run_sharded_workers
+    from main.utils.worker_utils import WorkerRecycler
+
+    workers = args.workers or int(os.environ.get("SHARD_WORKERS", 1))
+    # Recycling needs a supervisor process and the ledger to resume from, which the sharded path provides
+    if workers > 1 or WorkerRecycler().enabled:
+        return 0 if run_sharded_workers(workers, args.types) else 1
+    run_subscriptions(args.types)
+    return 0
+
+
+def warm(args):
+    from datetime import datetime
+    from main.report_pipeline import warm_caches
+
+    summary = warm_caches(datetime.strptime(args.run_date, "%Y-%m-%d").date() if args.run_date else None)
+    print(summary)
+    return 0
+
+
+def listen(args):
+    from main.report_pipeline import run_listener
+
+    run_listener()
+    return 0
+
+
+def render(args):
+    from main.utils.db_utils import DbUtils
+    from main.utils.s3_utils import S3Utils
+    from main.utils.rag_utils import RagUtils
+    from main.report_pipeline import REPORT_TYPES, ReportGenerator
+
+    report_info = REPORT_TYPES.get(args.subscription_type)
+    if not report_info:
+        print(f"Unknown subscription type: {args.subscription_type}", file=sys.stderr)
+        return 2
+
+    report_generator = ReportGenerator(S3Utils(), DbUtils(), RagUtils())
+    report, _ = getattr(report_generator, report_info['report_function'])(args.subscription_value)
+    # In memory mode the PDF is only written out here, when asked for
+    print(os.fspath(report))
+    return 0
+
+
+def artifacts(args):
+    from main.utils.artifact_utils import ArtifactStore
+
+    store = ArtifactStore()
+    print(store.sweep() if args.sweep else store.disk_usage())
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="python -m main.cli", description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    serve_parser = commands.add_parser("serve", help="Start the subscriptions dashboard and report viewer.")
+    serve_parser.add_argument("--host", default="0.0.0.0")
+    serve_parser.add_argument("--port", type=int)
+    serve_parser.add_argument("--debug", action="store_true")
+    serve_parser.set_defaults(func=serve)
+
+    run_parser = commands.add_parser("run", help="Generate and deliver every active subscription.")
+    run_parser.add_argument("--workers", type=int, help="Worker processes sharing one ledger run.")
+    run_parser.add_argument("--types", nargs="+", metavar="TYPE",
+                            help="Only deliver these subscription types, e.g. daily_report director_trades.")
+    run_parser.set_defaults(func=run)
+
+    migrate_parser = commands.add_parser("migrate", help="Apply the database schema changes, once per deploy.")
+    migrate_parser.set_defaults(func=migrate)
+
+    warm_parser = commands.add_parser("warm", help="Prefetch caches for the next delivery run.")
+    warm_parser.add_argument("--run-date", metavar="YYYY-MM-DD",
+                             help="Date of the delivery run to warm for (default: WARM_RUN_DATE or the next run).")
+    warm_parser.set_defaults(func=warm)
+
+    listen_parser = commands.add_parser("listen", help="Deliver reports as disclosures and preferences change.")
+    listen_parser.set_defaults(func=listen)
+
+    render_parser = commands.add_parser("render", help="Render a single report and print its PDF path.")
+    render_parser.add_argument("subscription_type", help="Report id, e.g. daily_report.")
+    render_parser.add_argument("subscription_value", nargs="?", help="Subscription value, e.g. '{\"asx_code\": \"BHP\"}'.")
+    render_parser.set_defaults(func=render)
+
+    artifacts_parser = commands.add_parser("artifacts", help="Show disk usage of stored reports.")
+    artifacts_parser.add_argument("--sweep", action="store_true", help="Apply the retention policy first.")
+    artifacts_parser.set_defaults(func=artifacts)
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
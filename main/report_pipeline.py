@@ -0,0 +1,1250 @@
+import json
+import os
+import sys
+import logging
+from main.utils.db_utils import DbUtils, canonical_subscription_value
+from main.utils.s3_utils import S3Utils
+from main.utils.rag_utils import RagUtils, DAILY_REPORT_TEMPLATES, INDUSTRY_REPORT_TEMPLATES
+from main.utils.market_data_utils import MarketDataUtils
+from main.utils.logger_utils import logger
+from main.utils.trace_utils import tracer
+from main.utils.metrics_utils import metrics
+from main.utils.notify_utils import (ChangeListener, DISCLOSURE_CHANNEL, DIRECTOR_TRADE_CHANNEL, PREFERENCE_CHANNEL,
+                                     COMPANY_CHANNEL)
+from main.utils.company_utils import CompanyDirectory
+from main.utils.ledger_utils import RunLedger, RENDERED
+from main.utils.artifact_utils import ReportArtifact, ArtifactStore, artifact_mode
+from main.utils.component_utils import Component, ComponentGraph
+from main.utils.image_utils import optimisation_enabled, optimise_data_uris, pdf_options
+from main.utils.provider_utils import provider_guard
+from main.utils.profile_utils import profiler
+from main.utils.worker_utils import WorkerRecycler, RECYCLE_EXIT_CODE, run_supervised
+from main.utils.import_utils import PREFERENCE_TYPES
+from main.utils.cache_utils import sweep_disk_caches
+import smtplib
+from email.mime.multipart import MIMEMultipart
+from email.mime.base import MIMEBase
+from email.mime.text import MIMEText
+from email.mime.image import MIMEImage
+from email import encoders
+from datetime import datetime, timedelta
+from jinja2 import Environment, FileSystemLoader, TemplateNotFound
+import io
+import base64
+import functools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import re
+from contextlib import nullcontext
+
+# pandas, matplotlib, pdfkit, requests, yfinance and boto3 are imported inside the stages that use them,
+# so entry points that never render a report (the dashboard, a cron run with nothing to do) start quickly.
+
+# Patterns used to turn a rendered report into a self-contained HTML email
+STYLESHEET_PATTERN = re.compile(r'<link rel="stylesheet" href="/static/([^"]+)">')
+ICON_PATTERN = re.compile(r'<link rel="icon"[^>]*>')
+DATA_URI_PATTERN = re.compile(r'src="data:image/(\w+);base64,([A-Za-z0-9+/=]+)"')
+
+# SMTP errors worth retrying; anything else (e.g. refused recipients) is the relay's answer
+SMTP_TRANSIENT_ERRORS = (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError, ConnectionError, TimeoutError)
+
+REPORT_TYPES = {
+    'industry_news': {
+        'report_id': 'industry_news',
+        'report_name': 'Industry News Report',
+        'report_function': 'generate_industry_news_report',
+        'report_html': 'industry_news_report_template.html',
+        'report_css': 'industry_news_report.css',
+        'components': ['industry_data', 'industry_prices', 'rag:industry_overview', 'rag:industry_media_update']
+    },
+    'daily_report': {
+        'report_id': 'daily_report',
+        'report_name': 'Daily Company Report',
+        'report_function': 'generate_daily_company_report',
+        'report_html': 'daily_company_report_template.html',
+        'report_css': 'daily_company_report.css',
+        'components': ['company_summary', 'logo', 'price_chart', 'rag:recent_activities', 'rag:media_update',
+                       'rag:director_trades', 'rag:key_updates']
+    },
+    'director_trades': {
+        'report_id': 'director_trades',
+        'report_name': 'Changes in Director Interests',
+        'report_function': 'generate_director_trades_report',
+        'report_html': 'director_trades_report_template.html',
+        'report_css': 'director_trades_report.css',
+        'components': ['company_summary', 'logo', 'director_trades']
+    }
+}
+
+# The data a report can declare in its 'components'. Each is fetched by the named ReportGenerator method,
+# keyed by the params it depends on, so reports in the same run share one fetch per key.
+# 'rag:<template_id>' components are built on demand by ReportGenerator.rag_component.
+COMPONENTS = {component.name: component for component in (
+    Component('company_summary', fetch='fetch_company_summary', key=('asx_code',)),
+    Component('logo', fetch='fetch_logo', key=('asx_code',)),
+    Component('price_series', fetch='fetch_price_series', key=('asx_code',)),
+    Component('price_chart', fetch='fetch_price_chart', key=('asx_code',),
+              depends=('company_summary', 'price_series')),
+    Component('director_trades', fetch='fetch_director_trades', key=('asx_code', 'date_from', 'date_to')),
+    Component('industry_data', fetch='fetch_industry_data', key=('industry', 'days')),
+    Component('industry_prices', fetch='fetch_industry_prices', key=('industry', 'days'),
+              depends=('industry_data',)),
+)}
+
+
+class ReportGenerator:
+    def __init__(self, s3, db, rag_utils, market_data=None, store=None, companies=None, director_trades_cache=False):
+        template_dir = os.path.join(os.getcwd(), 'templates')
+
+        # Check if the template directory exists
+        if not os.path.exists(template_dir):
+            logging.error(f"Template directory does not exist: {template_dir}")
+            raise FileNotFoundError(f"Template directory does not exist: {template_dir}")
+
+        self.env = Environment(loader=FileSystemLoader(template_dir))
+        self.s3 = s3
+        self.db = db
+        self.rag_utils = rag_utils
+        self.market_data = market_data or MarketDataUtils()
+        self.in_memory = artifact_mode() == "memory"
+        self.store = store or ArtifactStore()
+        # Optional CompanyDirectory; without one, company summaries are read from the database per report
+        self.companies = companies
+        # Scheduled runs read director trades from the disk cache a warm-up filled for the run's date range;
+        # the viewer and the listener read them afresh
+        self.director_trades_cache = director_trades_cache
+        self.logger = logging.getLogger(__name__)
+        # Report data shared by every report in a run, e.g. an industry report and the daily reports of its
+        # members. Each run (and each listener batch) uses a new ReportGenerator, so a run starts with an empty graph.
+        self.graph = ComponentGraph(self, COMPONENTS, factory=self.rag_component)
+
+    def rag_component(self, name):
+        """Builds the component for a 'rag:<template_id>' name."""
+        prefix, _, template_id = name.partition(':')
+        if prefix != 'rag' or not template_id:
+            raise KeyError(f"Unknown report component: {name}")
+        # Industry prompts list the member codes, so they wait for the industry data
+        depends = ('industry_data',) if template_id in INDUSTRY_REPORT_TEMPLATES else ()
+        return Component(name, fetch=functools.partial(self.fetch_rag, template_id),
+                         key=('asx_code', 'industry', 'as_of'), depends=depends)
+
+    def fetch_company_summary(self, params, inputs):
+        asx_code = params.get('asx_code')
+        if not asx_code:
+            return {'asx_code': 'ASX', 'company_name': 'ALL', 'company_summary': None}
+        if self.companies is not None:
+            company = self.companies.get(asx_code)
+            if company is not None:
+                return company
+        return self.db.get_company_summary(asx_code)
+
+    def fetch_logo(self, params, inputs):
+        asx_code = params.get('asx_code') or 'ASX'
+        try:
+            return self.company_logo(asx_code)
+        except Exception as e:
+            self.logger.warning(f"Company logo for {asx_code} not found: {e}")
+            return None
+
+    def fetch_price_series(self, params, inputs):
+        return self.market_data.get_stock_history(params['asx_code'], period="5d", interval="1d",
+                                                  as_of=params.get('as_of'))
+
+    def fetch_price_chart(self, params, inputs):
+        if self.price_change(inputs['price_series'])[0] is None:
+            # E.g. during a Yahoo Finance outage: the report goes out without its chart
+            self.logger.warning(f"Not enough price history for {params['asx_code']}. Skipping the stock chart.")
+            return None
+        stock_chart = self.render_stock_chart(params['asx_code'], inputs['company_summary']['company_name'],
+                                              inputs['price_series'])
+        return self.encode_image_bytes(stock_chart)
+
+    def fetch_director_trades(self, params, inputs):
+        db_params = {name: params[name] for name in ('asx_code', 'date_from', 'date_to') if params.get(name)}
+        if self.director_trades_cache:
+            return self.db.get_director_trades_cached(**db_params)
+        return self.db.get_director_trades(**db_params)
+
+    def fetch_industry_data(self, params, inputs):
+        industry_data = self.db.get_industry_data(params['industry'], days=params['days'])
+        # Share the member summaries with daily reports later in the run
+        for member in industry_data['members']:
+            self.graph.seed('company_summary', {'asx_code': member['asx_code']}, {
+                'asx_code': member['asx_code'],
+                'company_name': member['company_name'],
+                'company_summary': member['company_summary'],
+            })
+        return industry_data
+
+    def fetch_industry_prices(self, params, inputs):
+        """Returns {asx_code: price series} for the industry, downloading the missing series in one batch."""
+        asx_codes = [member['asx_code'] for member in inputs['industry_data']['members']]
+        missing_codes = [asx_code for asx_code in asx_codes if not self.graph.has('price_series', {'asx_code': asx_code})]
+        if missing_codes:
+            for asx_code, stock_data in self.market_data.get_stock_histories(missing_codes, period="5d", interval="1d",
+                                                                             as_of=params.get('as_of')).items():
+                self.graph.seed('price_series', {'asx_code': asx_code}, stock_data)
+        return {asx_code: self.graph.get('price_series', {'asx_code': asx_code}) for asx_code in asx_codes}
+
+    def fetch_rag(self, template_id, params, inputs):
+        rag_params = {'as_of': params['as_of']}
+        if 'industry_data' in inputs:
+            # The prompt lists the member codes, asked once for the industry rather than once per member
+            max_codes = int(os.environ.get("INDUSTRY_PROMPT_MAX_CODES", 40))
+            asx_codes = [member['asx_code'] for member in inputs['industry_data']['members']]
+            rag_params.update(industry=params['industry'], asx_codes=", ".join(asx_codes[:max_codes]))
+        else:
+            rag_params['asx_code'] = params['asx_code']
+        with tracer.span(f"rag.{template_id}"):
+            return self.format_rag_response(self.rag_utils.ask_template(template_id, rag_params)[0])
+
+    @staticmethod
+    def price_change(stock_data):
+        """Returns (last close, % change over the series), or (None, None) without enough prices."""
+        if stock_data is None or 'Close' not in stock_data:
+            return None, None
+        closes = stock_data['Close']
+        if hasattr(closes, 'columns'):
+            closes = closes.iloc[:, 0]
+        closes = closes.dropna()
+        if len(closes) < 2 or not closes.iloc[0]:
+            return None, None
+        return float(closes.iloc[-1]), float((closes.iloc[-1] - closes.iloc[0]) / closes.iloc[0] * 100)
+
+    @staticmethod
+    def encode_image(image_path):
+        if not image_path:
+            return None
+        with open(image_path, "rb") as image_file:
+            return ReportGenerator.encode_image_bytes(image_file.read())
+
+    @staticmethod
+    def encode_image_bytes(image_bytes):
+        if not image_bytes:
+            return None
+        encoded_string = base64.b64encode(image_bytes).decode('utf-8')
+        return f"data:image/png;base64,{encoded_string}"
+
+    @staticmethod
+    @functools.lru_cache(maxsize=None)
+    def encode_static_image(filename):
+        """Static images don't change while the process runs, so each is read and encoded once."""
+        return ReportGenerator.encode_image(os.path.join("static", filename))
+
+    def company_logo(self, asx_code):
+        """Returns the company logo as a data URI, fetched in memory when ARTIFACT_MODE=memory."""
+        if self.in_memory:
+            return self.encode_image_bytes(self.s3.fetch_logo_bytes(asx_code))
+        return self.encode_image(self.s3.fetch_logo_from_s3(asx_code))
+
+    @staticmethod
+    def parse_json(json_string):
+        """
+        Parses a JSON string and returns a Python dictionary.
+        If the string is empty or invalid, it logs a notice and returns an empty dictionary.
+
+        :param json_string:
+        :return: Parsed dictionary or empty dictionary
+        """
+        if not json_string:
+            logger.info("Details provided are empty.")
+            return {}
+
+        try:
+            # Attempt to parse the JSON string into a dictionary
+            return json.loads(json_string)
+        except json.JSONDecodeError as e:
+            logger.warning(f"Invalid JSON format: {e}")
+            return {}
+
+
+    def render_template_to_html_and_pdf(self, report_data, report_filename, include_pdf=True):
+        """
+        Renders the report to HTML and PDF, returning (ReportArtifact, html). In memory mode the PDF bytes
+        only stay in the artifact; otherwise it is also saved to the artifact store for the current run.
+        With include_pdf=False the PDF stage is skipped and the artifact is None.
+        """
+        try:
+            # Extract the report header and body template names from the report_data structure
+            report_header_template_name = report_data.get("report_header", {}).get("template_name")
+            body_template_name = report_data.get("report_body", {}).get("template_name")
+
+            if not report_header_template_name:
+                raise ValueError("No report header template name provided in the report data.")
+            if not body_template_name:
+                raise ValueError("No report body template name provided in the report data.")
+
+            # Encode images (e.g., DHI logo)
+            report_data["dhi_logo"] = self.encode_static_image("dhi_logo.png")
+
+            report_data['static_url'] = lambda filename: f"/static/{filename}"
+
+            # Render the master template (header) with the entire report_data, including the body data
+            self.logger.debug("Rendering master template with embedded template: %s", report_header_template_name)
+            master_template = self.env.get_template(report_header_template_name)
+
+            with tracer.span("html.render"):
+                final_html_content = master_template.render(report_data)
+
+            # Downsample and re-encode the inlined images once, before the HTML reaches wkhtmltopdf or email
+            if optimisation_enabled():
+                with tracer.span("assets.optimise"):
+                    final_html_content, html_before, html_after = optimise_data_uris(final_html_content,
+                                                                                     DATA_URI_PATTERN)
+                metrics.report_bytes.observe(html_before, artifact='html', stage='before')
+                metrics.report_bytes.observe(html_after, artifact='html', stage='after')
+                self.logger.info(f"Optimised images for {report_filename}: HTML {html_before} -> {html_after} bytes")
+
+            # Debugging: Log the final HTML content (formatted only when debug is enabled)
+            self.logger.debug("Final HTML content:\n%s", final_html_content)
+            if not include_pdf:
+                return None, final_html_content
+
+            import pdfkit
+
+            # Extract report orientation from the report_data
+            report_orientation = report_data.get("report_header", {}).get("report_orientation", "Portrait")
+
+            # Generate the PDF from the final HTML content
+            options = {
+                'enable-local-file-access': None,
+                'orientation': report_orientation
+            }
+            if optimisation_enabled():
+                options.update(pdf_options())
+            static_folder = os.path.join(os.getcwd(), 'static')
+            stylesheets = [
+                os.path.join(static_folder, report_data["report_header"]["header_css"]),
+                os.path.join(static_folder, report_data["report_body"]["body_css"])
+            ]
+
+            with tracer.span("pdf.render"):
+                # pdfkit returns the PDF bytes when no output path is given
+                artifact = ReportArtifact(report_filename, pdf_bytes=pdfkit.from_string(
+                    final_html_content, False, options=options, css=stylesheets))
+            if not self.in_memory:
+                artifact.spill(self.store)
+            metrics.report_bytes.observe(len(artifact.pdf_bytes), artifact='pdf', stage='after')
+
+            self.logger.info(f"Generated PDF: {artifact} ({len(artifact.pdf_bytes)} bytes)")
+            return artifact, final_html_content
+
+        except TemplateNotFound as e:
+            self.logger.error(f"Template not found: {e}")
+            raise
+        except FileNotFoundError as e:
+            self.logger.error(f"File not found: {e}")
+            raise
+        except Exception as e:
+            self.logger.error(f"Failed to generate PDF: {e}")
+            raise
+
+    def generate_industry_news_report(self, details, include_pdf=True):
+        self.logger.info(f"Generating Industry News report: {details}...")
+        report_info = REPORT_TYPES.get('industry_news')
+        industry_code = details
+        if not industry_code:
+            self.logger.error("Industry code (subscription_value) is missing in the details provided.")
+            raise ValueError("Industry code is required to generate the report.")
+
+        # Members, disclosures and director trades come from one query for the whole industry,
+        # and every member's price series from one download
+        days = int(os.environ.get("INDUSTRY_REPORT_DAYS", 7))
+        params = {'industry': industry_code, 'days': days, 'as_of': datetime.now().strftime("%Y-%m-%d")}
+        data = self.graph.resolve(report_info['components'], params)
+        industry_data = data['industry_data']
+
+        member_rows = []
+        recent_disclosures = []
+        for member in industry_data['members']:
+            last_price, percentage_change = self.price_change(data['industry_prices'].get(member['asx_code']))
+            member_rows.append({**member, 'last_price': last_price, 'percentage_change': percentage_change})
+            recent_disclosures.extend({**disclosure, 'asx_code': member['asx_code']}
+                                      for disclosure in member['disclosures'])
+        recent_disclosures.sort(key=lambda disclosure: disclosure.get('publish_date') or '', reverse=True)
+
+        report_data = {
+            "report_header": {
+                "template_name": "report_header.html",
+                "report_name": f"{report_info['report_name']}: {industry_code}",
+                "generation_date": datetime.now().strftime("%Y-%m-%d"),
+                "report_orientation": "Portrait",
+                "header_css": 'report_header.css'
+            },
+            "report_body": {
+                "template_name":  report_info['report_html'],
+                "industry_overview": data['rag:industry_overview'],
+                "media_update": data['rag:industry_media_update'],
+                "members": member_rows,
+                "recent_disclosures": recent_disclosures[:int(os.environ.get("INDUSTRY_REPORT_MAX_DISCLOSURES", 25))],
+                "director_trades": self.director_trades_table(industry_data['director_trades']),
+                "days": days,
+                "generation_date": datetime.now().strftime("%Y-%m-%d"),
+                "body_css": report_info['report_css']
+            }
+        }
+
+        # Render the templates to HTML and PDF
+        pdf_filename, report_html = self.render_template_to_html_and_pdf(
+            report_data, include_pdf=include_pdf,
+            report_filename=f"industry_news_report_{industry_code}_{datetime.now().strftime('%Y-%m-%d')}.pdf"
+        )
+        return pdf_filename, report_html
+
+    def generate_daily_company_report(self, details, include_pdf=True):
+        self.logger.info("Generating Daily Company Report...")
+        report_info = REPORT_TYPES.get('daily_report')
+        # Parse the details JSON string
+        try:
+            details_dict = self.parse_json(details)
+        except ValueError as e:
+            self.logger.error(f"Error in parsing details: {e}")
+            raise
+
+        # Extract the ASX code
+        asx_code = details_dict.get('asx_code')
+
+        if not asx_code:
+            self.logger.error("ASX code (subscription_value) is missing in the details provided.")
+            raise ValueError("ASX code is required to generate the report.")
+
+        # Company summary, logo, price chart and RAG answers; independent components are fetched concurrently
+        data = self.graph.resolve(report_info['components'],
+                                  {'asx_code': asx_code, 'as_of': datetime.now().strftime("%Y-%m-%d")})
+        company_name = data['company_summary']['company_name']
+
+        # Prepare the template contexts
+        report_data = {
+            "report_header": {
+                "template_name": "report_header.html",
+                "report_name": f"{report_info['report_name']}: {company_name} [{asx_code}]",
+                "company_name": company_name,
+                "generation_date": datetime.now().strftime("%Y-%m-%d"),
+                "report_orientation": "Portrait",
+                "header_css":  'report_header.css'
+            },
+            "report_body": {
+                "template_name":  report_info['report_html'],
+                "company_summary": data['company_summary']['company_summary'],
+                "company_logo": data['logo'],
+                "stock_chart": data['price_chart'],
+                "recent_activities":  data['rag:recent_activities'],
+                "media_update": data['rag:media_update'],
+                "director_trades":  data['rag:director_trades'],
+                "key_updates": data['rag:key_updates'],
+                "generation_date": datetime.now().strftime("%Y-%m-%d"),
+                "body_css": report_info['report_css']
+            }
+        }
+
+        # Render the templates to a PDF
+        pdf_filename, report_html = self.render_template_to_html_and_pdf(
+            report_data, include_pdf=include_pdf,
+            report_filename=f"daily_company_report_{asx_code}_{datetime.now().strftime('%Y-%m-%d')}.pdf"
+        )
+        return pdf_filename, report_html
+
+
+    @tracer.traced("chart.render")
+    def render_stock_chart(self, asx_code, company_name, stock_data):
+        """Plots the recent closing prices and returns the chart as PNG bytes."""
+        from matplotlib.figure import Figure
+
+        last_price = stock_data['Close'][-1]
+        previous_price = stock_data['Close'][-2]
+        percentage_change = ((last_price - previous_price) / previous_price) * 100
+        line_color = 'blue' if last_price > previous_price else 'red'
+
+        # Use a standalone Figure rather than pyplot's global state so charts can render on worker threads
+        fig = Figure(figsize=(10, 6))
+        ax = fig.subplots()
+        ax.plot(stock_data['Close'], color=line_color, linewidth=2)
+        ax.fill_between(stock_data.index, stock_data['Close'], color=line_color, alpha=0.1)
+        ax.plot(stock_data.index[-1], last_price, marker='o', color=line_color, markersize=8)
+        ax.grid(True, which='major', axis='y', linestyle='--', linewidth=0.5, color='gray')
+        ax.set_xlabel('')
+        ax.set_ylabel('Price (AUD)', fontsize=12)
+        ax.tick_params(axis='x', labelrotation=45)
+
+        fig.text(0.15, 0.92, f"{company_name} ({asx_code})", fontsize=16, weight='bold', ha='left')
+        fig.text(0.15, 0.86, f"${last_price:.2f}", fontsize=24, weight='bold', ha='left')
+        change_color = 'green' if percentage_change > 0 else 'red'
+        percentage_text = f"{percentage_change:.2f}%"
+        box_props = dict(boxstyle="round,pad=0.3", facecolor=change_color, edgecolor=change_color)
+        fig.text(0.32, 0.86, percentage_text, fontsize=16, color='white', ha='left', bbox=box_props)
+
+        fig.subplots_adjust(top=0.8)
+        buffer = io.BytesIO()
+        # The chart is shown at most 400px wide; render near the optimised size rather than at print resolution
+        fig.savefig(buffer, format='png', dpi=int(os.environ.get("CHART_DPI", 100)), bbox_inches='tight')
+        return buffer.getvalue()
+
+
+    def format_rag_response(self, rag_response):
+        """
+        Cleans up inconsistent Markdown-like formatting and converts it into structured HTML.
+        Removes only the first line if it's a top-level title and formats the remaining content into HTML.
+        Handles headers, bold text, lists, and ensures proper paragraph spacing.
+        Returns a well-formatted HTML string.
+        """
+
+        # Strip the first line if it looks like a top-level title (e.g., bold or header text)
+        rag_response = re.sub(r'^\s*(#|\*\*|##|###).*\n', '', rag_response, count=1)
+
+        # Normalize headers: convert any remaining `#`, `##`, etc., to <h2> and <h3> tags
+        cleaned_response = re.sub(r'^\s*#{1,2}\s+(.*)', r'<h2>\1</h2>', rag_response, flags=re.MULTILINE)
+        cleaned_response = re.sub(r'^\s*#{3,6}\s+(.*)', r'<h3>\1</h3>', cleaned_response, flags=re.MULTILINE)
+
+        # Normalize bold and italic: convert `**text**` or `__text__` to <strong> and `*text*` or `_text_` to <em>
+        cleaned_response = re.sub(r'(\*\*|__)(.*?)\1', r'<strong>\2</strong>', cleaned_response)  # Bold to <strong>
+        cleaned_response = re.sub(r'(\*|_)(.*?)\1', r'<em>\2</em>', cleaned_response)            # Italic to <em>
+
+        # Convert unordered and ordered lists into <ul><li> (both numbered and bullet lists)
+        cleaned_response = re.sub(r'^\s*[\*\-\+]\s+(.*)', r'<li>\1</li>', cleaned_response, flags=re.MULTILINE)  # Unordered lists
+        cleaned_response = re.sub(r'^\s*\d+\.\s+(.*)', r'<li>\1</li>', cleaned_response, flags=re.MULTILINE)     # Numbered lists
+
+        # Wrap consecutive <li> items in <ul> tags for bullet points
+        cleaned_response = re.sub(r'(<li>.*?</li>)', r'<ul>\1</ul>', cleaned_response, flags=re.DOTALL)
+
+        # Ensure paragraphs are properly separated: replace multiple newlines with <p> tags
+        cleaned_response = re.sub(r'\n{2,}', '</p><p>', cleaned_response)
+
+        # Wrap the entire content in a <div> and ensure it starts with a <p> tag
+        cleaned_response = f"<div><p>{cleaned_response}</p></div>"
+
+        # Clean up any excessive spaces or empty tags
+        cleaned_response = re.sub(r'\s+', ' ', cleaned_response)  # Remove extra spaces
+        cleaned_response = re.sub(r'<p>\s*</p>', '', cleaned_response)  # Remove empty paragraphs
+
+        return cleaned_response
+
+
+    @staticmethod
+    def director_trades_params(details_dict, now=None):
+        """Builds the get_director_trades arguments from the subscription details, as of now (default: the current time)."""
+        asx_code = details_dict.get('asx_code')
+        date_from = details_dict.get('date_from')
+        date_to = details_dict.get('date_to')
+        frequency = details_dict.get('frequency')
+
+        db_params = {}
+        if asx_code:
+            db_params['asx_code'] = asx_code
+        if date_from:
+            db_params['date_from'] = date_from
+        if date_to:
+            db_params['date_to'] = date_to
+        if frequency:
+            frequency = int(frequency)
+            now = now or datetime.now()
+            db_params['date_from'] = now - timedelta(days=frequency)
+            db_params['date_to'] = now
+        return db_params
+
+    def director_trades_table(self, director_trades_raw):
+        """Formats a director trades DataFrame as an HTML table, most recent change first."""
+        import pandas as pd
+
+        if director_trades_raw is None or director_trades_raw.empty:
+            # Log a notice if no records are found and handle it gracefully
+            self.logger.info("No director trades found for the given criteria.")
+            return "<p>No director trades available for the selected criteria.</p>"
+
+        # Drop unnecessary columns
+        director_trades_raw = director_trades_raw.drop(columns=['Indirect Interest Nature', 'ABN', 'Change Nature'],
+                                                       errors='ignore')
+
+        if 'Date Of Change' in director_trades_raw:
+            # Convert 'date_of_change' to datetime, errors='coerce' will set invalid parsing to NaT (Not a Time)
+            director_trades_raw['Date Of Change'] = pd.to_datetime(director_trades_raw['Date Of Change'], errors='coerce')
+
+            # Sort by 'date_of_change' in descending order
+            director_trades_raw = director_trades_raw.sort_values(by='Date Of Change', ascending=False)
+
+        # Convert to HTML for rendering
+        return director_trades_raw.to_html(classes='dataframe', index=False)
+
+    def generate_director_trades_report(self, details, include_pdf=True):
+        self.logger.info("Generating Director Trade Report...")
+        report_info = REPORT_TYPES.get('director_trades')
+        try:
+            details_dict = self.parse_json(details)
+        except ValueError as e:
+            self.logger.error(f"Error in parsing details: {e}")
+            raise
+
+        # Without an ASX code the report covers every company ('ALL' [ASX])
+        data = self.graph.resolve(report_info['components'], self.director_trades_params(details_dict))
+        company_name = data['company_summary']['company_name']
+        asx_code = details_dict.get('asx_code') or 'ASX'
+        director_trades_html = self.director_trades_table(data['director_trades'])
+
+        report_data = {
+            "report_header": {
+                "template_name": "report_header.html",
+                "report_name": f"{report_info['report_name']}: {company_name} [{asx_code}]",
+                "company_name": company_name,
+                "generation_date": datetime.now().strftime("%Y-%m-%d"),
+                "report_orientation": "Portrait",
+                "header_css": 'report_header.css'
+            },
+            "report_body": {
+                "template_name":  report_info['report_html'],
+                "company_logo": data['logo'],
+                "director_trades": director_trades_html,
+                "generation_date": datetime.now().strftime("%Y-%m-%d"),
+                "body_css": report_info['report_css']
+            }
+        }
+
+        # Render the templates to HTML and PDF
+        pdf_filename, report_html = self.render_template_to_html_and_pdf(
+            report_data, include_pdf=include_pdf,
+            report_filename=f"director_trades_report_{asx_code}_{datetime.now().strftime('%Y-%m-%d')}.pdf"
+        )
+        return pdf_filename, report_html
+
+
+class ReportSender:
+    def __init__(self):
+        self.logger = logging.getLogger(__name__)
+
+    @staticmethod
+    def read_report(report):
+        """Returns (file name, PDF bytes) for a ReportArtifact or a PDF path."""
+        if isinstance(report, ReportArtifact):
+            return report.filename, report.read()
+        with open(report, "rb") as f:
+            return os.path.basename(report), f.read()
+
+    @staticmethod
+    @functools.lru_cache(maxsize=None)
+    def read_stylesheet(filename):
+        with open(os.path.join(os.getcwd(), 'static', os.path.basename(filename))) as f:
+            return f.read()
+
+    def build_html_body(self, report_html):
+        """
+        Turns the rendered report into a multipart/related email body. Stylesheets are inlined and
+        base64 data URI images become CID references to image parts, which mail clients display reliably
+        and which keeps repeated images (e.g. the DHI logo) to a single part.
+        """
+        def inline_stylesheet(match):
+            try:
+                return f"<style>{self.read_stylesheet(match.group(1))}</style>"
+            except OSError as e:
+                self.logger.warning(f"Stylesheet {match.group(1)} not found for the HTML email: {e}")
+                return ""
+
+        images = {}
+
+        def to_cid(match):
+            subtype, data = match.groups()
+            if data not in images:
+                images[data] = (f"image{len(images) + 1}@insight", subtype)
+            return f'src="cid:{images[data][0]}"'
+
+        html = STYLESHEET_PATTERN.sub(inline_stylesheet, report_html)
+        html = ICON_PATTERN.sub("", html)
+        html = DATA_URI_PATTERN.sub(to_cid, html)
+
+        body = MIMEMultipart("related")
+        body.attach(MIMEText(html, "html", "utf-8"))
+        for data, (content_id, subtype) in images.items():
+            image = MIMEImage(base64.b64decode(data), _subtype=subtype)
+            image.add_header("Content-ID", f"<{content_id}>")
+            image.add_header("Content-Disposition", "inline")
+            body.attach(image)
+        return body
+
+    @tracer.traced("email.send")
+    def send_email(self, email_title, report_filename, recipients, report_html=None):
+        """
+        Send the report by email, as a PDF attachment, an inline HTML body (when report_html is given),
+        or both. Pass report_filename=None for an HTML-only email. Returns True once the relay accepts it.
+        """
+        report_name = report_filename or email_title
+        self.logger.info(f"Preparing to send email report {report_name} to {len(recipients)} recipients...")
+
+        email_sender = os.environ.get("EMAIL_SENDER")
+        email_provider = os.environ.get("EMAIL_PROVIDER", "mailhog").lower()
+
+        if email_provider == "mailchimp":
+            smtp_server = os.environ.get("SMTP_SERVER", "smtp.mandrillapp.com")
+            smtp_port = int(os.environ.get("SMTP_PORT", 587))  # Use Mailchimp's SMTP port
+            email_password = os.environ.get("EMAIL_PASSWORD")
+        else:  # Default to MailHog
+            smtp_server = os.environ.get("LOCAL_SMTP_SERVER", "localhost")
+            smtp_port = int(os.environ.get("LOCAL_SMTP_PORT", 1025))  # Use MailHog's SMTP port
+            email_password = None  # No password needed for MailHog
+
+        # Ensure the file has a .pdf extension
+        if isinstance(report_filename, str) and not report_filename.endswith('.pdf'):
+            report_filename += '.pdf'
+
+        msg = MIMEMultipart()
+        msg['Subject'] = email_title
+        msg['From'] = email_sender
+        msg['To'] = ", ".join(recipients)
+
+        if report_html:
+            msg.attach(self.build_html_body(report_html))
+
+        # Attach the PDF
+        if report_filename:
+            base_filename, pdf_bytes = self.read_report(report_filename)
+            part = MIMEBase("application", "octet-stream")
+            part.set_payload(pdf_bytes)
+            encoders.encode_base64(part)
+            part.add_header("Content-Disposition", f"attachment; filename='{base_filename}'")
+            msg.attach(part)
+
+        guard = provider_guard("smtp")
+
+        def deliver():
+            with smtplib.SMTP(smtp_server, smtp_port, timeout=guard.timeout) as server:
+                server.ehlo()
+                if email_provider == "mailchimp":
+                    server.starttls()
+                    server.ehlo()
+                    server.login(email_sender, email_password)
+                server.sendmail(msg['From'], recipients, msg.as_string())
+
+        try:
+            guard.call(deliver, retry_on=SMTP_TRANSIENT_ERRORS)
+            self.logger.info(f"Email report {report_name} sent successfully to {len(recipients)} recipients.")
+            metrics.emails_sent.inc(status="sent")
+            return True
+        except smtplib.SMTPAuthenticationError as auth_err:
+            self.logger.error(f"Authentication failed for {report_name}: {auth_err}")
+            metrics.emails_sent.inc(status="failed")
+        except Exception as e:
+            self.logger.error(f"Failed to send email report {report_name}: {e}")
+            metrics.emails_sent.inc(status="failed")
+        return False
+
+    @tracer.traced("api.send")
+    def send_api(self, report_filename, endpoints):
+        """Send report via API."""
+        import requests
+
+        self.logger.info(f"Sending API report {report_filename} to {len(endpoints)} endpoints...")
+
+        _, report_data = self.read_report(report_filename)
+
+        for endpoint in endpoints:
+            try:
+                response = requests.post(endpoint, files={'file': report_data})
+                response.raise_for_status()
+                self.logger.info(f"Report {report_filename} sent to API endpoint {endpoint} successfully.")
+            except requests.exceptions.RequestException as e:
+                self.logger.error(f"Failed to send report {report_filename} to API endpoint {endpoint}: {e}")
+
+    @tracer.traced("rss.publish")
+    def publish_rss(self, report_filename, feeds):
+        """Publish report to RSS feeds."""
+        import requests
+
+        self.logger.info(f"Publishing RSS report {report_filename} to {len(feeds)} feeds...")
+        _, report_data = self.read_report(report_filename)
+
+        for feed in feeds:
+            try:
+                # Assuming a simple post to the RSS feed URL with the report data
+                response = requests.post(feed, data=report_data)
+                response.raise_for_status()
+                self.logger.info(f"Report {report_filename} published to RSS feed {feed} successfully.")
+            except requests.exceptions.RequestException as e:
+                self.logger.error(f"Failed to publish report {report_filename} to RSS feed {feed}: {e}")
+
+
+def ordered_subscriptions(subscriptions):
+    """
+    Orders {subscription_type: values} items as in REPORT_TYPES, so industry reports run first and
+    the member summaries and prices they fetch in bulk are reused by the daily company reports.
+    """
+    report_ids = list(REPORT_TYPES)
+    return sorted(subscriptions.items(),
+                  key=lambda item: report_ids.index(item[0]) if item[0] in report_ids else len(report_ids))
+
+
+def report_profile(store, subscription_type, subscription_value, mode=None):
+    """
+    Profiles the report rendered inside the block when a mode is requested (the report viewer) or PROFILE_REPORTS
+    matches it, saving the profile next to the run's reports. Yields the ReportProfile, or None when not profiled.
+    """
+    try:
+        details = json.loads(subscription_value) if subscription_value else {}
+    except ValueError:
+        details = {}
+    asx_code = details.get('asx_code') if isinstance(details, dict) else None
+    if mode is None and not profiler.wanted(subscription_type, asx_code):
+        return nullcontext()
+    key = asx_code or re.sub(r'\W+', '_', subscription_value or 'all').strip('_')
+    return profiler.report(f"profile_{subscription_type}_{key}", store, mode)
+
+
+def deliver_email_report(report_generator, report_sender, subscription_type, subscription_value, emails,
+                         ledger=None, item=None, delivery_formats=None):
+    """
+    Generates one report and emails it to its recipients. Returns False for unknown report types.
+    delivery_formats maps recipients to 'html' or 'both' (anyone missing gets the PDF); the PDF is only
+    rendered if some recipient needs it.
+    When a ledger item is given, its state is recorded, an already rendered report is sent without re-rendering,
+    and recipients an earlier attempt already sent it to are skipped.
+    """
+    logger.info(
+        f"Generating report for subscription type: {subscription_type}, subscription value: {subscription_value}")
+
+    report_info = REPORT_TYPES.get(subscription_type)
+    if not report_info:
+        logger.warning(f"Unknown subscription type: {subscription_type}")
+        return False
+
+    email_title = 'DHI Report Subscription: ' + report_info['report_name'] + " for " + datetime.now().strftime("%d %B %Y")
+    report_function = getattr(report_generator, report_info['report_function'])
+
+    # Group the recipients by how they receive the report
+    already_sent = set(item.delivered_to or ()) if item else set()
+    recipients_by_format = {}
+    for email in emails:
+        if email in already_sent:
+            continue
+        delivery_format = (delivery_formats or {}).get(email, 'pdf')
+        recipients_by_format.setdefault(delivery_format if delivery_format in ('html', 'both') else 'pdf', []).append(email)
+    needs_pdf = bool(recipients_by_format.keys() & {'pdf', 'both'})
+    needs_html = bool(recipients_by_format.keys() & {'html', 'both'})
+
+    with tracer.report(subscription_type, subscription_value), \
+            report_profile(report_generator.store, subscription_type, subscription_value):
+        report_filename = report_html = None
+        if needs_pdf and item and item.state == RENDERED and item.artifact_path and os.path.exists(item.artifact_path):
+            logger.info(f"Reusing report rendered by an earlier attempt: {item.artifact_path}")
+            report_filename = ReportArtifact(os.path.basename(item.artifact_path), path=item.artifact_path)
+
+        if needs_html or (needs_pdf and report_filename is None):
+            # Generate the report, skipping the PDF when nobody needs it or it was already rendered
+            rendered, report_html = report_function(subscription_value, include_pdf=needs_pdf and report_filename is None)
+            if rendered is not None:
+                report_filename = rendered
+                if ledger and not ledger.mark_rendered(item.item_id, report_filename.spill(report_generator.store)):
+                    # The ledger resends rendered reports after a crash, so they must outlive this process;
+                    # if the claim was lost meanwhile, the worker now holding the item sends it
+                    logger.warning(f"Not sending {subscription_type} report for {subscription_value}: "
+                                   f"ledger item {item.item_id} was claimed by another worker.")
+                    return True
+
+        if ledger and not ledger.renew_claim(item.item_id):
+            logger.warning(f"Not sending {subscription_type} report for {subscription_value}: "
+                           f"ledger item {item.item_id} was claimed by another worker.")
+            return True
+
+        # Send the generated report to each email in the list
+        logger.info(
+            f"Sending email reports for {subscription_type}, subscription value: {subscription_value}")
+        delivered = True
+        for delivery_format, recipients in recipients_by_format.items():
+            sent = report_sender.send_email(
+                email_title,
+                report_filename if delivery_format in ('pdf', 'both') else None,
+                recipients,
+                report_html=report_html if delivery_format in ('html', 'both') else None
+            )
+            if sent and ledger:
+                # A retry after another group fails only sends to the groups still waiting
+                ledger.record_sent(item.item_id, recipients)
+            delivered = sent and delivered
+        if ledger:
+            if delivered:
+                ledger.mark_delivered(item.item_id)
+            else:
+                ledger.mark_failed(item.item_id, "Email delivery failed")
+    return True
+
+
+def run_subscriptions_with_ledger(report_generator, report_sender, distribution_lists, ledger, delivery_formats=None,
+                                  recycler=None):
+    """
+    Runs the email subscriptions through the run ledger so a crashed run resumes where it stopped.
+    The run id defaults to today's date, so re-running on the same day skips delivered reports.
+    Any number of workers can run this at once; each claims a disjoint batch of items at a time.
+    When the recycler asks for a fresh process, the worker hands its remaining claims back and returns None.
+    """
+    run_id = os.environ.get("RUN_ID") or datetime.now().strftime("%Y-%m-%d")
+    worker_id = ledger.worker_id
+    batch_size = int(os.environ.get("LEDGER_CLAIM_BATCH", 5))
+    ledger.ensure_schema()
+    ledger.plan(run_id, [
+        ("email", subscription_type, subscription_value, emails)
+        for subscription_type, subscription_values in ordered_subscriptions(distribution_lists.get("email", {}))
+        for subscription_value, emails in subscription_values.items()
+    ])
+
+    ledger.log_poison_items(run_id)
+
+    delivered = 0
+    while True:
+        items = ledger.claim_items(run_id, worker_id, batch_size)
+        if not items:
+            break
+        for item in items:
+            # The batch was claimed together, so restart the lease before each item; skip items claimed since
+            if not ledger.renew_claim(item.item_id):
+                logger.warning(f"Skipping ledger item {item.item_id}: its claim expired and another worker took it.")
+                continue
+            try:
+                if deliver_email_report(report_generator, report_sender, item.subscription_type,
+                                        item.subscription_value, item.recipients, ledger, item,
+                                        (delivery_formats or {}).get((item.subscription_type, item.subscription_value))):
+                    delivered += 1
+                else:
+                    ledger.mark_failed(item.item_id, f"Unknown subscription type: {item.subscription_type}")
+            except Exception as e:
+                # Record the failure and carry on; the item is retried until LEDGER_MAX_ATTEMPTS
+                logger.exception(f"Failed to deliver {item.subscription_type} report for {item.subscription_value}: {e}")
+                ledger.mark_failed(item.item_id, e)
+            if recycler is not None and recycler.task_done():
+                ledger.release_claims(run_id)
+                logger.info(f"Worker {worker_id} processed {delivered} reports in run {run_id} before recycling.")
+                return None
+
+    logger.info(f"Worker {worker_id} processed {delivered} reports in run {run_id}.")
+    return ledger.finish_run(run_id)
+
+
+def run_subscription_worker(subscription_types=None):
+    """Process target for run_sharded_workers; exits with RECYCLE_EXIT_CODE when it should be replaced."""
+    recycler = WorkerRecycler()
+    run_subscriptions(subscription_types, recycler=recycler)
+    if recycler.reason:
+        sys.exit(RECYCLE_EXIT_CODE)
+
+
+def run_sharded_workers(worker_count, subscription_types=None):
+    """
+    Starts worker_count local processes that share one ledger run. Each process claims its own items,
+    so this behaves like running the same number of containers with LEDGER_ENABLED=True.
+    A worker that reaches WORKER_MAX_TASKS reports or WORKER_MAX_RSS_MB is replaced by a fresh process,
+    which picks up the items it handed back.
+    """
+    os.environ["LEDGER_ENABLED"] = "True"
+    # Fix the run id up front so every worker joins the same run even across midnight
+    os.environ.setdefault("RUN_ID", datetime.now().strftime("%Y-%m-%d"))
+    failed = run_supervised("subscription-worker", worker_count, run_subscription_worker, (subscription_types,))
+    if failed:
+        logger.error(f"Subscription workers exited with errors: {', '.join(failed)}")
+    return not failed
+
+
+def invalid_subscriptions(subscriptions, companies):
+    """
+    Returns the (subscription_type, subscription_value) pairs whose ASX code is not in the company directory,
+    logging each, so bad subscriptions are dropped before anything is rendered.
+    """
+    codes = {}
+    for subscription_type, subscription_value in subscriptions:
+        # Only reports built around a company take an ASX code (industry reports take an industry name)
+        if 'company_summary' not in REPORT_TYPES.get(subscription_type, {}).get('components', ()):
+            continue
+        asx_code = ReportGenerator.parse_json(subscription_value).get('asx_code')
+        if asx_code:
+            codes[(subscription_type, subscription_value)] = asx_code
+
+    unknown = set(companies.unknown(codes.values()))
+    invalid = {key for key, asx_code in codes.items() if asx_code in unknown}
+    for subscription_type, subscription_value in sorted(invalid):
+        logger.error(f"Skipping {subscription_type} subscription {subscription_value}: unknown ASX code "
+                     f"{codes[(subscription_type, subscription_value)]}")
+    return invalid
+
+
+def run_subscriptions(subscription_types=None, recycler=None):
+    """
+    Generates and delivers every active subscription, or only those of the given subscription_types.
+    A WorkerRecycler stops a ledger run early so a fresh process can take over (see run_sharded_workers).
+    """
+    db = DbUtils()
+    s3 = S3Utils()
+    rag_utils = RagUtils()
+    companies = CompanyDirectory(db)
+    report_generator = ReportGenerator(s3, db, rag_utils, companies=companies, director_trades_cache=True)
+    report_sender = ReportSender()
+    logger.info("Processing subscription reports...")
+    # Fetch distribution lists by preference type first, then by subscription type
+    distribution_lists = db.get_distribution_lists_by_subscription(subscription_types)
+    if not distribution_lists:
+        logger.info("No active subscriptions; nothing to deliver.")
+        return
+
+    # Load the company directory in one query and drop subscriptions to unknown ASX codes up front
+    invalid = invalid_subscriptions({(subscription_type, subscription_value)
+                                     for subscriptions in distribution_lists.values()
+                                     for subscription_type, subscription_values in subscriptions.items()
+                                     for subscription_value in subscription_values}, companies)
+    for subscriptions in distribution_lists.values():
+        for subscription_type, subscription_value in invalid:
+            subscriptions.get(subscription_type, {}).pop(subscription_value, None)
+    delivery_formats = db.get_delivery_formats()
+
+    if os.environ.get("LEDGER_ENABLED", "False").lower() == "true":
+        counts = run_subscriptions_with_ledger(report_generator, report_sender, distribution_lists, RunLedger(db),
+                                               delivery_formats, recycler)
+        if counts is None:
+            # Recycled; the replacement worker carries on with the run
+            return
+        logger.info("All reports have been processed and sent.")
+        sweep_artifacts(report_generator.store)
+        tracer.emit_summary()
+        return
+
+    for preference_type, subscriptions in distribution_lists.items():
+        if preference_type not in PREFERENCE_TYPES:
+            logger.warning(f"Unknown preference type: {preference_type}")
+            continue  # Skip to the next preference type
+        logger.info(f"Processing reports for preference type: {preference_type}")
+
+        if preference_type == "email":
+            for subscription_type, subscription_values in ordered_subscriptions(subscriptions):
+                logger.info(f"Processing subscription type: {subscription_type}")
+
+                for subscription_value, emails in subscription_values.items():
+                    deliver_email_report(report_generator, report_sender, subscription_type, subscription_value,
+                                         emails, delivery_formats=delivery_formats.get((subscription_type,
+                                                                                        subscription_value)))
+
+        elif preference_type == "api":
+            logger.info(f"Processing API reports for preference type: {preference_type}")
+            # Placeholder for API transmission logic
+            # You can add logic here to handle API-based reports
+
+        elif preference_type == "rss":
+            logger.info(f"Processing RSS reports for preference type: {preference_type}")
+            # Placeholder for RSS transmission logic
+            # You can add logic here to handle RSS-based reports
+
+    # Optionally log the distribution for tracking purposes
+    logger.info("All reports have been processed and sent.")
+    sweep_artifacts(report_generator.store)
+    tracer.emit_summary()
+
+
+def sweep_artifacts(store):
+    """
+    Applies the artifact retention policy after a run and removes expired disk cache entries.
+    Disable with ARTIFACT_SWEEP=False.
+    """
+    if os.environ.get("ARTIFACT_SWEEP", "True").lower() != "true":
+        return None
+    try:
+        removed = sweep_disk_caches()
+        if removed:
+            logger.info(f"Removed {removed} expired disk cache entries.")
+        return store.sweep()
+    except OSError as e:
+        logger.warning(f"Failed to sweep report artifacts: {e}")
+        return None
+
+
+def next_run_date(now=None):
+    """
+    Returns the date of the next delivery run: WARM_RUN_DATE (YYYY-MM-DD) when set, otherwise today if it is
+    still before DELIVERY_TIME (HH:MM, default 06:00) and tomorrow after it.
+    """
+    run_date = os.environ.get("WARM_RUN_DATE")
+    if run_date:
+        return datetime.strptime(run_date, "%Y-%m-%d").date()
+    now = now or datetime.now()
+    delivery_time = datetime.strptime(os.environ.get("DELIVERY_TIME", "06:00"), "%H:%M").time()
+    return now.date() if now.time() < delivery_time else now.date() + timedelta(days=1)
+
+
+def warm_caches(run_date=None):
+    """
+    Prefetches everything the delivery run on run_date (default: next_run_date()) needs - RAG answers,
+    stock prices, logos and director trades - so the delivery window only renders and sends.
+    Returns a summary of what was warmed.
+    """
+    start_time = time.monotonic()
+    run_date = run_date or next_run_date()
+    # Keyed the way the delivery run will look them up on that day
+    as_of = run_date.strftime("%Y-%m-%d")
+    run_time = datetime.combine(run_date, datetime.now().time())
+    max_workers = int(os.environ.get("WARM_CONCURRENCY", 4))
+    db = DbUtils()
+    s3 = S3Utils()
+    rag_utils = RagUtils()
+    market_data = MarketDataUtils()
+
+    distribution_lists = db.get_distribution_lists_by_subscription(('daily_report', 'director_trades'))
+
+    # Collect the distinct subscriptions across every preference type
+    daily_codes = set()
+    logo_codes = set()
+    director_trades_params = {}
+    for subscriptions in distribution_lists.values():
+        for subscription_type, subscription_values in subscriptions.items():
+            for subscription_value in subscription_values:
+                details_dict = ReportGenerator.parse_json(subscription_value)
+                asx_code = details_dict.get('asx_code')
+                if subscription_type == 'daily_report' and asx_code:
+                    daily_codes.add(asx_code)
+                    logo_codes.add(asx_code)
+                elif subscription_type == 'director_trades':
+                    logo_codes.add(asx_code or 'ASX')
+                    director_trades_params[subscription_value] = ReportGenerator.director_trades_params(details_dict, run_time)
+
+    def warm_step(step, func, *args, **kwargs):
+        try:
+            func(*args, **kwargs)
+            return step, True
+        except Exception as e:
+            logger.warning(f"Failed to warm {step} for {args or kwargs}: {e}")
+            return step, False
+
+    summary = {'logos': 0, 'stock_prices': 0, 'director_trades': 0, 'rag_answers': 0, 'failures': 0}
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = [pool.submit(warm_step, 'logos', s3.fetch_logo_from_s3, asx_code) for asx_code in logo_codes]
+        futures += [pool.submit(warm_step, 'stock_prices', market_data.get_stock_history, asx_code, as_of=as_of)
+                    for asx_code in daily_codes]
+        futures += [pool.submit(warm_step, 'director_trades', db.get_director_trades_cached, **db_params)
+                    for db_params in director_trades_params.values()]
+
+        # RAG answers dominate the warm-up, so they share the same concurrency budget in their own pool
+        summary['rag_answers'] = rag_utils.warm(
+            DAILY_REPORT_TEMPLATES,
+            [{'asx_code': asx_code, 'as_of': as_of} for asx_code in sorted(daily_codes)],
+            max_workers=max_workers
+        )
+
+        for future in futures:
+            step, succeeded = future.result()
+            if succeeded:
+                summary[step] += 1
+            else:
+                summary['failures'] += 1
+
+    summary['elapsed_seconds'] = round(time.monotonic() - start_time, 2)
+    logger.info(f"Cache warm-up for the {as_of} run complete: {summary}")
+    return summary
+
+
+def affected_reports(events, db, companies=None):
+    """
+    Maps a batch of change events to the email reports they affect, as {(subscription_type, subscription_value): [emails]},
+    and returns it with the changed ASX codes and their industries.
+    Disclosures and director trades affect every active report for their ASX code, the industry report of the
+    company's industry (looked up in the company directory) and the all-company director trades report;
+    a company moving industry affects the industry reports of both industries, and a preference change
+    affects only the changed recipient.
+    """
+    changed_codes = {event['asx_code'] for event in events
+                     if event['channel'] in (DISCLOSURE_CHANNEL, DIRECTOR_TRADE_CHANNEL) and event.get('asx_code')}
+    director_trades_changed = any(event['channel'] == DIRECTOR_TRADE_CHANNEL for event in events)
+    changed_industries = set()
+    if companies is not None:
+        for asx_code in changed_codes:
+            company = companies.get(asx_code)
+            if company and company.get('industry'):
+                changed_industries.add(company['industry'])
+    for event in events:
+        if event['channel'] == COMPANY_CHANNEL:
+            # Only sent with the industries when the company's industry changed
+            changed_industries.update(industry for industry in (event.get('industry'), event.get('previous_industry'))
+                                      if industry)
+
+    affected = {}
+    if changed_codes or changed_industries:
+        distribution_lists = db.get_distribution_lists_by_subscription(preference_types=('email',))
+        for subscription_type, subscription_values in distribution_lists.get('email', {}).items():
+            # Industry reports take the industry name as their subscription value
+            industry_report = 'industry_data' in REPORT_TYPES.get(subscription_type, {}).get('components', ())
+            for subscription_value, emails in subscription_values.items():
+                if industry_report:
+                    changed = subscription_value in changed_industries
+                else:
+                    asx_code = ReportGenerator.parse_json(subscription_value).get('asx_code')
+                    changed = asx_code in changed_codes or (subscription_type == 'director_trades' and not asx_code
+                                                            and director_trades_changed)
+                if changed:
+                    affected.setdefault((subscription_type, subscription_value), set()).update(emails)
+
+    for event in events:
+        if event['channel'] == PREFERENCE_CHANNEL and event.get('preference_type') == 'email':
+            key = (event.get('subscription_type'), canonical_subscription_value(event.get('subscription_value')))
+            affected.setdefault(key, set()).add(event.get('preference_value'))
+
+    return {key: sorted(emails) for key, emails in affected.items()}, changed_codes, changed_industries
+
+
+def run_listener():
+    """
+    Event-driven mode: regenerates and delivers only the reports affected by new disclosures,
+    director trade annotations and preference changes, using NOTIFY_WORKERS report workers.
+    """
+    db = DbUtils()
+    s3 = S3Utils()
+    rag_utils = RagUtils()
+    market_data = MarketDataUtils()
+    # Refreshed on a timer and whenever a company row changes
+    companies = CompanyDirectory(db).start()
+    report_sender = ReportSender()
+    max_workers = int(os.environ.get("NOTIFY_WORKERS", 2))
+    pool = ThreadPoolExecutor(max_workers=max_workers)
+    # Reports being delivered; the value holds the delivery to run next when a newer change arrives meanwhile
+    in_flight = {}
+    in_flight_lock = threading.Lock()
+
+    def deliver(key, report_generator, emails, delivery_formats):
+        try:
+            deliver_email_report(report_generator, report_sender, key[0], key[1], emails,
+                                 delivery_formats=delivery_formats.get(key))
+        except Exception as e:
+            logger.exception(f"Failed to deliver {key[0]} report for {key[1]}: {e}")
+        finally:
+            with in_flight_lock:
+                pending = in_flight.pop(key, None)
+                if pending is not None:
+                    in_flight[key] = None
+            if pending is not None:
+                logger.info(f"Report {key} changed while it was being delivered. Delivering it again.")
+                pool.submit(deliver, key, *pending)
+
+    def handle_change_events(events):
+        company_codes = {event.get('asx_code') for event in events if event['channel'] == COMPANY_CHANNEL}
+        if company_codes:
+            companies.refresh(company_codes)
+        reports, changed_codes, changed_industries = affected_reports(events, db, companies)
+        invalid = invalid_subscriptions(reports, companies)
+        reports = {key: emails for key, emails in reports.items() if key not in invalid}
+        # Cached RAG answers for changed companies and their industries are out of date
+        for asx_code in changed_codes:
+            rag_utils.invalidate(asx_code=asx_code)
+        for industry in changed_industries:
+            rag_utils.invalidate(industry=industry)
+
+        logger.info(f"{len(events)} change events affect {len(reports)} reports.")
+        if not reports:
+            return
+        # Each batch is a new run with its own component cache, so data shared between its reports is fetched
+        # afresh while deliveries from earlier batches keep theirs
+        report_generator = ReportGenerator(s3, db, rag_utils, market_data=market_data, companies=companies)
+        delivery_formats = db.get_delivery_formats()
+        for key, emails in reports.items():
+            with in_flight_lock:
+                if key in in_flight:
+                    # Delivered again with this batch's data once the delivery in progress finishes
+                    logger.info(f"Report {key} is already being delivered. Queued to deliver again.")
+                    in_flight[key] = (report_generator, emails, delivery_formats)
+                    continue
+                in_flight[key] = None
+            pool.submit(deliver, key, report_generator, emails, delivery_formats)
+
+    listener = ChangeListener(db, handle_change_events)
+    if os.environ.get("NOTIFY_INSTALL_TRIGGERS", "False").lower() == "true":
+        listener.install_triggers()
+    try:
+        listener.listen()
+    finally:
+        companies.stop()
+        pool.shutdown(wait=True)
@@ -0,0 +1,152 @@
+import os
+import time
+import uuid
+import shutil
+import hashlib
+from datetime import datetime
+from main.utils.logger_utils import logger
+from main.utils.metrics_utils import metrics
+
+
+def artifact_mode():
+    """'memory' keeps rendered reports in memory between stages; 'disk' (the default) stores them as they render."""
+    return os.environ.get("ARTIFACT_MODE", "disk").lower()
+
+
+def atomic_write(path, data):
+    """Writes data through a uniquely named temporary file and os.replace, so readers never see a partial file."""
+    temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    try:
+        with open(temp_path, "wb") as f:
+            f.write(data)
+        os.replace(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    return path
+
+
+class ArtifactStore:
+    """
+    Stores rendered reports under ARTIFACT_DIR/<run_id>/, one subdirectory per run.
+    File names carry a hash of the content, so concurrent renders of the same report never overwrite
+    each other with different bytes, and identical renders share one file.
+
+    sweep() removes runs older than ARTIFACT_RETENTION_DAYS, then the oldest runs until the store is
+    under ARTIFACT_MAX_BYTES. The current run is never removed.
+    """
+
+    def __init__(self, run_id=None, root=None):
+        self.root = root or os.environ.get("ARTIFACT_DIR", os.path.join(os.getcwd(), 'output', 'runs'))
+        self.run_id = run_id or os.environ.get("RUN_ID") or datetime.now().strftime("%Y-%m-%d")
+        self.retention_days = float(os.environ.get("ARTIFACT_RETENTION_DAYS", 14))
+        self.max_bytes = int(os.environ.get("ARTIFACT_MAX_BYTES", 5 * 1024 ** 3))
+
+    @property
+    def run_dir(self):
+        return os.path.join(self.root, self.run_id)
+
+    def save(self, filename, data):
+        """Writes data under the current run as <name>_<hash><ext> and returns the path."""
+        stem, ext = os.path.splitext(filename)
+        digest = hashlib.sha256(data).hexdigest()[:16]
+        path = os.path.join(self.run_dir, f"{stem}_{digest}{ext}")
+        if os.path.exists(path):
+            return path
+        os.makedirs(self.run_dir, exist_ok=True)
+        return atomic_write(path, data)
+
+    def _runs(self):
+        """Returns [(last_modified, size_bytes, file_count, path)] for every run directory, oldest first."""
+        runs = []
+        try:
+            entries = list(os.scandir(self.root))
+        except FileNotFoundError:
+            return runs
+        for entry in entries:
+            if not entry.is_dir():
+                continue
+            last_modified, size, count = entry.stat().st_mtime, 0, 0
+            for dir_path, _, filenames in os.walk(entry.path):
+                for name in filenames:
+                    try:
+                        stat = os.stat(os.path.join(dir_path, name))
+                    except FileNotFoundError:
+                        continue
+                    last_modified = max(last_modified, stat.st_mtime)
+                    size += stat.st_size
+                    count += 1
+            runs.append((last_modified, size, count, entry.path))
+        return sorted(runs)
+
+    def disk_usage(self):
+        """Returns the number of runs, files and bytes in the store, and the free space on its volume."""
+        runs = self._runs()
+        usage = {
+            'runs': len(runs),
+            'files': sum(run[2] for run in runs),
+            'bytes': sum(run[1] for run in runs),
+            'free_bytes': None,
+        }
+        if os.path.exists(self.root):
+            usage['free_bytes'] = shutil.disk_usage(self.root).free
+        for unit, value in usage.items():
+            if value is not None:
+                metrics.artifact_storage.set(value, unit=unit)
+        return usage
+
+    def sweep(self):
+        """Applies the retention policy and returns what was removed along with the remaining disk usage."""
+        cutoff = time.time() - self.retention_days * 86400
+        all_runs = self._runs()
+        total_bytes = sum(run[1] for run in all_runs)
+        runs = [run for run in all_runs if os.path.basename(run[3]) != self.run_id]
+
+        removed_runs, freed_bytes = 0, 0
+        for last_modified, size, _, path in runs:
+            if last_modified >= cutoff and total_bytes <= self.max_bytes:
+                continue
+            shutil.rmtree(path, ignore_errors=True)
+            removed_runs += 1
+            freed_bytes += size
+            total_bytes -= size
+
+        usage = self.disk_usage()
+        if total_bytes > self.max_bytes:
+            logger.warning(f"Artifact store is over ARTIFACT_MAX_BYTES after sweeping: {usage}")
+        logger.info(f"Swept {removed_runs} artifact runs ({freed_bytes} bytes). Disk usage: {usage}")
+        return {'removed_runs': removed_runs, 'freed_bytes': freed_bytes, **usage}
+
+
+class ReportArtifact:
+    """
+    A rendered report PDF, held in memory, on disk, or both.
+    Stages pass the artifact itself rather than a file name, so in memory mode nothing touches the disk
+    unless the report has to outlive the process (see spill).
+    """
+
+    def __init__(self, filename, pdf_bytes=None, path=None):
+        self.filename = filename
+        self.pdf_bytes = pdf_bytes
+        self.path = path
+
+    def read(self):
+        """Returns the PDF bytes, reading them from disk only if they are not already in memory."""
+        if self.pdf_bytes is None:
+            with open(self.path, "rb") as f:
+                return f.read()
+        return self.pdf_bytes
+
+    def spill(self, store=None):
+        """Saves the PDF to the artifact store (the current run by default) and returns its path."""
+        if not self.path:
+            self.path = (store or ArtifactStore()).save(self.filename, self.pdf_bytes)
+            logger.debug(f"Stored report {self.filename} at {self.path}")
+        return self.path
+
+    def __fspath__(self):
+        # Lets existing callers keep using the artifact as a file path
+        return self.spill()
+
+    def __str__(self):
+        return self.path or self.filename
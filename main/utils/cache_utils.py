@@ -0,0 +1,120 @@
+import os
+import time
+import pickle
+import hashlib
+import threading
+from main.utils.logger_utils import logger
+
+
+def cache_root():
+    return os.environ.get("CACHE_DIR", os.path.join("output", "cache"))
+
+
+def sweep_disk_caches(max_age=None):
+    """
+    Removes the entries of every DiskCache namespace that are older than max_age seconds (default CACHE_MAX_AGE),
+    and any temporary files left by interrupted writes. Returns the number of files removed.
+    """
+    max_age = float(max_age if max_age is not None else os.environ.get("CACHE_MAX_AGE", 86400))
+    cutoff = time.time() - max_age
+    removed = 0
+    for dir_path, _, filenames in os.walk(cache_root()):
+        for name in filenames:
+            path = os.path.join(dir_path, name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+                    removed += 1
+            except FileNotFoundError:
+                continue
+    return removed
+
+
+class DiskCache:
+    """
+    Small pickle-backed cache shared between processes (e.g. a warm-up run and the delivery run).
+    Each entry is stored in its own file under output/cache/<namespace>. Entries older than the cache's max_age
+    are deleted when read, and by sweep_disk_caches after each run.
+    """
+
+    def __init__(self, namespace, max_age=None):
+        self.cache_dir = os.path.join(cache_root(), namespace)
+        self.max_age = float(max_age if max_age is not None else os.environ.get("CACHE_MAX_AGE", 86400))
+        if not os.path.exists(self.cache_dir):
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+    def _path(self, key):
+        digest = hashlib.sha1(key.encode("utf-8")).hexdigest()[:20]
+        return os.path.join(self.cache_dir, f"{digest}.pkl")
+
+    def get(self, key, max_age=None):
+        """Returns the cached value, or None if it is missing or older than max_age seconds."""
+        path = self._path(key)
+        max_age = self.max_age if max_age is None else max_age
+        try:
+            age = time.time() - os.path.getmtime(path)
+            if age > self.max_age:
+                # Expired for every reader, not just this one
+                os.remove(path)
+                return None
+            if age > max_age:
+                return None
+            with open(path, "rb") as f:
+                return pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"Failed to read cache entry {key}: {e}")
+            return None
+
+    def set(self, key, value):
+        """Stores the value atomically so concurrent readers never see a partial file."""
+        path = self._path(key)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(temp_path, "wb") as f:
+                pickle.dump(value, f)
+            os.replace(temp_path, path)
+        except Exception as e:
+            logger.warning(f"Failed to write cache entry {key}: {e}")
+
+    def get_or_set(self, key, fetch, max_age=None):
+        """Returns the cached value, calling fetch() and caching its result on a miss."""
+        value = self.get(key, max_age)
+        if value is None:
+            value = fetch()
+            if value is not None:
+                self.set(key, value)
+        return value
+
+
+class TtlCache:
+    """In-memory cache for short-lived values such as dashboard API responses."""
+
+    def __init__(self, ttl=None, max_entries=1000):
+        self.ttl = float(ttl if ttl is not None else os.environ.get("DASHBOARD_CACHE_TTL", 30))
+        self.max_entries = max_entries
+        self.entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if time.monotonic() > expires_at:
+                del self.entries[key]
+                return None
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            if len(self.entries) >= self.max_entries:
+                # Drop the oldest entry (FIFO)
+                del self.entries[next(iter(self.entries))]
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
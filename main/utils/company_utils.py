@@ -0,0 +1,107 @@
+import os
+import time
+import threading
+from main.utils.logger_utils import logger
+
+
+class CompanyDirectory:
+    """
+    Every company in disclosure.company (ASX code, name, summary and industry), held in memory and keyed by ASX code,
+    so report lookups and subscription validation need no database round trip.
+
+    load() reads the whole table in one query. refresh() compares a fingerprint per company with the one
+    loaded and fetches only the companies that changed; refresh(asx_codes) reloads just those codes, e.g. on a
+    company change notification. start() refreshes on a timer every COMPANY_DIRECTORY_REFRESH_SECONDS.
+    """
+
+    def __init__(self, db, refresh_seconds=None):
+        self.db = db
+        self.refresh_seconds = float(refresh_seconds if refresh_seconds is not None
+                                     else os.environ.get("COMPANY_DIRECTORY_REFRESH_SECONDS", 900))
+        self.companies = {}
+        self.fingerprints = {}
+        self.loaded_at = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    @staticmethod
+    def _normalise(asx_code):
+        return asx_code.strip().upper() if isinstance(asx_code, str) else asx_code
+
+    def _apply(self, rows, removed=()):
+        with self._lock:
+            for asx_code, company_name, company_summary, industry, fingerprint in rows:
+                self.companies[asx_code] = {
+                    'asx_code': asx_code,
+                    'company_name': company_name,
+                    'company_summary': company_summary,
+                    'industry': industry,
+                }
+                self.fingerprints[asx_code] = fingerprint
+            for asx_code in removed:
+                self.companies.pop(asx_code, None)
+                self.fingerprints.pop(asx_code, None)
+            self.loaded_at = time.monotonic()
+
+    def load(self):
+        """Loads every company in one query, replacing what is held."""
+        rows = self.db.get_companies()
+        with self._lock:
+            removed = set(self.companies) - {row[0] for row in rows}
+        self._apply(rows, removed)
+        logger.info(f"Loaded {len(rows)} companies into the company directory.")
+        return len(rows)
+
+    def refresh(self, asx_codes=None):
+        """Fetches only the companies that changed (or asx_codes) and returns how many were updated or removed."""
+        if self.loaded_at is None:
+            return self.load()
+
+        if asx_codes is not None:
+            asx_codes = sorted({self._normalise(asx_code) for asx_code in asx_codes if asx_code})
+            rows = self.db.get_companies(asx_codes) if asx_codes else []
+            removed = set(asx_codes) - {row[0] for row in rows}
+        else:
+            fingerprints = self.db.get_company_fingerprints()
+            with self._lock:
+                changed = sorted(asx_code for asx_code, fingerprint in fingerprints.items()
+                                 if self.fingerprints.get(asx_code) != fingerprint)
+                removed = set(self.companies) - set(fingerprints)
+            rows = self.db.get_companies(changed) if changed else []
+
+        self._apply(rows, removed)
+        if rows or removed:
+            logger.info(f"Refreshed the company directory: {len(rows)} updated, {len(removed)} removed.")
+        return len(rows) + len(removed)
+
+    def ensure_loaded(self):
+        if self.loaded_at is None:
+            self.load()
+        return self
+
+    def get(self, asx_code):
+        """Returns {'asx_code', 'company_name', 'company_summary', 'industry'} for the code, or None if unknown."""
+        self.ensure_loaded()
+        with self._lock:
+            return self.companies.get(self._normalise(asx_code))
+
+    def unknown(self, asx_codes):
+        """Returns the codes that are not in the directory."""
+        self.ensure_loaded()
+        with self._lock:
+            return sorted({asx_code for asx_code in asx_codes if self._normalise(asx_code) not in self.companies})
+
+    def start(self):
+        """Refreshes the directory in a background thread every refresh_seconds until stop()."""
+        def refresh_periodically():
+            while not self._stop.wait(self.refresh_seconds):
+                try:
+                    self.refresh()
+                except Exception as e:
+                    logger.warning(f"Failed to refresh the company directory: {e}")
+
+        threading.Thread(target=refresh_periodically, name="company-directory-refresh", daemon=True).start()
+        return self
+
+    def stop(self):
+        self._stop.set()
@@ -0,0 +1,149 @@
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from main.utils.trace_utils import tracer
+from main.utils.profile_utils import profiler
+
+
+class Component:
+    """
+    A piece of report data (e.g. a company summary or a RAG answer).
+    `fetch` names the method on the graph's target (or is a callable) that computes it from (params, inputs),
+    where inputs holds the values of the components listed in `depends`. `key` names the params that identify a value,
+    so two reports asking for the same component with the same key share one computation.
+    """
+
+    def __init__(self, name, fetch, key=(), depends=()):
+        self.name = name
+        self.fetch = fetch
+        self.key = tuple(key)
+        self.depends = tuple(depends)
+
+    def key_for(self, params):
+        # Dates and datetimes are keyed by day, like the director trades disk cache
+        return (self.name,) + tuple(
+            params.get(name).strftime('%Y-%m-%d') if hasattr(params.get(name), 'strftime') else params.get(name)
+            for name in self.key)
+
+
+class ComponentGraph:
+    """
+    Resolves the components a report declares, together with their dependencies, as a DAG.
+    Components whose dependencies are met run concurrently on up to COMPONENT_WORKERS threads, and each
+    (component, key) is computed once until clear() is called, however many reports ask for it.
+    At most COMPONENT_CACHE_MAX_ENTRIES finished values are kept; the least recently used is dropped first,
+    and is computed again if a later report still needs it.
+    """
+
+    def __init__(self, target, components, factory=None, max_workers=None, max_entries=None):
+        self.target = target
+        self.components = dict(components)
+        self.factory = factory
+        self.max_workers = max_workers or int(os.environ.get("COMPONENT_WORKERS", 4))
+        self.max_entries = int(max_entries or os.environ.get("COMPONENT_CACHE_MAX_ENTRIES", 1000))
+        self._results = OrderedDict()
+        self._lock = threading.Lock()
+
+    def component(self, name):
+        with self._lock:
+            if name not in self.components:
+                if self.factory is None:
+                    raise KeyError(f"Unknown report component: {name}")
+                self.components[name] = self.factory(name)
+            return self.components[name]
+
+    def waves(self, names):
+        """Orders the components and their dependencies into waves; every wave only depends on earlier ones."""
+        needed, pending = {}, list(names)
+        while pending:
+            name = pending.pop()
+            if name not in needed:
+                needed[name] = self.component(name)
+                pending.extend(needed[name].depends)
+
+        waves, done = [], set()
+        while len(done) < len(needed):
+            wave = [name for name, component in needed.items()
+                    if name not in done and set(component.depends) <= done]
+            if not wave:
+                raise ValueError(f"Report components have cyclic dependencies: {sorted(set(needed) - done)}")
+            waves.append(wave)
+            done.update(wave)
+        return waves
+
+    def resolve(self, names, params):
+        """Computes the named components for params and returns {name: value}, including dependencies."""
+        values = {}
+        stages, profile = tracer.context(), profiler.context()
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            for wave in self.waves(names):
+                futures = {name: self._submit(pool, self.component(name), params, values, stages, profile)
+                           for name in wave}
+                for name, future in futures.items():
+                    values[name] = future.result()
+        return values
+
+    def seed(self, name, params, value):
+        """Records a value computed elsewhere (e.g. in bulk), unless the component already has one for this key."""
+        future = Future()
+        future.set_result(value)
+        key = self.component(name).key_for(params)
+        with self._lock:
+            if key not in self._results:
+                self._remember(key, future)
+
+    def has(self, name, params):
+        key = self.component(name).key_for(params)
+        with self._lock:
+            return key in self._results
+
+    def get(self, name, params, default=None):
+        """Returns the value already computed or seeded for this key, waiting for it if it is still running."""
+        key = self.component(name).key_for(params)
+        with self._lock:
+            future = self._results.get(key)
+            if future is not None:
+                self._results.move_to_end(key)
+        return default if future is None else future.result()
+
+    def clear(self):
+        with self._lock:
+            self._results.clear()
+
+    def _submit(self, pool, component, params, values, stages, profile=None):
+        key = component.key_for(params)
+        with self._lock:
+            if key in self._results:
+                self._results.move_to_end(key)
+                return self._results[key]
+            inputs = {name: values[name] for name in component.depends}
+            future = pool.submit(self._compute, component, params, inputs, stages, profile)
+            self._remember(key, future)
+
+        def forget_failure(done):
+            # A failed component is retried by the next report that needs it
+            if done.exception() is not None:
+                with self._lock:
+                    if self._results.get(key) is done:
+                        del self._results[key]
+
+        future.add_done_callback(forget_failure)
+        return future
+
+    def _remember(self, key, future):
+        """Stores a result under the lock, dropping the least recently used finished results over max_entries."""
+        self._results[key] = future
+        if len(self._results) <= self.max_entries:
+            return
+        for old_key in list(self._results):
+            if len(self._results) <= self.max_entries:
+                break
+            # Values still being computed stay, so the reports waiting on them share them
+            if self._results[old_key].done():
+                del self._results[old_key]
+
+    def _compute(self, component, params, inputs, stages, profile=None):
+        fetch = component.fetch if callable(component.fetch) else getattr(self.target, component.fetch)
+        with tracer.attach(stages), profiler.attach(profile):
+            return fetch(params, inputs)
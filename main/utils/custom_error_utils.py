@@ -4,3 +4,15 @@ class DatabaseError(Exception):
 
 class S3Error(Exception):
     pass
+
+
+class ProviderUnavailableError(Exception):
+    pass
+
+
+class MarketDataError(Exception):
+    pass
+
+
+class S3UnavailableError(S3Error):
+    pass
@@ -1,12 +1,73 @@
 import psycopg2
+import psycopg2.extras
+import psycopg2.extensions
 import os
+import time
+import json
+import uuid
+import threading
+from collections import namedtuple
 from main.utils.logger_utils import logger
+from main.utils.metrics_utils import metrics
 from main.utils.custom_error_utils import DatabaseError
+from main.utils.cache_utils import DiskCache
+from main.utils.trace_utils import tracer
 import ast
-import pandas as pd
+
+# How each preference receives its report: the PDF attachment, an inline HTML email, or both
+PREFERENCE_SCHEMA_SQL = """
+SELECT pg_advisory_xact_lock(7215002);
+ALTER TABLE insights.distribution_preferences
+    ADD COLUMN IF NOT EXISTS delivery_format TEXT NOT NULL DEFAULT 'pdf'
+    CHECK (delivery_format IN ('pdf', 'html', 'both'));
+"""
+
+# Default statement_timeout in milliseconds per query class, overridable with DB_STATEMENT_TIMEOUT_<CLASS>_MS
+# (0 disables it): short dashboard and lookup reads, heavy report analytics, and writes.
+STATEMENT_TIMEOUTS_MS = {'read': 30000, 'analytics': 120000, 'write': 60000}
+
+
+# The recipients of one report: every active preference_value for a (preference_type, subscription_type,
+# subscription_value), with recipients as a sorted tuple
+RecipientGroup = namedtuple('RecipientGroup', ['preference_type', 'subscription_type', 'subscription_value',
+                                               'recipients'])
+
+
+def canonical_subscription_value(subscription_value):
+    """
+    Normalises a subscription value so equivalent subscriptions share one report: JSON objects are re-serialised
+    with sorted keys ('{"frequency":7,"asx_code":"BHP"}' and '{"asx_code": "BHP", "frequency": 7}' match),
+    other values (industry names) are only trimmed.
+    """
+    if not isinstance(subscription_value, str):
+        return subscription_value
+    value = subscription_value.strip()
+    if value.startswith('{'):
+        try:
+            return json.dumps(json.loads(value), sort_keys=True)
+        except ValueError:
+            pass
+    return value
+
+
+def statement_timeout_ms(query_class):
+    return int(os.environ.get(f"DB_STATEMENT_TIMEOUT_{query_class.upper()}_MS", STATEMENT_TIMEOUTS_MS[query_class]))
 
 
 class DbUtils:
+    """
+    Writes, and reads that must see them, go to the DB_HOST primary. Read-only methods pass replica=True and
+    go to the first reachable DSN in DB_REPLICA_DSNS, falling back to the primary when no replica connects.
+    A replica that fails to connect is skipped for DB_REPLICA_RETRY_SECONDS, and for
+    DB_PRIMARY_STICKY_SECONDS after a write this process reads from the primary so it sees its own changes.
+    """
+    # Shared by every instance in the process: replicas marked down (DSN -> retry time) and the last write
+    _replica_down = {}
+    _last_write = 0.0
+    _routing_lock = threading.Lock()
+    # SQL types of id columns, (table, column) -> e.g. 'uuid', looked up once so id lists are cast to them
+    _id_types = {}
+
     def __init__(self):
         self.dbname = os.environ.get('DB_NAME')
         self.username = os.environ.get('DB_USER')
@@ -14,19 +75,120 @@ class DbUtils:
         self.host = os.environ.get('DB_HOST')
         self.port = os.environ.get('DB_PORT')
         self.update_count = os.environ.get("UPDATE_COUNT", 5)
+        # Comma separated libpq DSNs or URLs; database, user and password default to the primary's
+        self.replica_dsns = [dsn.strip() for dsn in os.environ.get('DB_REPLICA_DSNS', '').split(',') if dsn.strip()]
+        self.replica_connect_timeout = int(os.environ.get('DB_REPLICA_CONNECT_TIMEOUT', 3))
+        self.replica_retry_seconds = float(os.environ.get('DB_REPLICA_RETRY_SECONDS', 30))
+        self.primary_sticky_seconds = float(os.environ.get('DB_PRIMARY_STICKY_SECONDS', 5))
+
+    def get_connection(self, replica=False, query_class='write'):
+        """Opens a connection with the statement_timeout of query_class, on a replica when replica=True."""
+        if replica and self.replica_dsns:
+            if time.monotonic() - DbUtils._last_write < self.primary_sticky_seconds:
+                metrics.db_connections.inc(role="primary", reason="sticky")
+            else:
+                conn = self._connect_replica(query_class)
+                if conn is not None:
+                    return conn
+                metrics.db_connections.inc(role="primary", reason="fallback")
+        else:
+            metrics.db_connections.inc(role="primary", reason=query_class)
 
-    def get_connection(self):
         conn = psycopg2.connect(
             dbname=self.dbname,
             user=self.username,
             password=self.password,
             host=self.host,
-            port=self.port
+            port=self.port,
+            **self._session_options(query_class)
         )
         return conn
 
-    def select_all(self, query, params=None):
-        conn = self.get_connection()
+    @staticmethod
+    def _session_options(query_class):
+        timeout = statement_timeout_ms(query_class)
+        return {'options': f"-c statement_timeout={timeout}"} if timeout else {}
+
+    def _connect_replica(self, query_class):
+        """Returns a connection to the first healthy replica, or None when every replica is down."""
+        for dsn in self.replica_dsns:
+            with DbUtils._routing_lock:
+                if DbUtils._replica_down.get(dsn, 0) > time.monotonic():
+                    continue
+            # The DSN's own settings win, except that the session options are appended to any options it sets
+            params = {'dbname': self.dbname, 'user': self.username, 'password': self.password,
+                      'connect_timeout': self.replica_connect_timeout, **psycopg2.extensions.parse_dsn(dsn)}
+            session_options = self._session_options(query_class).get('options')
+            if session_options:
+                params['options'] = f"{params.get('options', '')} {session_options}".strip()
+            try:
+                conn = psycopg2.connect(**params)
+            except psycopg2.OperationalError as e:
+                logger.warning(f"Replica {params.get('host')}:{params.get('port', 5432)} is unavailable, "
+                               f"skipping it for {self.replica_retry_seconds}s: {e}")
+                with DbUtils._routing_lock:
+                    DbUtils._replica_down[dsn] = time.monotonic() + self.replica_retry_seconds
+                continue
+            metrics.db_connections.inc(role="replica", reason=query_class)
+            return conn
+        logger.warning("No read replica is reachable. Reading from the primary.")
+        return None
+
+    @staticmethod
+    def _mark_write():
+        DbUtils._last_write = time.monotonic()
+
+    def ensure_preference_schema(self):
+        """
+        Adds the delivery_format column to distribution_preferences if it is missing and returns True when it did.
+        The column is looked up first: ALTER TABLE takes an ACCESS EXCLUSIVE lock even when there is nothing to add.
+        """
+        exists = self.select_all(
+            "SELECT 1 FROM information_schema.columns WHERE table_schema = 'insights' "
+            "AND table_name = 'distribution_preferences' AND column_name = 'delivery_format';")
+        if exists:
+            return False
+        self.execute(PREFERENCE_SCHEMA_SQL)
+        return True
+
+    def id_type(self, table, column):
+        """Returns the SQL type of an id column, e.g. 'uuid' or 'integer', to cast parameters to."""
+        key = (table, column)
+        if key not in DbUtils._id_types:
+            rows = self.select_all(
+                "SELECT format_type(atttypid, atttypmod) FROM pg_attribute WHERE attrelid = %s::regclass AND attname = %s;",
+                (table, column), replica=True)
+            DbUtils._id_types[key] = rows[0][0]
+        return DbUtils._id_types[key]
+
+    @staticmethod
+    def normalise_id(value, id_type):
+        """
+        Returns an id as the string Postgres would print for id_type (e.g. a lower-case UUID), or None when it is
+        not a valid value of that type.
+        """
+        value = str(value).strip()
+        try:
+            if id_type == 'uuid':
+                return str(uuid.UUID(value))
+            if id_type in ('smallint', 'integer', 'bigint'):
+                return str(int(value))
+        except ValueError:
+            return None
+        return value
+
+    @staticmethod
+    def valid_ids(ids, id_type):
+        """
+        Returns the ids normalised with normalise_id, leaving out values that are not valid for id_type, so casting
+        the list to the column's type cannot fail on one bad id.
+        """
+        normalised = (DbUtils.normalise_id(value, id_type) for value in ids)
+        return list(dict.fromkeys(value for value in normalised if value is not None))
+
+    @tracer.traced("db.select")
+    def select_all(self, query, params=None, replica=False, query_class='read'):
+        conn = self.get_connection(replica=replica, query_class=query_class)
         cur = conn.cursor()
         cur.execute(query, params)
         sql_results = cur.fetchall()
@@ -34,6 +196,7 @@ class DbUtils:
         conn.close()
         return sql_results
 
+    @tracer.traced("db.execute")
     def execute(self, query, params=None):
         """
         Execute an INSERT, UPDATE, or DELETE query.
@@ -43,6 +206,7 @@ class DbUtils:
         try:
             cur.execute(query, params)
             conn.commit()  # Commit the changes
+            self._mark_write()
         except Exception as e:
             conn.rollback()  # Rollback in case of error
             raise e
@@ -50,6 +214,47 @@ class DbUtils:
             cur.close()
             conn.close()
 
+    @tracer.traced("db.execute_values")
+    def execute_values(self, query, rows, template=None, page_size=1000, fetch=False):
+        """
+        Execute a multi-row INSERT or UPDATE with psycopg2's execute_values in a single transaction.
+        Returns the RETURNING rows when fetch is True, otherwise the number of rows in the batch.
+        """
+        conn = self.get_connection()
+        cur = conn.cursor()
+        try:
+            results = psycopg2.extras.execute_values(cur, query, rows, template=template, page_size=page_size,
+                                                     fetch=fetch)
+            conn.commit()
+            self._mark_write()
+            return results if fetch else len(rows)
+        except Exception as e:
+            conn.rollback()
+            raise e
+        finally:
+            cur.close()
+            conn.close()
+
+    @tracer.traced("db.execute")
+    def execute_returning(self, query, params=None):
+        """
+        Execute an INSERT, UPDATE, or DELETE query with a RETURNING clause and return its rows.
+        """
+        conn = self.get_connection()
+        cur = conn.cursor()
+        try:
+            cur.execute(query, params)
+            results = cur.fetchall()
+            conn.commit()
+            self._mark_write()
+            return results
+        except Exception as e:
+            conn.rollback()
+            raise e
+        finally:
+            cur.close()
+            conn.close()
+
     def get_external_ids(self):
         logger.info("Getting External Ids...")
         query = f"""SELECT d.external_id, dd.document_url, d.disclosure_id
@@ -85,6 +290,7 @@ class DbUtils:
             raise DatabaseError("No Document Urls found in db for the given external ids!!")
         return sql_results
 
+    @tracer.traced("db.director_trades")
     def get_director_trades(self, asx_code=None, date_from=None, date_to=None):
         logger.info(f"Fetching director trades for ASX code: {asx_code if asx_code else 'All companies'}, from date: {date_from if date_from else 'No start date'}, to date: {date_to if date_to else 'No end date'}...")
 
@@ -127,12 +333,19 @@ class DbUtils:
             WHERE rn = 1;
         """
 
-        sql_results = self.select_all(query, tuple(params))
+        sql_results = self.select_all(query, tuple(params), replica=True, query_class='analytics')
 
         if not sql_results:
             logger.info(f"No director trades found in the database for the given criteria!")
             return None
 
+        return self._director_trades_frame(sql_results)
+
+    @staticmethod
+    def _director_trades_frame(sql_results):
+        """Expands (external_id, structured_text) rows into a DataFrame with one column per trade attribute."""
+        import pandas as pd
+
         # Create a DataFrame from the results
         df = pd.DataFrame(sql_results, columns=['external_id', 'structured_text'])
 
@@ -152,8 +365,115 @@ class DbUtils:
         ]
         return result_df
 
+    def get_director_trades_cached(self, asx_code=None, date_from=None, date_to=None, max_age=None):
+        """
+        Same as get_director_trades, cached on disk per ASX code and day range
+        so a warm-up run can prefetch the data ahead of the delivery window.
+        """
+        def day(value):
+            return value.strftime('%Y-%m-%d') if hasattr(value, 'strftime') else value
+
+        cache_key = f"{asx_code}|{day(date_from)}|{day(date_to)}"
+        return DiskCache("director_trades").get_or_set(
+            cache_key,
+            lambda: self.get_director_trades(asx_code=asx_code, date_from=date_from, date_to=date_to),
+            max_age=max_age
+        )
+
+    @tracer.traced("db.industry_data")
+    def get_industry_data(self, industry, days=7):
+        """
+        Fetches everything the industry report needs in one set-based query: the member companies,
+        their disclosures and their director trades over the last `days` days.
+        Returns {'industry', 'members': [{asx_code, company_name, company_summary, disclosures}],
+        'director_trades': DataFrame or None}, with director trades tagged by an 'ASX Code' column.
+        """
+        logger.info(f"Fetching industry data for {industry} over the last {days} days...")
+        query = """
+            WITH members AS (
+                SELECT company_id, asx_code, company_name, company_summary
+                FROM disclosure.company
+                WHERE industry = %s
+            ),
+            recent_disclosures AS (
+                SELECT d.company_id,
+                       json_agg(json_build_object('external_id', d.external_id,
+                                                  'publish_date', d.publish_date,
+                                                  'document_url', dd.document_url)
+                                ORDER BY d.publish_date DESC) AS disclosures
+                FROM disclosure.disclosure AS d
+                INNER JOIN members AS m ON d.company_id = m.company_id
+                LEFT JOIN disclosure.disclosure_document AS dd ON d.disclosure_id = dd.disclosure_id
+                WHERE d.publish_date >= now() - make_interval(days => %s)
+                GROUP BY d.company_id
+            ),
+            latest_trades AS (
+                SELECT DISTINCT ON (d.disclosure_id) d.company_id, daa.external_id, daa.structured_text
+                FROM disclosure.disclosure_attributes_annotations AS daa
+                INNER JOIN disclosure.disclosure AS d
+                    ON daa.disclosure_id = d.disclosure_id
+                    AND daa.attribute_id = '47bcf56f-19bf-403f-b491-21493f72b16c'
+                INNER JOIN members AS m ON d.company_id = m.company_id
+                WHERE d.publish_date >= now() - make_interval(days => %s)
+                ORDER BY d.disclosure_id, daa.run_date DESC
+            ),
+            trades AS (
+                SELECT company_id, json_agg(json_build_array(external_id, structured_text)) AS trades
+                FROM latest_trades
+                GROUP BY company_id
+            )
+            SELECT m.asx_code, m.company_name, m.company_summary,
+                   COALESCE(rd.disclosures, '[]'::json), COALESCE(t.trades, '[]'::json)
+            FROM members AS m
+            LEFT JOIN recent_disclosures AS rd ON m.company_id = rd.company_id
+            LEFT JOIN trades AS t ON m.company_id = t.company_id
+            ORDER BY m.asx_code;
+        """
+        sql_results = self.select_all(query, (industry, days, days), replica=True, query_class='analytics')
+        if not sql_results:
+            logger.info(f"No companies found in the database for industry: {industry}!")
+            raise DatabaseError(f"No companies found in the database for industry: {industry}!")
+
+        members, trade_rows, trade_codes = [], [], []
+        for asx_code, company_name, company_summary, disclosures, trades in sql_results:
+            members.append({
+                'asx_code': asx_code,
+                'company_name': company_name,
+                'company_summary': company_summary,
+                'disclosures': disclosures,
+            })
+            trade_rows.extend((external_id, structured_text) for external_id, structured_text in trades)
+            trade_codes.extend([asx_code] * len(trades))
 
+        director_trades = None
+        if trade_rows:
+            director_trades = self._director_trades_frame(trade_rows)
+            director_trades.insert(0, 'ASX Code', trade_codes)
+        return {'industry': industry, 'members': members, 'director_trades': director_trades}
 
+    @tracer.traced("db.companies")
+    def get_companies(self, asx_codes=None):
+        """
+        Returns [(asx_code, company_name, company_summary, industry, fingerprint)] for every company, or only for
+        asx_codes. The fingerprint changes whenever the name, summary or industry does (see CompanyDirectory.refresh).
+        """
+        query = """
+            SELECT asx_code, company_name, company_summary, industry,
+                   md5(concat_ws('|', company_name, company_summary, industry)) AS fingerprint
+            FROM disclosure.company
+            WHERE %s::text[] IS NULL OR asx_code = ANY(%s::text[]);
+        """
+        return self.select_all(query, (asx_codes, asx_codes), replica=True, query_class='analytics')
+
+    def get_company_fingerprints(self):
+        """Returns {asx_code: fingerprint} for every company, without the summaries."""
+        query = """
+            SELECT asx_code, md5(concat_ws('|', company_name, company_summary, industry))
+            FROM disclosure.company;
+        """
+        return dict(self.select_all(query, replica=True))
+
+    @tracer.traced("db.company_summary")
     def get_company_summary(self, asx_code):
         logger.info(f"Fetching disclosure summary for ASX code: {asx_code}...")
         query = """
@@ -161,7 +481,7 @@ class DbUtils:
             FROM disclosure.company 
             WHERE asx_code = %s;
         """
-        sql_results = self.select_all(query, (asx_code,))
+        sql_results = self.select_all(query, (asx_code,), replica=True)
         if not sql_results:
             logger.info(f"No disclosures found in the database for ASX code: {asx_code}!")
             raise DatabaseError(f"No disclosures found in the database for ASX code: {asx_code}!")
@@ -175,55 +495,84 @@ class DbUtils:
         }
         return result_dict
 
-    def get_distribution_lists_by_subscription(self):
-        logger.info("Fetching distribution lists by preference type and subscription type...")
+    def get_recipient_groups(self, subscription_types=None, preference_types=None):
+        """
+        Returns a RecipientGroup per active report, optionally limited to subscription_types and preference_types.
+        Recipients are aggregated by the database; the few groups whose values differ only in JSON formatting are
+        then merged under canonical_subscription_value. Returns an empty list when there are no active preferences.
+        """
         query = """
-            SELECT dp.preference_type, dp.preference_value, dp.subscription_type, dp.subscription_value
+            SELECT dp.preference_type, dp.subscription_type, dp.subscription_value,
+                   array_agg(DISTINCT dp.preference_value) AS recipients
             FROM insights.customers c
             JOIN insights.distribution_preferences dp ON c.customer_id = dp.customer_id
             WHERE dp.is_active = TRUE
-            ORDER BY dp.preference_type, dp.subscription_type;
+              AND (%s::text[] IS NULL OR dp.subscription_type = ANY(%s::text[]))
+              AND (%s::text[] IS NULL OR dp.preference_type = ANY(%s::text[]))
+            GROUP BY dp.preference_type, dp.subscription_type, dp.subscription_value;
         """
-        sql_results = self.select_all(query)
-        if not sql_results:
-            logger.info("No active distribution lists found in the database!")
-            raise DatabaseError("No active distribution lists found in the database!")
+        subscription_types = list(subscription_types) if subscription_types is not None else None
+        preference_types = list(preference_types) if preference_types is not None else None
+        rows = self.select_all(query, (subscription_types, subscription_types, preference_types, preference_types),
+                               replica=True)
+
+        grouped = {}
+        for preference_type, subscription_type, subscription_value, recipients in rows:
+            key = (preference_type, subscription_type, canonical_subscription_value(subscription_value))
+            grouped.setdefault(key, set()).update(recipients)
+        return [RecipientGroup(*key, tuple(sorted(recipients))) for key, recipients in sorted(grouped.items())]
+
+    def get_distribution_lists_by_subscription(self, subscription_types=None, preference_types=None):
+        """
+        Returns {preference_type: {subscription_type: {subscription_value: [recipients]}}} built from
+        get_recipient_groups, or {} when there are no active preferences.
+        """
+        logger.info("Fetching distribution lists by preference type and subscription type...")
+        groups = self.get_recipient_groups(subscription_types, preference_types)
+        if not groups:
+            logger.info("No active distribution lists found in the database.")
+            return {}
 
-        # Grouping by preference_type, then subscription_type, then subscription_value
         distribution_lists = {}
-        for row in sql_results:
-            preference_type = row[0]
-            preference_value = row[1]
-            subscription_type = row[2]
-            subscription_value = row[3]
-
-            if preference_type not in distribution_lists:
-                distribution_lists[preference_type] = {}
-
-            if subscription_type not in distribution_lists[preference_type]:
-                distribution_lists[preference_type][subscription_type] = {}
-
-            if subscription_value not in distribution_lists[preference_type][subscription_type]:
-                distribution_lists[preference_type][subscription_type][subscription_value] = []
+        for group in groups:
+            distribution_lists.setdefault(group.preference_type, {}).setdefault(group.subscription_type, {})[
+                group.subscription_value] = list(group.recipients)
 
-            # Add the preference_value (e.g., email) under the correct subscription_value
-            distribution_lists[preference_type][subscription_type][subscription_value].append(preference_value)
-
-        print (distribution_lists)
+        logger.info("Loaded distribution lists for %d reports and %d recipients.", len(groups),
+                    sum(len(group.recipients) for group in groups))
+        logger.debug("Distribution lists: %s", distribution_lists)
         return distribution_lists
 
+    def get_delivery_formats(self):
+        """
+        Returns {(subscription_type, subscription_value): {email: delivery_format}} for active email
+        preferences that don't use the default PDF delivery.
+        """
+        query = """
+            SELECT dp.subscription_type, dp.subscription_value, dp.preference_value, dp.delivery_format
+            FROM insights.distribution_preferences dp
+            WHERE dp.is_active = TRUE
+              AND dp.preference_type = 'email'
+              AND dp.delivery_format <> 'pdf';
+        """
+        delivery_formats = {}
+        for subscription_type, subscription_value, email, delivery_format in self.select_all(query):
+            key = (subscription_type, canonical_subscription_value(subscription_value))
+            delivery_formats.setdefault(key, {})[email] = delivery_format
+        return delivery_formats
+
     def get_distribution_preferences(self):
         logger.info("Fetching distribution lists by preference type and subscription type...")
 
         query = """
-            SELECT CONCAT(c.first_name, ' ', c.last_name) as customer_name, dp.preference_id, dp.customer_id, dp.preference_type, dp.preference_value, dp.is_active, dp.subscription_type, dp.subscription_value
+            SELECT CONCAT(c.first_name, ' ', c.last_name) as customer_name, dp.preference_id, dp.customer_id, dp.preference_type, dp.preference_value, dp.is_active, dp.subscription_type, dp.subscription_value, dp.delivery_format
             FROM insights.distribution_preferences dp 
             INNER JOIN insights.customers c
             ON dp.customer_id = c.customer_id
             ORDER BY dp.preference_id;
         """
 
-        sql_results = self.select_all(query)
+        sql_results = self.select_all(query, replica=True)
 
         if not sql_results:
             logger.info("No customer preference lists found in the database!")
@@ -241,12 +590,72 @@ class DbUtils:
                 "preference_value": row[4],
                 "is_active": row[5],
                 "subscription_type": row[6],
-                "subscription_value": row[7]
+                "subscription_value": row[7],
+                "delivery_format": row[8]
             })
 
         return distribution_lists
 
 
+    def get_distribution_preferences_page(self, after_id=None, limit=100, customer_id=None,
+                                          subscription_type=None, is_active=None):
+        """
+        Returns one page of distribution preferences ordered by preference_id, using keyset pagination.
+        Pass the returned next_after as after_id to fetch the following page (None when there are no more rows).
+        """
+        query = """
+            SELECT CONCAT(c.first_name, ' ', c.last_name) as customer_name, dp.preference_id, dp.customer_id, dp.preference_type, dp.preference_value, dp.is_active, dp.subscription_type, dp.subscription_value, dp.delivery_format
+            FROM insights.distribution_preferences dp 
+            INNER JOIN insights.customers c
+            ON dp.customer_id = c.customer_id
+            WHERE (%s IS NULL OR dp.preference_id > %s)
+              AND (%s IS NULL OR dp.customer_id = %s)
+              AND (%s IS NULL OR dp.subscription_type = %s)
+              AND (%s IS NULL OR dp.is_active = %s)
+            ORDER BY dp.preference_id
+            LIMIT %s;
+        """
+        # Fetch one extra row to know whether another page follows
+        params = (after_id, after_id, customer_id, customer_id, subscription_type, subscription_type,
+                  is_active, is_active, limit + 1)
+        sql_results = self.select_all(query, params, replica=True)
+
+        preferences = [{
+            "customer_name": row[0],
+            "preference_id": row[1],
+            "customer_id": row[2],
+            "preference_type": row[3],
+            "preference_value": row[4],
+            "is_active": row[5],
+            "subscription_type": row[6],
+            "subscription_value": row[7],
+            "delivery_format": row[8]
+        } for row in sql_results[:limit]]
+
+        next_after = preferences[-1]["preference_id"] if len(sql_results) > limit else None
+        return {"items": preferences, "next_after": next_after}
+
+    def get_customers_page(self, after_id=None, limit=100):
+        """Returns one page of customers ordered by customer_id, using keyset pagination."""
+        query = """
+            SELECT c.customer_id, c.first_name, c.last_name, c.email
+            FROM insights.customers c 
+            WHERE (%s IS NULL OR c.customer_id > %s)
+            ORDER BY c.customer_id
+            LIMIT %s;
+        """
+        sql_results = self.select_all(query, (after_id, after_id, limit + 1), replica=True)
+
+        customers = [{
+            "customer_id": row[0],
+            "first_name": row[1],
+            "last_name": row[2],
+            "email": row[3]
+        } for row in sql_results[:limit]]
+
+        next_after = customers[-1]["customer_id"] if len(sql_results) > limit else None
+        return {"items": customers, "next_after": next_after}
+
     def get_customers(self):
         logger.info("Fetching distribution lists by preference type and subscription type...")
 
@@ -256,7 +665,7 @@ class DbUtils:
             ORDER BY c.customer_id;
         """
 
-        sql_results = self.select_all(query)
+        sql_results = self.select_all(query, replica=True)
 
         if not sql_results:
             logger.info("No customers found in the database!")
@@ -298,7 +707,8 @@ class DbUtils:
 
         return new_status
 
-    def update_preference(self, preference_id, preference_type, preference_value, subscription_type, subscription_value, is_active):
+    def update_preference(self, preference_id, preference_type, preference_value, subscription_type, subscription_value, is_active,
+                          delivery_format='pdf'):
         """
         Updates the distribution_preferences table with the new values.
         """
@@ -308,10 +718,12 @@ class DbUtils:
                 preference_value = %s,
                 subscription_type = %s,
                 subscription_value = %s,
-                is_active = %s
+                is_active = %s,
+                delivery_format = %s
             WHERE preference_id = %s;
         """
-        params = (preference_type, preference_value, subscription_type, subscription_value, is_active, preference_id)
+        params = (preference_type, preference_value, subscription_type, subscription_value, is_active, delivery_format,
+                  preference_id)
 
         try:
             self.execute(query, params)
@@ -338,12 +750,14 @@ class DbUtils:
             raise
 
 
-    def insert_new_subscription(self, customer_id, preference_type, preference_value, subscription_type, subscription_value, is_active):
+    def insert_new_subscription(self, customer_id, preference_type, preference_value, subscription_type, subscription_value, is_active,
+                                delivery_format='pdf'):
         query = """
-            INSERT INTO insights.distribution_preferences (customer_id, preference_type, preference_value, subscription_type, subscription_value, is_active)
-            VALUES (%s, %s, %s, %s, %s, %s)
+            INSERT INTO insights.distribution_preferences (customer_id, preference_type, preference_value, subscription_type, subscription_value, is_active, delivery_format)
+            VALUES (%s, %s, %s, %s, %s, %s, %s)
         """
-        params = (customer_id, preference_type, preference_value, subscription_type, subscription_value, is_active)
+        params = (customer_id, preference_type, preference_value, subscription_type, subscription_value, is_active,
+                  delivery_format)
         self.execute(query, params)
 
     def add_customer(self, first_name, last_name, email):
@@ -367,3 +781,75 @@ class DbUtils:
         except Exception as e:
             logger.error(f"Failed to add customer {first_name} {last_name}: {e}")
             return {'success': False, 'message': f"An error occurred while adding the customer: {e}"}
+
+    def bulk_insert_subscriptions(self, numbered_rows):
+        """
+        Inserts many distribution preferences in a single transaction.
+        Takes (row_number, values) pairs with values in insert_new_subscription order,
+        and returns (inserted_count, errors) where rows for unknown customers are reported as errors.
+        """
+        if not numbered_rows:
+            return 0, []
+
+        # Cast the ids rather than the column, so the lookup uses the primary key index
+        id_type = self.id_type('insights.customers', 'customer_id')
+        customer_ids = self.valid_ids({values[0] for _, values in numbered_rows}, id_type)
+        known_ids = {self.normalise_id(row[0], id_type) for row in self.select_all(
+            f"SELECT customer_id FROM insights.customers WHERE customer_id = ANY(%s::{id_type}[]);", (customer_ids,))}
+
+        rows, errors = [], []
+        for row_number, values in numbered_rows:
+            # Compared in canonical form, so e.g. an upper-case UUID in the upload still matches
+            customer_id = self.normalise_id(values[0], id_type)
+            if customer_id in known_ids:
+                rows.append((customer_id,) + tuple(values[1:]))
+            else:
+                errors.append({"row": row_number, "error": f"Unknown customer_id: {values[0]}"})
+
+        if rows:
+            query = """
+                INSERT INTO insights.distribution_preferences (customer_id, preference_type, preference_value, subscription_type, subscription_value, is_active, delivery_format)
+                VALUES %s
+                RETURNING preference_id
+            """
+            inserted = len(self.execute_values(query, rows, fetch=True))
+        else:
+            inserted = 0
+        logger.info(f"Bulk inserted {inserted} subscriptions ({len(errors)} rows rejected).")
+        return inserted, errors
+
+    def bulk_add_customers(self, numbered_rows):
+        """
+        Inserts many customers in a single transaction, skipping emails that already exist.
+        Returns (inserted_count, errors) where existing emails are reported as errors.
+        """
+        if not numbered_rows:
+            return 0, []
+
+        query = """
+            INSERT INTO insights.customers (first_name, last_name, email)
+            VALUES %s
+            ON CONFLICT (email) DO NOTHING
+            RETURNING email
+        """
+        inserted_emails = {row[0] for row in self.execute_values(query, [values for _, values in numbered_rows],
+                                                                 fetch=True)}
+        errors = [{"row": row_number, "error": f"Email {values[2]} already exists."}
+                  for row_number, values in numbered_rows if values[2] not in inserted_emails]
+        logger.info(f"Bulk added {len(inserted_emails)} customers ({len(errors)} already existed).")
+        return len(inserted_emails), errors
+
+    def bulk_set_preferences_active(self, preference_ids, is_active):
+        """
+        Sets is_active for many preferences in one statement. Returns the ids that were updated.
+        """
+        id_type = self.id_type('insights.distribution_preferences', 'preference_id')
+        query = f"""
+            UPDATE insights.distribution_preferences
+            SET is_active = %s
+            WHERE preference_id = ANY(%s::{id_type}[])
+            RETURNING preference_id;
+        """
+        updated = [row[0] for row in self.execute_returning(query, (is_active, self.valid_ids(preference_ids, id_type)))]
+        logger.info(f"Set is_active={is_active} on {len(updated)} preferences.")
+        return updated
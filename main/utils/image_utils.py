@@ -0,0 +1,102 @@
+import io
+import os
+import base64
+import functools
+from main.utils.logger_utils import logger
+
+IMAGE_FORMATS = ('png', 'jpeg', 'webp', 'auto')
+
+
+def optimisation_enabled():
+    return os.environ.get("IMAGE_OPTIMISE", "True").lower() == "true"
+
+
+def image_settings():
+    """
+    Returns (format, max_width, quality, colours) for optimised report images.
+    The reports display images at most 400px wide (the stock chart), so the default width keeps 2x for print.
+    """
+    image_format = os.environ.get("IMAGE_FORMAT", "png").lower()
+    if image_format not in IMAGE_FORMATS:
+        logger.warning(f"Unknown IMAGE_FORMAT {image_format}, using png.")
+        image_format = 'png'
+    return (image_format, int(os.environ.get("IMAGE_MAX_WIDTH", 800)), int(os.environ.get("IMAGE_QUALITY", 80)),
+            int(os.environ.get("IMAGE_COLOURS", 256)))
+
+
+def pdf_options():
+    """wkhtmltopdf options that downsample and recompress the images embedded in the PDF."""
+    return {
+        'image-dpi': os.environ.get("PDF_IMAGE_DPI", "150"),
+        'image-quality': os.environ.get("PDF_IMAGE_QUALITY", "80"),
+    }
+
+
+def _encode(img, image_format, quality, colours):
+    from PIL import Image
+
+    buffer = io.BytesIO()
+    if image_format == 'png':
+        if img.mode not in ('RGB', 'RGBA'):
+            img = img.convert('RGBA')
+        # Fast octree is the quantiser that keeps the alpha channel
+        img.quantize(colors=colours, method=Image.Quantize.FASTOCTREE).save(buffer, format='PNG', optimize=True)
+    elif image_format == 'jpeg':
+        img.convert('RGB').save(buffer, format='JPEG', quality=quality, optimize=True, progressive=True)
+    else:
+        img.save(buffer, format='WEBP', quality=quality, method=6)
+    return buffer.getvalue()
+
+
+@functools.lru_cache(maxsize=64)
+def optimise_image(image_bytes, image_format='png', max_width=800, quality=80, colours=256):
+    """
+    Downsamples an image to max_width and re-encodes it as a quantised PNG, JPEG or WebP.
+    'auto' picks the smaller of PNG and JPEG (JPEG only for opaque images). Returns (bytes, subtype), or
+    (original bytes, None) when the image cannot be decoded or the result would not be smaller.
+    Results are cached by content, so an image shared by many reports (the DHI logo) is optimised once.
+    """
+    from PIL import Image
+
+    try:
+        with Image.open(io.BytesIO(image_bytes)) as img:
+            img.load()
+            if img.width > max_width:
+                img = img.resize((max_width, round(img.height * max_width / img.width)), Image.LANCZOS)
+
+            if image_format == 'auto':
+                opaque = img.mode in ('RGB', 'L') or (img.mode == 'RGBA' and img.getextrema()[3][0] == 255)
+                candidates = [(_encode(img, 'png', quality, colours), 'png')]
+                if opaque:
+                    candidates.append((_encode(img, 'jpeg', quality, colours), 'jpeg'))
+                optimised = min(candidates, key=lambda candidate: len(candidate[0]))
+            else:
+                optimised = (_encode(img, image_format, quality, colours), image_format)
+    except Exception as e:
+        logger.warning(f"Could not optimise image, keeping the original: {e}")
+        return image_bytes, None
+
+    if len(optimised[0]) >= len(image_bytes):
+        return image_bytes, None
+    return optimised
+
+
+def optimise_data_uris(html, pattern):
+    """
+    Replaces every base64 image data URI matched by pattern (groups: subtype, data) with its optimised version.
+    Each distinct image is optimised once per document, however often it appears.
+    Returns (html, bytes_before, bytes_after).
+    """
+    settings = image_settings()
+    replacements = {}
+
+    def replace(match):
+        data = match.group(2)
+        if data not in replacements:
+            image_bytes, subtype = optimise_image(base64.b64decode(data), *settings)
+            replacements[data] = match.group(0) if subtype is None else \
+                f'src="data:image/{subtype};base64,{base64.b64encode(image_bytes).decode("utf-8")}"'
+        return replacements[data]
+
+    optimised = pattern.sub(replace, html)
+    return optimised, len(html.encode('utf-8')), len(optimised.encode('utf-8'))
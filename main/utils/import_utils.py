@@ -0,0 +1,123 @@
+import io
+import re
+import csv
+import json
+
+# How a subscriber receives reports; run_subscriptions delivers each of these
+PREFERENCE_TYPES = ('email', 'api', 'rss')
+DELIVERY_FORMATS = ('pdf', 'html', 'both')
+SUBSCRIPTION_FIELDS = ('customer_id', 'preference_type', 'preference_value', 'subscription_type',
+                       'subscription_value', 'is_active', 'delivery_format')
+OPTIONAL_SUBSCRIPTION_FIELDS = ('is_active', 'delivery_format')
+CUSTOMER_FIELDS = ('first_name', 'last_name', 'email')
+EMAIL_PATTERN = re.compile(r"^[^@\s]+@[^@\s]+\.[^@\s]+$")
+
+
+def parse_rows(content, file_format):
+    """
+    Parses an uploaded CSV (with a header row) or JSONL document into a list of dictionaries.
+    Lines that are not valid JSON are returned as {'_error': ...} so they can be reported per row.
+    """
+    if isinstance(content, bytes):
+        content = content.decode("utf-8-sig")
+
+    if file_format == "csv":
+        return [dict(row) for row in csv.DictReader(io.StringIO(content))]
+    if file_format == "jsonl":
+        rows = []
+        for line in content.splitlines():
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+                rows.append(row if isinstance(row, dict) else {"_error": "Each line must be a JSON object"})
+            except json.JSONDecodeError as e:
+                rows.append({"_error": f"Invalid JSON: {e}"})
+        return rows
+    raise ValueError(f"Unsupported file format: {file_format}")
+
+
+def parse_bool(value):
+    if isinstance(value, bool):
+        return value
+    if str(value).strip().lower() in ('true', '1', 'yes', 'y'):
+        return True
+    if str(value).strip().lower() in ('false', '0', 'no', 'n', ''):
+        return False
+    raise ValueError(f"Invalid boolean value: {value}")
+
+
+def validate_subscription_rows(rows, report_ids):
+    """
+    Validates subscription rows before a bulk insert.
+    Returns (valid_rows, errors) where valid_rows are tuples in SUBSCRIPTION_FIELDS order
+    and errors are {'row': <1-based row number>, 'error': <message>} dictionaries.
+    """
+    valid_rows, errors = [], []
+    for row_number, row in enumerate(rows, start=1):
+        if "_error" in row:
+            errors.append({"row": row_number, "error": row["_error"]})
+            continue
+
+        missing = [field for field in SUBSCRIPTION_FIELDS
+                   if field not in OPTIONAL_SUBSCRIPTION_FIELDS and not str(row.get(field) or '').strip()]
+        if missing:
+            errors.append({"row": row_number, "error": f"Missing fields: {', '.join(missing)}"})
+            continue
+
+        preference_type = str(row['preference_type']).strip().lower()
+        preference_value = str(row['preference_value']).strip()
+        subscription_type = str(row['subscription_type']).strip()
+        if preference_type not in PREFERENCE_TYPES:
+            errors.append({"row": row_number, "error": f"Unknown preference type: {preference_type}"})
+            continue
+        if preference_type == 'email' and not EMAIL_PATTERN.match(preference_value):
+            errors.append({"row": row_number, "error": f"Invalid email address: {preference_value}"})
+            continue
+        if subscription_type not in report_ids:
+            errors.append({"row": row_number, "error": f"Unknown subscription type: {subscription_type}"})
+            continue
+        try:
+            # Optional: a missing column, a blank CSV cell or a JSON null means active
+            is_active = row.get('is_active')
+            is_active = True if is_active is None or str(is_active).strip() == '' else parse_bool(is_active)
+        except ValueError as e:
+            errors.append({"row": row_number, "error": str(e)})
+            continue
+        delivery_format = str(row.get('delivery_format') or 'pdf').strip().lower()
+        if delivery_format not in DELIVERY_FORMATS:
+            errors.append({"row": row_number, "error": f"Unknown delivery format: {delivery_format}"})
+            continue
+
+        subscription_value = row['subscription_value']
+        if not isinstance(subscription_value, str):
+            subscription_value = json.dumps(subscription_value)
+
+        valid_rows.append((row_number, (str(row['customer_id']).strip(), preference_type, preference_value,
+                                        subscription_type, subscription_value.strip(), is_active, delivery_format)))
+    return valid_rows, errors
+
+
+def validate_customer_rows(rows):
+    """Validates customer rows before a bulk insert. Returns (valid_rows, errors) like validate_subscription_rows."""
+    valid_rows, errors, seen_emails = [], [], set()
+    for row_number, row in enumerate(rows, start=1):
+        if "_error" in row:
+            errors.append({"row": row_number, "error": row["_error"]})
+            continue
+
+        values = tuple(str(row.get(field) or '').strip() for field in CUSTOMER_FIELDS)
+        missing = [field for field, value in zip(CUSTOMER_FIELDS, values) if not value]
+        if missing:
+            errors.append({"row": row_number, "error": f"Missing fields: {', '.join(missing)}"})
+            continue
+        email = values[2].lower()
+        if not EMAIL_PATTERN.match(email):
+            errors.append({"row": row_number, "error": f"Invalid email address: {values[2]}"})
+            continue
+        if email in seen_emails:
+            errors.append({"row": row_number, "error": f"Duplicate email in upload: {values[2]}"})
+            continue
+        seen_emails.add(email)
+        valid_rows.append((row_number, (values[0], values[1], values[2])))
+    return valid_rows, errors
@@ -0,0 +1,206 @@
+import os
+import socket
+from collections import namedtuple
+from main.utils.logger_utils import logger
+
+PLANNED = 'planned'
+RENDERED = 'rendered'
+DELIVERED = 'delivered'
+FAILED = 'failed'
+
+LedgerItem = namedtuple('LedgerItem', ['item_id', 'preference_type', 'subscription_type', 'subscription_value',
+                                       'recipients', 'state', 'attempts', 'artifact_path', 'delivered_to'])
+
+# The advisory lock serialises schema creation when several workers start at once
+SCHEMA_SQL = """
+SELECT pg_advisory_xact_lock(7215001);
+
+CREATE TABLE IF NOT EXISTS insights.report_runs (
+    run_id TEXT PRIMARY KEY,
+    started_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    finished_at TIMESTAMPTZ,
+    status TEXT NOT NULL DEFAULT 'running'
+);
+
+CREATE TABLE IF NOT EXISTS insights.report_run_items (
+    item_id BIGSERIAL PRIMARY KEY,
+    run_id TEXT NOT NULL REFERENCES insights.report_runs (run_id) ON DELETE CASCADE,
+    preference_type TEXT NOT NULL,
+    subscription_type TEXT NOT NULL,
+    subscription_value TEXT NOT NULL,
+    recipients TEXT[] NOT NULL,
+    state TEXT NOT NULL DEFAULT 'planned',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    artifact_path TEXT,
+    last_error TEXT,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    claimed_by TEXT,
+    claimed_at TIMESTAMPTZ,
+    delivered_to TEXT[] NOT NULL DEFAULT '{}',
+    UNIQUE (run_id, preference_type, subscription_type, subscription_value)
+);
+
+-- For ledgers created before items were claimed and recipients recorded
+ALTER TABLE insights.report_run_items ADD COLUMN IF NOT EXISTS claimed_by TEXT;
+ALTER TABLE insights.report_run_items ADD COLUMN IF NOT EXISTS claimed_at TIMESTAMPTZ;
+ALTER TABLE insights.report_run_items ADD COLUMN IF NOT EXISTS delivered_to TEXT[] NOT NULL DEFAULT '{}';
+"""
+
+
+class RunLedger:
+    """
+    Persistent record of the work items in a subscription run, stored in Postgres.
+    Each item moves through planned -> rendered -> delivered, or to failed. Re-running with the same run_id
+    skips delivered items, re-sends rendered ones without re-rendering, and retries failed ones
+    until they reach LEDGER_MAX_ATTEMPTS.
+
+    Workers claim items with SELECT ... FOR UPDATE SKIP LOCKED, so any number of processes or containers
+    can share a run without sending the same report twice. A claim expires after LEDGER_LEASE_SECONDS
+    so items held by a crashed worker are picked up again; a worker renews its claim before each item and
+    before sending, and state changes only apply while this worker still holds the claim.
+    """
+
+    def __init__(self, db, worker_id=None):
+        self.db = db
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+        self.max_attempts = int(os.environ.get("LEDGER_MAX_ATTEMPTS", 3))
+        self.lease_seconds = int(os.environ.get("LEDGER_LEASE_SECONDS", 900))
+        self.retry_delay_seconds = int(os.environ.get("LEDGER_RETRY_DELAY_SECONDS", 60))
+
+    def ensure_schema(self):
+        """
+        Creates the ledger tables if they are missing and returns True when it did.
+        The columns are looked up first: ALTER TABLE takes an ACCESS EXCLUSIVE lock even when there is nothing
+        to add, which would stall the workers claiming items.
+        """
+        columns = self.db.select_all(
+            "SELECT count(*) FROM information_schema.columns WHERE table_schema = 'insights' "
+            "AND table_name = 'report_run_items' AND column_name IN ('claimed_by', 'claimed_at', 'delivered_to');")
+        if columns and columns[0][0] == 3:
+            return False
+        self.db.execute(SCHEMA_SQL)
+        return True
+
+    def plan(self, run_id, items):
+        """
+        Records the run and its (preference_type, subscription_type, subscription_value, recipients) items.
+        Items already in the ledger keep their state; undelivered ones pick up the latest recipients.
+        """
+        self.db.execute("INSERT INTO insights.report_runs (run_id) VALUES (%s) ON CONFLICT (run_id) DO NOTHING;",
+                        (run_id,))
+        if not items:
+            return
+        query = """
+            INSERT INTO insights.report_run_items (run_id, preference_type, subscription_type, subscription_value, recipients)
+            VALUES %s
+            ON CONFLICT (run_id, preference_type, subscription_type, subscription_value)
+            DO UPDATE SET recipients = EXCLUDED.recipients
+            WHERE insights.report_run_items.state <> 'delivered'
+        """
+        self.db.execute_values(query, [(run_id, *item[:3], list(item[3])) for item in items])
+        logger.info(f"Planned {len(items)} work items for run {run_id}.")
+
+    def claim_items(self, run_id, worker_id=None, batch_size=5):
+        """
+        Claims up to batch_size undelivered items for this worker and returns them.
+        Items claimed by another live worker, poison items, and items that failed less than
+        LEDGER_RETRY_DELAY_SECONDS ago are not returned.
+        """
+        query = """
+            UPDATE insights.report_run_items
+            SET claimed_by = %s, claimed_at = now()
+            WHERE item_id IN (
+                SELECT item_id
+                FROM insights.report_run_items
+                WHERE run_id = %s
+                  AND state <> 'delivered'
+                  AND attempts < %s
+                  AND (state <> 'failed' OR updated_at < now() - make_interval(secs => %s))
+                  AND (claimed_by IS NULL OR claimed_at < now() - make_interval(secs => %s))
+                ORDER BY item_id
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING item_id, preference_type, subscription_type, subscription_value, recipients, state, attempts, artifact_path,
+                      delivered_to;
+        """
+        params = (worker_id or self.worker_id, run_id, self.max_attempts, self.retry_delay_seconds, self.lease_seconds, batch_size)
+        return sorted((LedgerItem(*row) for row in self.db.execute_returning(query, params)),
+                      key=lambda item: item.item_id)
+
+    def log_poison_items(self, run_id):
+        """Logs the items that have used up their retries in this run."""
+        poison = self.db.select_all(
+            "SELECT subscription_type, subscription_value FROM insights.report_run_items "
+            "WHERE run_id = %s AND state = %s AND attempts >= %s;", (run_id, FAILED, self.max_attempts))
+        for subscription_type, subscription_value in poison:
+            logger.warning(f"Skipping {subscription_type} report for {subscription_value}: "
+                           f"failed {self.max_attempts} times in run {run_id}.")
+        return len(poison)
+
+    def renew_claim(self, item_id):
+        """Restarts the lease on an item and returns False when this worker no longer holds it."""
+        return bool(self.db.execute_returning(
+            "UPDATE insights.report_run_items SET claimed_at = now() "
+            "WHERE item_id = %s AND claimed_by = %s AND state <> %s RETURNING item_id;",
+            (item_id, self.worker_id, DELIVERED)))
+
+    def release_claims(self, run_id):
+        """Hands this worker's undelivered items back, so another worker claims them without waiting for the lease."""
+        self.db.execute(
+            "UPDATE insights.report_run_items SET claimed_by = NULL, claimed_at = NULL "
+            "WHERE run_id = %s AND claimed_by = %s AND state <> %s;", (run_id, self.worker_id, DELIVERED))
+
+    def record_sent(self, item_id, recipients):
+        """
+        Records recipients the report has been sent to, so a retry after a partial failure only sends to the rest.
+        Returns False when another worker has claimed the item since.
+        """
+        updated = self.db.execute_returning(
+            "UPDATE insights.report_run_items "
+            "SET delivered_to = ARRAY(SELECT DISTINCT unnest(delivered_to || %s::text[])) "
+            "WHERE item_id = %s AND claimed_by = %s RETURNING item_id;",
+            (list(recipients), item_id, self.worker_id))
+        return bool(updated)
+
+    def mark_rendered(self, item_id, artifact_path):
+        return self._update(item_id, RENDERED, artifact_path=artifact_path)
+
+    def mark_delivered(self, item_id):
+        return self._update(item_id, DELIVERED)
+
+    def mark_failed(self, item_id, error):
+        return self._update(item_id, FAILED, error=str(error)[:2000])
+
+    def _update(self, item_id, state, artifact_path=None, error=None):
+        """Moves an item this worker holds to state; returns False when another worker has claimed it since."""
+        query = """
+            UPDATE insights.report_run_items
+            SET state = %s,
+                artifact_path = COALESCE(%s, artifact_path),
+                last_error = %s,
+                attempts = attempts + %s,
+                claimed_by = CASE WHEN %s = 'rendered' THEN claimed_by END,
+                claimed_at = CASE WHEN %s = 'rendered' THEN now() END,
+                updated_at = now()
+            WHERE item_id = %s AND claimed_by = %s
+            RETURNING item_id;
+        """
+        updated = self.db.execute_returning(query, (state, artifact_path, error, 1 if state == FAILED else 0, state,
+                                                    state, item_id, self.worker_id))
+        if not updated:
+            logger.warning(f"Ledger item {item_id} is no longer claimed by {self.worker_id}; not marking it {state}.")
+        return bool(updated)
+
+    def finish_run(self, run_id):
+        """
+        Marks the run complete (or partial when items remain undelivered) and returns counts per state.
+        With several workers, the last one to finish records the final status.
+        """
+        counts = dict(self.db.select_all(
+            "SELECT state, COUNT(*) FROM insights.report_run_items WHERE run_id = %s GROUP BY state;", (run_id,)))
+        status = 'complete' if set(counts) <= {DELIVERED} else 'partial'
+        self.db.execute("UPDATE insights.report_runs SET finished_at = now(), status = %s WHERE run_id = %s;",
+                        (status, run_id))
+        logger.info(f"Run {run_id} finished ({status}): {counts}")
+        return counts
@@ -1,19 +1,108 @@
 import logging
+import logging.handlers
 import os
 import sys
+import copy
+import json
 import time
+import queue
+import atexit
+import multiprocessing.util
+from datetime import datetime, timezone
 from dotenv import load_dotenv
 
+TEXT_FORMAT = "%(asctime)s,%(msecs)d %(name)s %(levelname)s %(message)s"
+
+# Set in queue mode; drains the log queue on a background thread
+queue_listener = None
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats each record as one JSON object per line."""
+
+    def format(self, record):
+        entry = {
+            "timestamp": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "thread": record.threadName,
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    Puts records on the queue with only the message merged (its args may change after the call);
+    timestamps, JSON and the write itself happen on the listener thread.
+    """
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def configure_queue_logging():
+    """
+    Logs through a QueueHandler, so callers only put the record on a queue; a QueueListener thread formats it
+    (as JSON with LOG_FORMAT=json) and writes it to stdout and, with LOG_FILE set, to a size-rotated file.
+    """
+    formatter = JsonFormatter() if os.getenv("LOG_FORMAT", "json").lower() == "json" else \
+        logging.Formatter(TEXT_FORMAT, datefmt="%H:%M:%S")
+    handlers = [logging.StreamHandler(sys.stdout)]
+    logfile = os.getenv("LOG_FILE")
+    if logfile:
+        os.makedirs(os.path.dirname(os.path.abspath(logfile)), exist_ok=True)
+        handlers.append(logging.handlers.RotatingFileHandler(
+            logfile, maxBytes=int(os.getenv("LOG_FILE_MAX_BYTES", 10 * 1024 ** 2)),
+            backupCount=int(os.getenv("LOG_FILE_BACKUPS", 5)), encoding="utf-8"))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    queue_handler = DeferredQueueHandler(queue.Queue(-1))
+    root = logging.getLogger()
+    root.addHandler(queue_handler)
+    root.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
+
+    def start_listener():
+        global queue_listener
+        queue_listener = logging.handlers.QueueListener(queue_handler.queue, *handlers, respect_handler_level=True)
+        queue_listener.start()
+
+    def restart_in_child():
+        # A forked worker (sharded or recycled) inherits the queue but not the listener thread
+        queue_handler.queue = queue.Queue(-1)
+        start_listener()
+
+    start_listener()
+    os.register_at_fork(after_in_child=restart_in_child)
+    # multiprocessing children exit through os._exit, which skips atexit, so they flush through a finalizer
+    multiprocessing.util.register_after_fork(
+        queue_handler, lambda _: multiprocessing.util.Finalize(None, lambda: queue_listener.stop(), exitpriority=0))
+    # Flush whatever is still queued when the process exits
+    atexit.register(lambda: queue_listener.stop())
+
 
 # Function to configure logging based on the environment variable
 def configure_logging():
     load_dotenv()
     logging_mode = os.getenv("LOGGING_MODE", "stdout")
 
-    if logging_mode == "stdout":
+    if logging_mode == "queue":
+        configure_queue_logging()
+    elif logging_mode == "stdout":
         logging.basicConfig(
             stream=sys.stdout,
-            format="%(asctime)s,%(msecs)d %(name)s %(levelname)s %(message)s",
+            format=TEXT_FORMAT,
             datefmt="%H:%M:%S",
             level=logging.INFO,
         )
@@ -25,7 +114,7 @@ def configure_logging():
         logging.basicConfig(
             filename=logfile,
             filemode="w",
-            format="%(asctime)s,%(msecs)d %(name)s %(levelname)s %(message)s",
+            format=TEXT_FORMAT,
             datefmt="%H:%M:%S",
             level=logging.DEBUG,
         )
@@ -37,16 +126,13 @@ def configure_logging():
         logging.basicConfig(
             filename=logfile,
             filemode="w",
-            format="%(asctime)s,%(msecs)d %(name)s %(levelname)s %(message)s",
+            format=TEXT_FORMAT,
             datefmt="%H:%M:%S",
             level=logging.DEBUG,
         )
         console = logging.StreamHandler(sys.stdout)
         console.setLevel(logging.INFO)
-        formatter = logging.Formatter(
-            "%(asctime)s,%(msecs)d %(name)s %(levelname)s %(message)s",
-            datefmt="%H:%M:%S",
-        )
+        formatter = logging.Formatter(TEXT_FORMAT, datefmt="%H:%M:%S")
         console.setFormatter(formatter)
         logging.getLogger("").addHandler(console)
     elif logging_mode == "none":
@@ -0,0 +1,100 @@
+from datetime import datetime
+from main.utils.logger_utils import logger
+from main.utils.cache_utils import DiskCache
+from main.utils.trace_utils import tracer
+from main.utils.provider_utils import provider_guard
+from main.utils.custom_error_utils import MarketDataError, ProviderUnavailableError
+
+
+class MarketDataUtils:
+    def __init__(self):
+        self.cache = DiskCache("market_data")
+
+    @staticmethod
+    def _cache_key(stock_symbol, period, interval, as_of=None):
+        """Keys a history by the day of the run it is for (as_of, default today), so a warm-up can fill it ahead."""
+        as_of = as_of or datetime.now()
+        day = as_of.strftime('%Y-%m-%d') if hasattr(as_of, 'strftime') else as_of
+        return f"{stock_symbol}|{period}|{interval}|{day}"
+
+    @staticmethod
+    def _download(yf, tickers, **kwargs):
+        """
+        yf.download through the Yahoo Finance provider guard (rate limit, concurrency, retries, breaker).
+        yf.download logs its failures and returns an empty frame, so an empty download is raised inside the guarded
+        call to be retried and counted by the breaker. Returns an empty DataFrame once the retries are used up or
+        while the breaker is open, so reports go out without prices rather than failing.
+        """
+        guard = provider_guard("yahoo")
+
+        def download():
+            data = yf.download(tickers, timeout=guard.timeout, **kwargs)
+            if data is None or data.empty:
+                errors = getattr(yf.shared, "_ERRORS", None)
+                raise MarketDataError(f"No data downloaded for {tickers}" + (f": {errors}" if errors else ""))
+            return data
+
+        try:
+            return guard.call(download)
+        except (MarketDataError, ProviderUnavailableError) as e:
+            import pandas as pd
+
+            logger.warning(f"Yahoo Finance download failed: {e}")
+            return pd.DataFrame()
+
+    @tracer.traced("market_data.stock_history")
+    def get_stock_history(self, asx_code, period="5d", interval="1d", as_of=None):
+        """Fetches the price history for an ASX code from Yahoo Finance, cached for the day of the run (as_of)."""
+        stock_symbol = f"{asx_code}.AX"
+        cache_key = self._cache_key(stock_symbol, period, interval, as_of)
+
+        stock_data = self.cache.get(cache_key)
+        if stock_data is not None:
+            return stock_data
+
+        import yfinance as yf
+
+        logger.info(f"Downloading stock data for {stock_symbol}...")
+        stock_data = self._download(yf, stock_symbol, period=period, interval=interval)
+        if not stock_data.empty:
+            self.cache.set(cache_key, stock_data)
+        return stock_data
+
+    @tracer.traced("market_data.stock_histories")
+    def get_stock_histories(self, asx_codes, period="5d", interval="1d", as_of=None):
+        """
+        Fetches the price histories for many ASX codes with a single Yahoo Finance download.
+        Histories already cached for the day of the run (as_of) are not downloaded again. Returns {asx_code: DataFrame}.
+        """
+        histories, missing = {}, []
+        for asx_code in dict.fromkeys(asx_codes):
+            stock_data = self.cache.get(self._cache_key(f"{asx_code}.AX", period, interval, as_of))
+            if stock_data is not None:
+                histories[asx_code] = stock_data
+            else:
+                missing.append(asx_code)
+        if not missing:
+            return histories
+
+        import pandas as pd
+        import yfinance as yf
+
+        logger.info(f"Downloading stock data for {len(missing)} symbols...")
+        stock_symbols = [f"{asx_code}.AX" for asx_code in missing]
+        data = self._download(yf, stock_symbols, period=period, interval=interval, group_by="ticker")
+        for asx_code, stock_symbol in zip(missing, stock_symbols):
+            # Multi-ticker downloads have (ticker, field) columns; the level order differs between yfinance versions
+            if isinstance(data.columns, pd.MultiIndex):
+                if stock_symbol in data.columns.get_level_values(0):
+                    stock_data = data[stock_symbol]
+                elif stock_symbol in data.columns.get_level_values(-1):
+                    stock_data = data.xs(stock_symbol, axis=1, level=-1)
+                else:
+                    stock_data = pd.DataFrame()
+            else:
+                stock_data = data
+            stock_data = stock_data.dropna(how="all")
+            if not stock_data.empty:
+                self.cache.set(self._cache_key(stock_symbol, period, interval, as_of), stock_data)
+            histories[asx_code] = stock_data
+        return histories
@@ -0,0 +1,76 @@
+import os
+import sys
+from main.utils.metrics_utils import metrics
+
+MEMORY_MODES = ('none', 'rss', 'tracemalloc')
+
+
+def rss_bytes():
+    """Returns the resident set size of this process in bytes, or None when it cannot be read."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    # Without /proc only the peak is available: ru_maxrss is in bytes on macOS and kilobytes elsewhere
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class MemoryAccountant:
+    """
+    Measures the memory each report leaves behind. MEMORY_ACCOUNTING controls how: "rss" (the default) records
+    the process RSS before and after the report, "tracemalloc" also traces Python allocations for their peak
+    and net growth (slower, for investigating), "none" turns it off.
+    Reports rendered concurrently share the process, so per-report figures overlap under COMPONENT_WORKERS
+    or NOTIFY_WORKERS; the RSS after each report is what the worker recycling policy acts on.
+    """
+
+    def __init__(self):
+        self.mode = os.getenv("MEMORY_ACCOUNTING", "rss").lower()
+        if self.mode not in MEMORY_MODES:
+            self.mode = 'rss'
+
+    def start(self):
+        """Returns the measurements taken before a report, to pass to finish()."""
+        if self.mode == 'none':
+            return None
+        traced = None
+        if self.mode == 'tracemalloc':
+            import tracemalloc
+
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+            traced = tracemalloc.get_traced_memory()[0]
+        return rss_bytes(), traced
+
+    def finish(self, before):
+        """Returns {rss_bytes, rss_delta_bytes[, python_peak_bytes, python_delta_bytes]} for the report."""
+        if before is None:
+            return None
+        rss_before, traced_before = before
+        rss = rss_bytes()
+        usage = {'rss_bytes': rss}
+        if rss is not None and rss_before is not None:
+            usage['rss_delta_bytes'] = rss - rss_before
+            if metrics.enabled:
+                metrics.process_rss.set(rss)
+                metrics.report_memory.observe(max(0, usage['rss_delta_bytes']), measure='rss_delta')
+        if traced_before is not None:
+            import tracemalloc
+
+            current, peak = tracemalloc.get_traced_memory()
+            usage['python_peak_bytes'] = peak - traced_before
+            usage['python_delta_bytes'] = current - traced_before
+            if metrics.enabled:
+                metrics.report_memory.observe(max(0, usage['python_peak_bytes']), measure='python_peak')
+        return usage
+
+
+# Define the memory accountant
+memory = MemoryAccountant()
@@ -0,0 +1,147 @@
+import os
+import threading
+from bisect import bisect_left
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+BYTE_BUCKETS = (10 * 1024, 50 * 1024, 100 * 1024, 250 * 1024, 500 * 1024, 1024 ** 2, 2.5 * 1024 ** 2,
+                5 * 1024 ** 2, 10 * 1024 ** 2, 25 * 1024 ** 2)
+MEMORY_BUCKETS = (1024 ** 2, 5 * 1024 ** 2, 10 * 1024 ** 2, 25 * 1024 ** 2, 50 * 1024 ** 2, 100 * 1024 ** 2,
+                  250 * 1024 ** 2, 500 * 1024 ** 2, 1024 ** 3)
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(label_key, extra=None):
+    pairs = list(label_key) + (list(extra.items()) if extra else [])
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+class Counter:
+    def __init__(self, name, description):
+        self.name = name
+        self.description = description
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self.values.items()):
+                lines.append(f"{self.name}{_format_labels(key)} {value}")
+        return lines
+
+
+class Gauge:
+    def __init__(self, name, description):
+        self.name = name
+        self.description = description
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def set(self, value, **labels):
+        with self._lock:
+            self.values[_label_key(labels)] = value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} gauge"]
+        with self._lock:
+            for key, value in sorted(self.values.items()):
+                lines.append(f"{self.name}{_format_labels(key)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, description, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.description = description
+        self.buckets = tuple(buckets)
+        self.series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            series = self.series.get(key)
+            if series is None:
+                # Per-bucket counts plus a final +Inf bucket, then the running sum
+                series = self.series[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][bisect_left(self.buckets, value)] += 1
+            series[1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, total) in sorted(self.series.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + ("+Inf",), counts):
+                    cumulative += count
+                    lines.append(f"{self.name}_bucket{_format_labels(key, {'le': bound})} {cumulative}")
+                lines.append(f"{self.name}_sum{_format_labels(key)} {round(total, 6)}")
+                lines.append(f"{self.name}_count{_format_labels(key)} {cumulative}")
+        return lines
+
+
+class Metrics:
+    """
+    In-process metrics registry rendered in the Prometheus text exposition format.
+    Disable with METRICS_ENABLED=false.
+    """
+
+    def __init__(self):
+        self.enabled = os.getenv("METRICS_ENABLED", "True").lower() == "true"
+        self.report_generations = Counter("insight_report_generations_total",
+                                          "Reports generated, by report type and status.")
+        self.report_duration = Histogram("insight_report_duration_seconds",
+                                         "End-to-end report generation and delivery time, by report type.")
+        self.stage_duration = Histogram("insight_stage_duration_seconds",
+                                        "Time spent per stage (db, s3, rag, chart, html, pdf, email).")
+        self.stage_failures = Counter("insight_stage_failures_total",
+                                      "Stages that raised an exception, by stage.")
+        self.rag_cache = Counter("insight_rag_cache_requests_total",
+                                 "RAG answer lookups, by cache result (hit, miss, stale).")
+        self.emails_sent = Counter("insight_emails_sent_total",
+                                   "Report emails sent, by status.")
+        self.artifact_storage = Gauge("insight_artifact_storage",
+                                      "Stored report artifacts, by unit (runs, files, bytes, free_bytes).")
+        self.report_bytes = Histogram("insight_report_bytes",
+                                      "Rendered report size, by artifact (html, pdf) and stage (before, after "
+                                      "asset optimisation).", buckets=BYTE_BUCKETS)
+        self.provider_calls = Counter("insight_provider_calls_total",
+                                      "Calls to external providers, by provider and outcome (ok, error, rejected).")
+        self.provider_concurrency = Gauge("insight_provider_concurrency_limit",
+                                          "Adaptive in-flight limit, by provider.")
+        self.provider_circuit_open = Gauge("insight_provider_circuit_open",
+                                           "1 while a provider's circuit breaker is open, by provider.")
+        self.db_connections = Counter("insight_db_connections_total",
+                                      "Database connections opened, by role (primary, replica) and reason "
+                                      "(query class, sticky after a write, replica fallback).")
+        self.report_profiles = Counter("insight_report_profiles_total",
+                                       "On-demand report profiles, by outcome (saved, busy, throttled, failed).")
+        self.report_memory = Histogram("insight_report_memory_bytes",
+                                       "Memory per report, by measure (rss_delta: RSS growth across the report, "
+                                       "python_peak: peak traced Python allocations).", buckets=MEMORY_BUCKETS)
+        self.process_rss = Gauge("insight_process_rss_bytes", "Resident set size after the last report.")
+
+    def render(self):
+        lines = []
+        for metric in (self.report_generations, self.report_duration, self.stage_duration,
+                       self.stage_failures, self.rag_cache, self.emails_sent, self.artifact_storage,
+                       self.report_bytes, self.provider_calls, self.provider_concurrency,
+                       self.provider_circuit_open, self.db_connections, self.report_profiles,
+                       self.report_memory, self.process_rss):
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+# Define the metrics registry
+metrics = Metrics()
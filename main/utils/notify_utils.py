@@ -0,0 +1,178 @@
+import os
+import json
+import time
+import select
+import psycopg2
+import psycopg2.extensions
+from main.utils.logger_utils import logger
+
+DISCLOSURE_CHANNEL = "insight_disclosure"
+DIRECTOR_TRADE_CHANNEL = "insight_director_trade"
+PREFERENCE_CHANNEL = "insight_preference"
+COMPANY_CHANNEL = "insight_company"
+CHANNELS = (DISCLOSURE_CHANNEL, DIRECTOR_TRADE_CHANNEL, PREFERENCE_CHANNEL, COMPANY_CHANNEL)
+
+# Trigger functions publishing the changes the listener reacts to. Installed with ChangeListener.install_triggers().
+TRIGGER_SQL = """
+CREATE OR REPLACE FUNCTION insights.notify_disclosure_insert() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('insight_disclosure', json_build_object(
+        'asx_code', (SELECT asx_code FROM disclosure.company WHERE company_id = NEW.company_id))::text);
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS insight_disclosure_notify ON disclosure.disclosure;
+CREATE TRIGGER insight_disclosure_notify AFTER INSERT ON disclosure.disclosure
+    FOR EACH ROW EXECUTE FUNCTION insights.notify_disclosure_insert();
+
+CREATE OR REPLACE FUNCTION insights.notify_director_trade_insert() RETURNS trigger AS $$
+BEGIN
+    IF NEW.attribute_id = '47bcf56f-19bf-403f-b491-21493f72b16c' THEN
+        PERFORM pg_notify('insight_director_trade', json_build_object(
+            'asx_code', (SELECT c.asx_code FROM disclosure.disclosure d
+                         JOIN disclosure.company c ON d.company_id = c.company_id
+                         WHERE d.disclosure_id = NEW.disclosure_id))::text);
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS insight_director_trade_notify ON disclosure.disclosure_attributes_annotations;
+CREATE TRIGGER insight_director_trade_notify AFTER INSERT ON disclosure.disclosure_attributes_annotations
+    FOR EACH ROW EXECUTE FUNCTION insights.notify_director_trade_insert();
+
+CREATE OR REPLACE FUNCTION insights.notify_preference_change() RETURNS trigger AS $$
+BEGIN
+    IF NEW.is_active AND (TG_OP = 'INSERT' OR NOT OLD.is_active
+                          OR OLD.subscription_value IS DISTINCT FROM NEW.subscription_value
+                          OR OLD.subscription_type IS DISTINCT FROM NEW.subscription_type
+                          OR OLD.preference_value IS DISTINCT FROM NEW.preference_value) THEN
+        PERFORM pg_notify('insight_preference', json_build_object(
+            'preference_type', NEW.preference_type,
+            'preference_value', NEW.preference_value,
+            'subscription_type', NEW.subscription_type,
+            'subscription_value', NEW.subscription_value)::text);
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS insight_preference_notify ON insights.distribution_preferences;
+CREATE TRIGGER insight_preference_notify AFTER INSERT OR UPDATE ON insights.distribution_preferences
+    FOR EACH ROW EXECUTE FUNCTION insights.notify_preference_change();
+
+CREATE OR REPLACE FUNCTION insights.notify_company_change() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'UPDATE' THEN
+        IF OLD.industry IS DISTINCT FROM NEW.industry THEN
+            -- Both industries' reports change membership
+            PERFORM pg_notify('insight_company', json_build_object(
+                'asx_code', NEW.asx_code, 'industry', NEW.industry, 'previous_industry', OLD.industry)::text);
+            RETURN NEW;
+        END IF;
+    END IF;
+    PERFORM pg_notify('insight_company', json_build_object('asx_code', NEW.asx_code)::text);
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS insight_company_notify ON disclosure.company;
+CREATE TRIGGER insight_company_notify AFTER INSERT OR UPDATE OF asx_code, company_name, company_summary, industry
+    ON disclosure.company FOR EACH ROW EXECUTE FUNCTION insights.notify_company_change();
+"""
+
+
+class ChangeListener:
+    """
+    Listens for Postgres NOTIFY events and hands debounced batches of them to a handler.
+    A batch is flushed once no new event has arrived for NOTIFY_DEBOUNCE_SECONDS,
+    or NOTIFY_MAX_DELAY_SECONDS after its first event, whichever comes first, and before reconnecting
+    after a lost connection.
+    """
+
+    def __init__(self, db, handler, channels=CHANNELS):
+        self.db = db
+        self.handler = handler
+        self.channels = channels
+        self.debounce_seconds = float(os.environ.get("NOTIFY_DEBOUNCE_SECONDS", 30))
+        self.max_delay_seconds = float(os.environ.get("NOTIFY_MAX_DELAY_SECONDS", 300))
+        self.reconnect_seconds = float(os.environ.get("NOTIFY_RECONNECT_SECONDS", 5))
+        # The batch being debounced, kept across reconnects: (channel, payload) -> event
+        self._pending = {}
+        self._first_event_at = self._last_event_at = None
+
+    def install_triggers(self):
+        """Creates or replaces the trigger functions that publish the change notifications."""
+        self.db.execute(TRIGGER_SQL)
+        logger.info("Installed change notification triggers.")
+
+    def listen(self, stop_event=None):
+        """Blocks, dispatching batches of events until stop_event is set. Reconnects after connection errors."""
+        while not (stop_event and stop_event.is_set()):
+            try:
+                self._listen_once(stop_event)
+            except psycopg2.OperationalError as e:
+                logger.error(f"Lost the notification connection: {e}. Reconnecting in {self.reconnect_seconds}s...")
+                # Events sent while disconnected are lost, so the ones already received are not held back
+                self._flush()
+                time.sleep(self.reconnect_seconds)
+
+    def _listen_once(self, stop_event):
+        conn = self.db.get_connection()
+        conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+        cur = conn.cursor()
+        for channel in self.channels:
+            cur.execute(f"LISTEN {channel};")
+        logger.info(f"Listening for changes on: {', '.join(self.channels)}")
+
+        try:
+            while not (stop_event and stop_event.is_set()):
+                # Wake up for new events, for the debounce window to close, or to check the stop flag
+                timeout = 1.0
+                if self._pending:
+                    now = time.monotonic()
+                    timeout = max(0.0, min(timeout, self._last_event_at + self.debounce_seconds - now,
+                                           self._first_event_at + self.max_delay_seconds - now))
+
+                if select.select([conn], [], [], timeout) != ([], [], []):
+                    conn.poll()
+                    while conn.notifies:
+                        notify = conn.notifies.pop(0)
+                        event = self._parse(notify)
+                        self._pending[(event['channel'], json.dumps(event, sort_keys=True))] = event
+                        self._last_event_at = time.monotonic()
+                        self._first_event_at = self._first_event_at or self._last_event_at
+
+                now = time.monotonic()
+                if self._pending and (now - self._last_event_at >= self.debounce_seconds
+                                      or now - self._first_event_at >= self.max_delay_seconds):
+                    self._flush()
+        finally:
+            cur.close()
+            conn.close()
+
+    def _flush(self):
+        """Hands the pending batch, if any, to the handler."""
+        if not self._pending:
+            return
+        events = list(self._pending.values())
+        self._pending = {}
+        self._first_event_at = self._last_event_at = None
+        logger.info(f"Dispatching {len(events)} change events.")
+        try:
+            self.handler(events)
+        except Exception as e:
+            logger.exception(f"Failed to handle change events: {e}")
+
+    @staticmethod
+    def _parse(notify):
+        try:
+            payload = json.loads(notify.payload) if notify.payload else {}
+        except json.JSONDecodeError:
+            logger.warning(f"Ignoring invalid payload on {notify.channel}: {notify.payload}")
+            payload = {}
+        if not isinstance(payload, dict):
+            payload = {}
+        payload['channel'] = notify.channel
+        return payload
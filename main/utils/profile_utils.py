@@ -0,0 +1,197 @@
+import os
+import sys
+import time
+import hmac
+import marshal
+import threading
+from contextlib import contextmanager
+from main.utils.logger_utils import logger
+from main.utils.metrics_utils import metrics
+
+PROFILE_MODES = ('sample', 'cprofile')
+
+
+class ReportProfile:
+    """
+    The profile of one report render, across the requesting thread and the component threads attached to it.
+    'sample' mode walks the stacks of those threads every interval seconds, stopping after max_samples samples
+    or max_seconds, and keeps them as collapsed stacks (`frame;frame;frame count`, the input of flamegraph.pl
+    and speedscope). 'cprofile' mode also runs cProfile in each attached thread for a pstats file.
+    """
+
+    def __init__(self, name, mode='sample', interval=0.01, max_samples=5000, max_seconds=120):
+        self.name = name
+        self.mode = mode
+        self.interval = interval
+        self.max_samples = max_samples
+        self.max_seconds = max_seconds
+        self.stacks = {}
+        self.samples = 0
+        self.truncated = False
+        self.paths = {}
+        self._threads = {}
+        self._profiles = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._sampler = threading.Thread(target=self._sample, name="report-profile-sampler", daemon=True)
+
+    def start(self):
+        self._sampler.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._sampler.join()
+
+    def enter_thread(self):
+        """Starts profiling the calling thread; returns the token to pass to exit_thread."""
+        ident = threading.get_ident()
+        with self._lock:
+            self._threads[ident] = self._threads.get(ident, 0) + 1
+        profile = None
+        if self.mode == 'cprofile':
+            import cProfile
+
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+            except ValueError:
+                # Python 3.12+ profiles every thread from the first enable(), so this thread is already covered
+                profile = None
+        return ident, profile
+
+    def exit_thread(self, token):
+        ident, profile = token
+        if profile is not None:
+            profile.disable()
+        with self._lock:
+            if profile is not None:
+                self._profiles.append(profile)
+            self._threads[ident] -= 1
+            if not self._threads[ident]:
+                del self._threads[ident]
+
+    def _sample(self):
+        deadline = time.monotonic() + self.max_seconds
+        while not self._stop.wait(self.interval):
+            if self.samples >= self.max_samples or time.monotonic() > deadline:
+                self.truncated = True
+                return
+            frames = sys._current_frames()
+            with self._lock:
+                threads = list(self._threads)
+            for ident in threads:
+                frame, stack = frames.get(ident), []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                if stack:
+                    collapsed = ";".join(reversed(stack))
+                    self.stacks[collapsed] = self.stacks.get(collapsed, 0) + 1
+            self.samples += 1
+
+    def collapsed(self):
+        return "".join(f"{stack} {count}\n" for stack, count in sorted(self.stacks.items()))
+
+    def save(self, store):
+        """Saves <name>.collapsed (and <name>.pstats in cprofile mode) to the artifact store and returns the paths."""
+        self.paths['collapsed'] = store.save(f"{self.name}.collapsed", self.collapsed().encode("utf-8"))
+        if self._profiles:
+            import pstats
+
+            stats = pstats.Stats(*self._profiles)
+            # The format pstats.Stats.dump_stats writes, so `python -m pstats <file>` reads it back
+            self.paths['pstats'] = store.save(f"{self.name}.pstats", marshal.dumps(stats.stats))
+        return self.paths
+
+
+class Profiler:
+    """
+    On-demand profiling of single report renders, bounded for production use: one profile at a time,
+    at most one every PROFILE_MIN_INTERVAL_SECONDS, and PROFILE_MAX_SAMPLES / PROFILE_MAX_SECONDS per profile.
+    A render is profiled when it matches PROFILE_REPORTS (comma-separated report types, optionally with an
+    ASX code, e.g. "daily_report:BHP,director_trades"), or when the report viewer is called with
+    ?profile=sample|cprofile and the PROFILE_TOKEN.
+    """
+
+    def __init__(self):
+        self.mode = os.getenv("PROFILE_MODE", "sample").lower()
+        self.token = os.getenv("PROFILE_TOKEN", "")
+        self.interval = float(os.getenv("PROFILE_SAMPLE_INTERVAL_MS", 10)) / 1000
+        self.max_samples = int(os.getenv("PROFILE_MAX_SAMPLES", 5000))
+        self.max_seconds = float(os.getenv("PROFILE_MAX_SECONDS", 120))
+        self.min_interval = float(os.getenv("PROFILE_MIN_INTERVAL_SECONDS", 60))
+        self.reports = {tuple(entry.strip().split(":", 1)) for entry in os.getenv("PROFILE_REPORTS", "").split(",")
+                        if entry.strip()}
+        self._local = threading.local()
+        self._active = threading.Lock()
+        self._last_started = None
+
+    def wanted(self, report_type, asx_code=None):
+        """True when PROFILE_REPORTS asks for this report type (or this report type and ASX code)."""
+        return (report_type,) in self.reports or (report_type, asx_code) in self.reports
+
+    def authorised(self, token):
+        return bool(self.token) and hmac.compare_digest(self.token, token or "")
+
+    def context(self):
+        """Returns the profile of the report running in this thread, or None."""
+        return getattr(self._local, "profile", None)
+
+    @contextmanager
+    def attach(self, profile):
+        """Profiles this thread as part of another thread's report (from context())."""
+        if profile is None:
+            yield
+            return
+        previous = getattr(self._local, "profile", None)
+        self._local.profile = profile
+        token = profile.enter_thread()
+        try:
+            yield
+        finally:
+            profile.exit_thread(token)
+            self._local.profile = previous
+
+    @contextmanager
+    def report(self, name, store, mode=None):
+        """
+        Profiles the report rendered inside the block and saves the profile to store under name, yielding the
+        ReportProfile (its paths are set on exit), or None when another profile is running or one ran too recently.
+        """
+        mode = mode if mode in PROFILE_MODES else self.mode
+        now = time.monotonic()
+        if not self._active.acquire(blocking=False):
+            metrics.report_profiles.inc(outcome="busy")
+            logger.info(f"Not profiling {name}: another profile is running.")
+            yield None
+            return
+        if self._last_started is not None and now - self._last_started < self.min_interval:
+            self._active.release()
+            metrics.report_profiles.inc(outcome="throttled")
+            logger.info(f"Not profiling {name}: the last profile started less than {self.min_interval:g}s ago.")
+            yield None
+            return
+
+        self._last_started = now
+        profile = ReportProfile(name, mode, self.interval, self.max_samples, self.max_seconds)
+        try:
+            with self.attach(profile.start()):
+                yield profile
+        finally:
+            profile.stop()
+            try:
+                paths = profile.save(store)
+                metrics.report_profiles.inc(outcome="saved")
+                logger.info(f"Saved {mode} profile of {name} ({profile.samples} samples"
+                            f"{', truncated' if profile.truncated else ''}): {paths}")
+            except OSError as e:
+                metrics.report_profiles.inc(outcome="failed")
+                logger.warning(f"Failed to save the profile of {name}: {e}")
+            finally:
+                self._active.release()
+
+
+# Define the profiler
+profiler = Profiler()
@@ -0,0 +1,189 @@
+import os
+import time
+import random
+import threading
+from main.utils.logger_utils import logger
+from main.utils.metrics_utils import metrics
+from main.utils.custom_error_utils import ProviderUnavailableError
+
+# Per-provider defaults, each overridable with PROVIDER_<NAME>_<SETTING> (e.g. PROVIDER_RAG_MAX_CONCURRENCY=4).
+# rate/burst: token bucket in calls per second (rate 0 disables it); min/max_concurrency: bounds of the adaptive
+# in-flight limit; latency_target: seconds above which a call counts as slow; retries/backoff/max_backoff: bounded
+# retries with full jitter; breaker_failures/breaker_reset: consecutive failures that open the circuit and the
+# seconds before a probe call is let through; timeout: seconds passed to the provider's client
+# (the RAG client has its own RAG_CONNECT_TIMEOUT and RAG_DEADLINE_SECONDS).
+PROVIDER_DEFAULTS = {
+    'rag': {'rate': 5, 'burst': 10, 'min_concurrency': 1, 'max_concurrency': 8, 'latency_target': 120,
+            'retries': 2, 'backoff': 2, 'max_backoff': 30, 'breaker_failures': 5, 'breaker_reset': 60},
+    'yahoo': {'rate': 2, 'burst': 5, 'min_concurrency': 1, 'max_concurrency': 4, 'latency_target': 10,
+              'retries': 2, 'backoff': 2, 'max_backoff': 30, 'breaker_failures': 5, 'breaker_reset': 120,
+              'timeout': 15},
+    's3': {'rate': 50, 'burst': 100, 'min_concurrency': 2, 'max_concurrency': 16, 'latency_target': 5,
+           'retries': 2, 'backoff': 0.5, 'max_backoff': 10, 'breaker_failures': 10, 'breaker_reset': 30,
+           'timeout': 10},
+    'smtp': {'rate': 10, 'burst': 20, 'min_concurrency': 1, 'max_concurrency': 4, 'latency_target': 10,
+             'retries': 2, 'backoff': 2, 'max_backoff': 30, 'breaker_failures': 5, 'breaker_reset': 60,
+             'timeout': 30},
+}
+
+
+class TokenBucket:
+    """Lets `rate` calls per second through on average, with bursts of up to `burst` calls."""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class AdaptiveLimiter:
+    """
+    Limits calls in flight with AIMD: the limit grows by about one per limit's worth of fast, successful calls
+    and halves on a failure or a call slower than latency_target, staying between min_limit and max_limit.
+    """
+
+    def __init__(self, min_limit, max_limit, latency_target):
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self.latency_target = latency_target
+        self.limit = float(max(self.min_limit, self.max_limit // 2))
+        self.in_flight = 0
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        with self._condition:
+            while self.in_flight >= int(self.limit):
+                self._condition.wait()
+            self.in_flight += 1
+
+    def release(self, latency, failed):
+        with self._condition:
+            self.in_flight -= 1
+            if failed or latency > self.latency_target:
+                self.limit = max(self.min_limit, self.limit / 2)
+            else:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            self._condition.notify_all()
+            return self.limit
+
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive failures and rejects calls for `reset_seconds`,
+    then lets a single probe call through; its success closes the circuit, its failure reopens it.
+    """
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, failure_threshold, reset_seconds):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_seconds:
+                self.state = self.HALF_OPEN
+            if self.state == self.OPEN or (self.state == self.HALF_OPEN and self._probing):
+                return False
+            if self.state == self.HALF_OPEN:
+                self._probing = True
+            return True
+
+    def record(self, failed):
+        with self._lock:
+            self._probing = False
+            if not failed:
+                self.failures = 0
+                self.state = self.CLOSED
+                return self.state
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+            return self.state
+
+
+class ProviderGuard:
+    """
+    Wraps calls to one external provider (RAG, Yahoo Finance, S3, SMTP) with a rate limit, an adaptive
+    concurrency limit, bounded retries with jitter and a circuit breaker. When the provider degrades,
+    callers slow down and then fail fast with ProviderUnavailableError instead of piling on.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        settings = {setting: float(os.environ.get(f"PROVIDER_{name.upper()}_{setting.upper()}", default))
+                    for setting, default in PROVIDER_DEFAULTS.get(name, PROVIDER_DEFAULTS['rag']).items()}
+        self.timeout = settings.get('timeout')
+        self.retries = int(settings['retries'])
+        self.backoff = settings['backoff']
+        self.max_backoff = settings['max_backoff']
+        self.bucket = TokenBucket(settings['rate'], settings['burst'])
+        self.limiter = AdaptiveLimiter(int(settings['min_concurrency']), int(settings['max_concurrency']),
+                                       settings['latency_target'])
+        self.breaker = CircuitBreaker(int(settings['breaker_failures']), settings['breaker_reset'])
+        metrics.provider_concurrency.set(self.limiter.limit, provider=name)
+
+    def call(self, fn, *args, retry_on=(Exception,), **kwargs):
+        """
+        Calls fn(*args, **kwargs). Exceptions matching retry_on count as provider failures and are retried up to
+        `retries` times; any other exception means the provider answered, and is raised straight away.
+        """
+        for attempt in range(self.retries + 1):
+            if not self.breaker.allow():
+                metrics.provider_calls.inc(provider=self.name, outcome="rejected")
+                raise ProviderUnavailableError(f"{self.name} is unavailable (circuit open)")
+
+            self.bucket.acquire()
+            self.limiter.acquire()
+            start, failed = time.monotonic(), False
+            try:
+                return fn(*args, **kwargs)
+            except retry_on as e:
+                failed = True
+                if attempt == self.retries:
+                    raise
+                error = e
+            finally:
+                limit = self.limiter.release(time.monotonic() - start, failed)
+                state = self.breaker.record(failed)
+                metrics.provider_concurrency.set(round(limit, 2), provider=self.name)
+                metrics.provider_circuit_open.set(int(state == CircuitBreaker.OPEN), provider=self.name)
+                metrics.provider_calls.inc(provider=self.name, outcome="error" if failed else "ok")
+
+            # Full jitter keeps parallel workers from retrying in lockstep
+            delay = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+            logger.warning(f"{self.name} call failed ({error}); retry {attempt + 1}/{self.retries} in {delay:.1f}s")
+            time.sleep(delay)
+
+
+_guards = {}
+_guards_lock = threading.Lock()
+
+
+def provider_guard(name):
+    """Returns the process-wide guard for a provider, so every worker thread shares its limits."""
+    with _guards_lock:
+        if name not in _guards:
+            _guards[name] = ProviderGuard(name)
+        return _guards[name]
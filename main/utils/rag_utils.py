@@ -1,27 +1,198 @@
 import os
 import json
-import requests
 import logging
 import time
 import pickle
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from main.utils.trace_utils import tracer
+from main.utils.metrics_utils import metrics
+from main.utils.provider_utils import provider_guard
+from main.utils.custom_error_utils import ProviderUnavailableError
+
+# Prompt templates used by the reports, keyed by template id
+PROMPT_TEMPLATES = {
+    'recent_activities': "Provide me a summary of recent activities, for company: {asx_code}",
+    'media_update': "Provide me a media update and sentiment and reflections, for company: {asx_code}",
+    'director_trades': "Tell me about recent director trades, for company: {asx_code}",
+    'key_updates': (
+        "Summarize key activities disclosed by {asx_code} over the last 7 days in a bullet-point list. "
+        "Focus on:\n\n"
+        " - Financial updates\n"
+        " - Product or service launches\n"
+        " - Strategic initiatives (e.g., mergers, acquisitions)\n"
+        " - Operational changes (e.g., leadership, restructuring)\n"
+        " - Market activity (e.g., stock buybacks, investments)\n"
+        " - Regulatory updates\n"
+        " - Sustainability actions\n"
+        " - Partnerships\n"
+        " - Customer announcements\n"
+        " - Industry recognition\n\n"
+        "Present each as a separate bullet point, and skip categories with no updates."
+    ),
+    'industry_overview': (
+        "Summarize the key developments disclosed over the last 7 days by companies in the {industry} industry "
+        "({asx_codes}) as a bullet-point list, grouping related announcements and naming the companies involved."
+    ),
+    'industry_media_update': (
+        "Provide a media update and sentiment for the {industry} industry, covering companies: {asx_codes}"
+    ),
+}
+
+# Templates used by the daily company report, in the order they are rendered
+DAILY_REPORT_TEMPLATES = ['recent_activities', 'media_update', 'director_trades', 'key_updates']
+
+# Templates used by the industry news report, asked once per industry rather than once per member
+INDUSTRY_REPORT_TEMPLATES = ['industry_overview', 'industry_media_update']
+
 
 class RagUtils:
-    def __init__(self, cache_file="rag_cache.pkl", cache_size=100):
+    def __init__(self, cache_file="rag_cache.pkl", cache_size=None):
         self.rag_endpoint = os.getenv("RAG_ENDPOINT", "http://development.dhi-ai.com:5000/rag")
         self.source_of_request = os.getenv("SOURCE_OF_REQUEST", "insight_distribution")
         self.user_name = os.getenv("USER_NAME", "insight_distribution")
+        self.connect_timeout = float(os.getenv("RAG_CONNECT_TIMEOUT", 10))
+        self.deadline_seconds = float(os.getenv("RAG_DEADLINE_SECONDS", 300))
+        # Longest wait for the next bytes of the stream; the deadline bounds the stream as a whole
+        self.read_timeout = min(float(os.getenv("RAG_READ_TIMEOUT", 60)), self.deadline_seconds)
+        self.finish_events = set(os.getenv("RAG_FINISH_EVENTS", "end,done,finish").split(","))
         self.logger = logging.getLogger(__name__)
-        self.cache_size = cache_size
+        self.cache_size = cache_size or int(os.getenv("RAG_CACHE_SIZE", 2000))
+        self.max_age = float(os.getenv("RAG_CACHE_MAX_AGE", 86400))
+        # Answers arriving in a burst are saved together, at most once every RAG_CACHE_SAVE_INTERVAL seconds
+        self.save_interval = float(os.getenv("RAG_CACHE_SAVE_INTERVAL", 5))
+        self._persist = True
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self._save_timer = None
+        self._last_saved = 0.0
         self.cache_file = cache_file
         self.cache = self._load_cache_from_disk()
 
     def ask_question(self, question):
         # Check if the question is in the cache
         if question in self.cache:
-            self.logger.info(f"Returning cached answer for question: {question}")
-            return self.cache[question]
+            self.logger.debug("Returning cached answer for question: %s", question)
+            metrics.rag_cache.inc(result="hit")
+            return self.cache[question][:2]
+
+        metrics.rag_cache.inc(result="miss")
+
+        rag_response, conversation_id, answered = self._query_rag(question)
+        if answered:
+            # Save the result in the cache and persist to disk
+            self._update_cache(question, (rag_response, conversation_id))
+        return rag_response, conversation_id
+
+    def ask_template(self, template_id, params=None, max_age=None):
+        """
+        Asks a question built from one of the PROMPT_TEMPLATES.
+        Answers are cached under a compact key of the template id and its normalised parameters,
+        and are refetched once they are older than max_age seconds.
+        """
+        if template_id not in PROMPT_TEMPLATES:
+            raise ValueError(f"Unknown RAG prompt template: {template_id}")
+
+        params = self._normalise_params(params)
+        cache_key = self.make_cache_key(template_id, params)
+        max_age = self.max_age if max_age is None else max_age
+
+        cached = self.cache.get(cache_key)
+        if cached and time.time() - cached[2] <= max_age:
+            self.logger.info("Returning cached answer for %s", cache_key)
+            metrics.rag_cache.inc(result="hit")
+            return cached[:2]
+
+        metrics.rag_cache.inc(result="stale" if cached else "miss")
+
+        prompt = PROMPT_TEMPLATES[template_id].format(**params)
+        rag_response, conversation_id, answered = self._query_rag(prompt)
+        if answered:
+            self._update_cache(cache_key, (rag_response, conversation_id, time.time()))
+        elif cached:
+            self.logger.warning(f"RAG request failed for {cache_key}. Returning stale cached answer.")
+            return cached[:2]
+        return rag_response, conversation_id
+
+    def warm(self, template_ids, params_list, max_age=None, max_workers=1):
+        """
+        Fills the cache for every template and parameter set, running up to max_workers requests at once.
+        The cache is saved to disk once at the end. Returns the number of answers fetched from the RAG endpoint.
+        """
+        jobs = [(template_id, params) for params in params_list for template_id in template_ids]
+
+        def warm_one(job):
+            template_id, params = job
+            key = self.make_cache_key(template_id, self._normalise_params(params))
+            before = self.cache.get(key)
+            self.ask_template(template_id, params, max_age=max_age)
+            return self.cache.get(key) is not before
+
+        self._persist = False
+        try:
+            with ThreadPoolExecutor(max_workers=max(1, max_workers)) as pool:
+                fetched = sum(pool.map(warm_one, jobs))
+        finally:
+            self._persist = True
+            self._save_cache_to_disk()
+        self.logger.info(f"Warmed RAG cache: {fetched} answers fetched for {len(params_list)} parameter sets.")
+        return fetched
+
+    def invalidate(self, asx_code=None, template_id=None, industry=None):
+        """
+        Removes cached template answers for an ASX code, an industry and/or a template id. Returns the number removed.
+        Industry prompts are keyed by industry and their member codes, so a member's change invalidates its industry.
+        """
+        asx_code = asx_code.strip().upper() if asx_code else None
+        industry = industry.strip() if industry else None
+        with self._lock:
+            stale_keys = []
+            for key in self.cache:
+                parsed = self.parse_cache_key(key)
+                if parsed is None:
+                    continue
+                key_template_id, key_params = parsed
+                if template_id and key_template_id != template_id:
+                    continue
+                if asx_code and key_params.get("asx_code") != asx_code:
+                    continue
+                if industry and key_params.get("industry") != industry:
+                    continue
+                stale_keys.append(key)
+
+            for key in stale_keys:
+                del self.cache[key]
+        if stale_keys:
+            self._schedule_save()
+        self.logger.info(f"Invalidated {len(stale_keys)} cached RAG answers.")
+        return len(stale_keys)
+
+    @staticmethod
+    def _normalise_params(params):
+        normalised = {str(k).strip().lower(): str(v).strip() for k, v in (params or {}).items()}
+        if "asx_code" in normalised:
+            normalised["asx_code"] = normalised["asx_code"].upper()
+        return normalised
+
+    @staticmethod
+    def make_cache_key(template_id, params):
+        """Builds a compact key, e.g. 'tpl:recent_activities|as_of=2024-10-01|asx_code=BHP'."""
+        return "tpl:" + "|".join([template_id] + [f"{k}={params[k]}" for k in sorted(params)])
+
+    @staticmethod
+    def parse_cache_key(key):
+        """Returns (template_id, params) for a template cache key, or None for a raw question key."""
+        if not isinstance(key, str) or not key.startswith("tpl:"):
+            return None
+        template_id, *pairs = key[4:].split("|")
+        return template_id, dict(pair.split("=", 1) for pair in pairs)
+
+    @tracer.traced("rag.request")
+    def _query_rag(self, question):
+        """Sends a prompt to the RAG endpoint. Returns (answer, conversation_id, answered)."""
+        import requests
 
-        self.logger.info(f"Asking RAG question: {question}")
+        self.logger.debug("Asking RAG question: %s", question)
         form = {
             "prompt": question,
             "source_of_request": self.source_of_request,
@@ -30,60 +201,126 @@ class RagUtils:
 
         try:
             self.logger.info("Sending request to RAG endpoint...")
-            response = requests.post(self.rag_endpoint, data=form)
-
-            if response.status_code in [200, 201]:
-                self.logger.info(f"Received response with status code {response.status_code}. Processing response...")
-
-                response_str = response.content.decode("utf-8")
-                lines = response_str.split("\n")
-
-                result = None
-                for line in reversed(lines):
-                    if line.startswith("data: "):
-                        json_str = line[6:]  # Remove the "data: " prefix
-                        try:
-                            json_obj = json.loads(json_str)
-                            if "answer" in json_obj:
-                                result = json_obj
-                                self.logger.info("Found a valid answer in the response.")
-                                break
-                        except json.JSONDecodeError:
-                            self.logger.warning("Failed to decode JSON, continuing with the next line.")
-                            continue
-
-                if result:
-                    rag_response = result.get("answer", "No response")
-                    conversation_id = result.get("conversation_id", None)
-
-                    # Save the result in the cache and persist to disk
-                    self._update_cache(question, (rag_response, conversation_id))
-
-                    self.logger.info(f"RAG response successfully retrieved: {rag_response}")
-                    return rag_response, conversation_id
-                else:
-                    self.logger.error("No valid response found in the RAG output.")
-                    return "No response", None
+            # Rate limited, retried on connection errors, 429 and 5xx, and skipped while the endpoint is failing
+            status_code, result = provider_guard("rag").call(self._post_question, form,
+                                                             retry_on=(requests.RequestException,))
+            if status_code not in [200, 201]:
+                self.logger.error(f"RAG request failed with status code {status_code}.")
+                return "Request failed", None, False
+
+            if result:
+                rag_response = result.get("answer", "No response")
+                conversation_id = result.get("conversation_id", None)
+                self.logger.info("RAG response successfully retrieved (%d characters).", len(rag_response))
+                self.logger.debug("RAG response: %s", rag_response)
+                return rag_response, conversation_id, True
             else:
-                self.logger.error(f"RAG request failed with status code {response.status_code}. Retrying...")
-                time.sleep(1)  # Optional: Add delay before retrying if needed
-                return "Request failed", None
+                self.logger.error("No valid response found in the RAG output.")
+                return "No response", None, False
 
         except requests.RequestException as e:
             self.logger.error(f"An error occurred while contacting the RAG endpoint: {e}")
-            return "Request error", None
+            return "Request error", None, False
+        except ProviderUnavailableError as e:
+            self.logger.warning(f"Skipping the RAG request: {e}")
+            return "Request error", None, False
+
+    def _post_question(self, form):
+        """Posts one prompt and reads the event stream. Returns (status code, result); raises on 429 and 5xx."""
+        import requests
+
+        deadline = time.monotonic() + self.deadline_seconds
+        # Stream the response so events are parsed as they arrive instead of buffering the whole body
+        with requests.post(self.rag_endpoint, data=form, stream=True,
+                           timeout=(self.connect_timeout, self.read_timeout)) as response:
+            if response.status_code == 429 or response.status_code >= 500:
+                response.raise_for_status()
+            if response.status_code not in [200, 201]:
+                return response.status_code, None
+            self.logger.info(f"Received response with status code {response.status_code}. Processing response...")
+            return response.status_code, self._read_event_stream(response, deadline)
+
+    def _read_event_stream(self, response, deadline):
+        """
+        Parses the SSE stream line by line and keeps only the latest event carrying an answer.
+        Stops early after a finish event (including its data, which may carry the final answer), once the overall
+        deadline has passed, or when the stream stalls for longer than the read timeout after an answer has arrived.
+        """
+        import requests
+
+        result = None
+        event_name = None
+        finishing = False
+        lines = response.iter_lines(decode_unicode=True)
+
+        while True:
+            try:
+                line = next(lines, None)
+            except requests.RequestException as e:
+                if result is None:
+                    raise
+                self.logger.warning(f"RAG stream stalled ({e}). Using the latest answer received.")
+                break
+            if line is None:
+                break
+            if time.monotonic() > deadline:
+                self.logger.warning(f"RAG stream exceeded the {self.deadline_seconds}s deadline. Using the latest answer received.")
+                break
+
+            if not line:
+                # A blank line ends the current event
+                if finishing:
+                    break
+                event_name = None
+                continue
+
+            if isinstance(line, bytes):
+                line = line.decode("utf-8")
+
+            if line.startswith("event:"):
+                event_name = line[6:].strip()
+                if event_name in self.finish_events:
+                    # Read the rest of the event, whose data may hold the final answer, then stop
+                    self.logger.info(f"Received finish event '{event_name}' from the RAG stream.")
+                    finishing = True
+                continue
+
+            if not line.startswith("data:"):
+                continue
+
+            json_str = line[5:].strip()  # Remove the "data:" prefix
+            try:
+                json_obj = json.loads(json_str)
+            except json.JSONDecodeError:
+                self.logger.warning("Failed to decode JSON, continuing with the next line.")
+                continue
+
+            if isinstance(json_obj, dict):
+                if "answer" in json_obj:
+                    result = json_obj
+                if json_obj.get("event") in self.finish_events or json_obj.get("done") is True:
+                    self.logger.info("Received finish marker from the RAG stream.")
+                    break
+
+        if result:
+            self.logger.info("Found a valid answer in the response.")
+        return result
 
     def _update_cache(self, question, result):
         """Updates the cache with the latest question and result and saves it to disk."""
-        if len(self.cache) >= self.cache_size:
-            # If the cache is full, remove the oldest item (FIFO)
-            oldest_question = next(iter(self.cache))
-            del self.cache[oldest_question]
-            self.logger.info(f"Cache full. Removed oldest cached entry: {oldest_question}")
+        with self._lock:
+            # Re-inserting moves a refreshed entry to the back of the FIFO order
+            self.cache.pop(question, None)
+            if len(self.cache) >= self.cache_size:
+                # If the cache is full, remove the oldest item (FIFO)
+                oldest_question = next(iter(self.cache))
+                del self.cache[oldest_question]
+                self.logger.debug("Cache full. Removed oldest cached entry: %s", oldest_question)
 
-        self.cache[question] = result
-        self._save_cache_to_disk()
-        self.logger.info(f"Cached the result for question: {question}")
+            self.cache[question] = result
+        if self._persist:
+            self._schedule_save()
+        self.logger.debug("Cached the result for question: %s", question)
 
     def _load_cache_from_disk(self):
         """Loads the cache from disk if it exists."""
@@ -100,12 +337,41 @@ class RagUtils:
             self.logger.info("No cache file found. Starting with an empty cache.")
             return {}
 
+    def _schedule_save(self):
+        """Saves the cache now, or once save_interval seconds have passed since the last save."""
+        with self._lock:
+            if self._save_timer is not None:
+                return
+            now = time.monotonic()
+            delay = self._last_saved + self.save_interval - now
+            if delay > 0:
+                # Not a daemon, so the pending save still runs when the process exits
+                self._save_timer = threading.Timer(delay, self._save_cache_to_disk)
+                self._save_timer.start()
+                return
+            self._last_saved = now
+        self._save_cache_to_disk()
+
     def _save_cache_to_disk(self):
-        """Saves the current cache to disk."""
-        try:
-            with open(self.cache_file, "wb") as f:
-                pickle.dump(self.cache, f)
-            self.logger.info("Cache saved to disk.")
-        except Exception as e:
-            self.logger.error(f"Failed to save cache to disk: {e}")
+        """
+        Saves a snapshot of the cache to disk. The snapshot is pickled outside the cache lock and replaces the
+        file atomically, so readers never wait on the write and never load a partial file.
+        """
+        with self._save_lock:
+            with self._lock:
+                if self._save_timer is not None:
+                    self._save_timer.cancel()
+                    self._save_timer = None
+                self._last_saved = time.monotonic()
+                snapshot = dict(self.cache)
+            temp_path = f"{self.cache_file}.{os.getpid()}.tmp"
+            try:
+                with open(temp_path, "wb") as f:
+                    pickle.dump(snapshot, f)
+                os.replace(temp_path, self.cache_file)
+                self.logger.info("Cache saved to disk.")
+            except Exception as e:
+                self.logger.error(f"Failed to save cache to disk: {e}")
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
 
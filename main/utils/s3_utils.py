@@ -1,27 +1,80 @@
+import io
 import os
-import boto3
-import botocore
+import threading
 from main.utils.logger_utils import logger
-from main.utils.custom_error_utils import S3Error
-from PIL import Image
+from main.utils.custom_error_utils import S3Error, S3UnavailableError
+from main.utils.trace_utils import tracer
+from main.utils.artifact_utils import atomic_write
+from main.utils.provider_utils import provider_guard
+
+# ClientError codes with which S3 signals it is degraded (throttling, 5xx); anything else, e.g. 403 or 404, is an answer
+S3_FAILURE_CODES = {'SlowDown', 'Throttling', 'ThrottlingException', 'RequestLimitExceeded', 'TooManyRequests',
+                    'ServiceUnavailable', 'InternalError', 'RequestTimeout', 'RequestTimeTooSkewed'}
+
+
+def is_s3_failure(error):
+    """True when a botocore ClientError means S3 is throttling or failing rather than answering the request."""
+    code = str(error.response.get("Error", {}).get("Code", ""))
+    status = error.response.get("ResponseMetadata", {}).get("HTTPStatusCode") or 0
+    return code in S3_FAILURE_CODES or (code.isdigit() and int(code) >= 500) or status == 429 or status >= 500
+
+
+def guarded_s3_call(fn, *args):
+    """
+    Calls fn(*args) through the S3 provider guard. Connection errors and throttling or 5xx ClientErrors are retried
+    and counted by the breaker and the concurrency limiter; raises S3UnavailableError once the retries are used up.
+    """
+    import botocore.exceptions
+
+    guard = provider_guard("s3")
+
+    def attempt():
+        try:
+            return fn(*args)
+        except botocore.exceptions.ClientError as error:
+            if is_s3_failure(error):
+                raise S3UnavailableError(f"S3 is unavailable: {error}") from error
+            raise
+
+    return guard.call(attempt, retry_on=(botocore.exceptions.BotoCoreError, S3UnavailableError))
+
 
 class S3Utils:
+    # PNG logos by ASX code, shared by every instance in the process
+    _logo_cache = {}
+    _logo_lock = threading.Lock()
+
     def __init__(self):
         self.bucket_name = os.environ.get("S3_PUBLIC_BUCKET", "dhi-disclosures-public-dev")
         self.aws_access_key_id = os.environ.get("AWS_ACCESS_KEY_ID", "")
         self.aws_secret_access_key = os.environ.get("AWS_SECRET_ACCESS_KEY", "")
 
+    @staticmethod
+    def _client_config(guard):
+        from botocore.config import Config
+
+        return Config(connect_timeout=guard.timeout, read_timeout=guard.timeout)
+
+    @tracer.traced("s3.fetch_pdf")
     def fetch_pdf_from_s3(self, key):
+        # boto3 is slow to import, so it is only loaded once S3 is actually used
+        import boto3
+        import botocore.exceptions
+
         session = boto3.Session(
             aws_access_key_id=self.aws_access_key_id,
             aws_secret_access_key=self.aws_secret_access_key,
         )
 
-        s3 = session.client("s3")
+        guard = provider_guard("s3")
+        s3 = session.client("s3", config=self._client_config(guard))
         try:
             temp_pdf = key.split("/")[-1]
-            s3.download_file(self.bucket_name, key, temp_pdf)
+            guarded_s3_call(s3.download_file, self.bucket_name, key, temp_pdf)
             return temp_pdf
+        except S3UnavailableError as error:
+            logger.error("Error reading data from S3: %s", error)
+            return None
         except botocore.exceptions.ClientError as error:
             if error.response["Error"]["Code"] == "404":
                 logger.error("File not found in S3: %s", key)
@@ -30,6 +83,7 @@ class S3Utils:
                 logger.exception("Error reading data from S3: %s", error)
             return None
 
+    @tracer.traced("s3.fetch_logo")
     def fetch_logo_from_s3(self, asx_code):
         output_dir = 'output'
         if not os.path.exists(output_dir):
@@ -42,28 +96,66 @@ class S3Utils:
         if os.path.exists(converted_logo_file):
             return converted_logo_file
 
+        logo_bytes = self._download_logo(asx_code)
+        if logo_bytes is None:
+            return None
+        atomic_write(converted_logo_file, logo_bytes)
+
+        # Return the path to the resized logo
+        return converted_logo_file
+
+    @tracer.traced("s3.fetch_logo")
+    def fetch_logo_bytes(self, asx_code):
+        """
+        Returns the company logo as PNG bytes without writing temporary files. Logos are kept in memory
+        for the life of the process; a logo already saved to output/ (e.g. by a warm-up run) is reused.
+        """
+        with S3Utils._logo_lock:
+            if asx_code in S3Utils._logo_cache:
+                return S3Utils._logo_cache[asx_code]
+
+        converted_logo_file = f"output/{asx_code}.png"
+        if os.path.exists(converted_logo_file):
+            with open(converted_logo_file, "rb") as f:
+                logo_bytes = f.read()
+        else:
+            logo_bytes = self._download_logo(asx_code)
+
+        with S3Utils._logo_lock:
+            S3Utils._logo_cache[asx_code] = logo_bytes
+        return logo_bytes
+
+    def _download_logo(self, asx_code):
+        """Downloads the .ico logo into memory and converts it to a resized PNG. Returns None if unavailable."""
+        import boto3
+        import botocore.exceptions
+        from PIL import Image
+
         session = boto3.Session()
-        s3 = session.client("s3")
+        guard = provider_guard("s3")
+        s3 = session.client("s3", config=self._client_config(guard))
         s3_logo_name = f"company_logo/{asx_code}.ico"
-        temp_logo_file = f"output/{asx_code}.ico"
+
+        def download():
+            # A fresh buffer per attempt, so a retry never appends to a partial download
+            buffer = io.BytesIO()
+            s3.download_fileobj(self.bucket_name, s3_logo_name, buffer)
+            buffer.seek(0)
+            return buffer
 
         try:
-            # Download the .ico file from S3
-            s3.download_file(self.bucket_name, s3_logo_name, temp_logo_file)
+            # Download the .ico file from S3; a missing logo (404) is an answer, not a provider failure
+            ico_buffer = guarded_s3_call(download)
 
             # Convert .ico file to .png using Pillow
-            with Image.open(temp_logo_file) as img:
+            png_buffer = io.BytesIO()
+            with Image.open(ico_buffer) as img:
                 # Resize the logo before saving
                 max_logo_width = 100
                 max_logo_height = 50
                 img.thumbnail((max_logo_width, max_logo_height), Image.LANCZOS)
-                img.save(converted_logo_file, format='PNG')
-
-            # Remove the .ico file after conversion
-            os.remove(temp_logo_file)
-
-            # Return the path to the resized logo
-            return converted_logo_file
+                img.save(png_buffer, format='PNG')
+            return png_buffer.getvalue()
 
         except botocore.exceptions.ClientError as error:
             if error.response["Error"]["Code"] == "404":
@@ -72,6 +164,9 @@ class S3Utils:
             else:
                 logger.exception("Error reading data from S3: %s", error)
                 return None
+        except S3UnavailableError as error:
+            logger.warning(f"Logo {s3_logo_name} not downloaded: {error}. Proceeding with no logo.")
+            return None
         except Exception as e:
             logger.error(f"Error converting logo from .ico to .png: {e}")
             return None
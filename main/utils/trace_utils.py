@@ -0,0 +1,198 @@
+import os
+import json
+import time
+import threading
+import functools
+from contextlib import contextmanager
+from main.utils.logger_utils import logger
+from main.utils.metrics_utils import metrics
+from main.utils.memory_utils import memory
+
+
+class _NoopSpan:
+    """Shared span returned when tracing and metrics are disabled, so a disabled span costs one attribute lookup."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class _Span:
+    __slots__ = ("tracer", "name", "start")
+
+    def __init__(self, tracer, name):
+        self.tracer = tracer
+        self.name = name
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.tracer.record(self.name, time.perf_counter() - self.start, failed=exc_type is not None)
+        return False
+
+
+class Tracer:
+    """
+    Lightweight per-stage timing for report generation.
+    TRACING_MODE controls the output: "none" (default), "log" (JSON lines through the logger)
+    or "file" (JSON lines appended to logs/trace_<timestamp>.jsonl next to the log files).
+    Spans also feed the /metrics histograms, so they stay active while metrics are enabled.
+    """
+
+    def __init__(self):
+        self.mode = os.getenv("TRACING_MODE", "none").lower()
+        self.emitting = self.mode in ("log", "file")
+        self.enabled = self.emitting or metrics.enabled
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._totals = {}
+        self._reports = []
+        self._trace_file = None
+        if self.mode == "file":
+            log_folder = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'logs'))
+            os.makedirs(log_folder, exist_ok=True)
+            self._trace_file = os.path.join(log_folder, f'trace_{time.strftime("%Y%m%d-%H%M%S")}.jsonl')
+
+    def span(self, name):
+        """Context manager timing a single stage, e.g. `with tracer.span("pdf.render"):`."""
+        if not self.enabled:
+            return _NOOP_SPAN
+        return _Span(self, name)
+
+    def traced(self, name):
+        """Decorator timing every call of a function as a stage."""
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return func(*args, **kwargs)
+                with _Span(self, name):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def record(self, name, duration, failed=False):
+        """Adds a finished stage to the current report (if any) and to the run totals."""
+        if metrics.enabled:
+            metrics.stage_duration.observe(duration, stage=name)
+            if failed:
+                metrics.stage_failures.inc(stage=name)
+        if not self.emitting:
+            return
+        stages = getattr(self._local, "stages", None)
+        with self._lock:
+            # A report's stages may be recorded from several threads (see attach)
+            if stages is not None:
+                stage = stages.setdefault(name, {"count": 0, "seconds": 0.0})
+                stage["count"] += 1
+                stage["seconds"] += duration
+                if failed:
+                    stage["failed"] = True
+            self._totals.setdefault(name, []).append(duration)
+
+    @contextmanager
+    def report(self, report_type, subscription_value):
+        """Collects every stage timed in this thread, and the memory the report used, into one per-report breakdown."""
+        if not self.enabled:
+            yield
+            return
+
+        self._local.stages = {}
+        start = time.perf_counter()
+        memory_before = memory.start()
+        status = "ok"
+        try:
+            yield
+        except Exception:
+            status = "failed"
+            raise
+        finally:
+            stages = self._local.stages
+            self._local.stages = None
+            total = time.perf_counter() - start
+            memory_usage = memory.finish(memory_before)
+            if metrics.enabled:
+                metrics.report_generations.inc(report_type=report_type, status=status)
+                metrics.report_duration.observe(total, report_type=report_type)
+            if self.emitting:
+                with self._lock:
+                    self._reports.append(total)
+                self.emit({
+                    "event": "report_timing",
+                    "report_type": report_type,
+                    "subscription_value": subscription_value,
+                    "status": status,
+                    "total_seconds": round(total, 4),
+                    "stages": {name: {**stage, "seconds": round(stage["seconds"], 4)} for name, stage in stages.items()},
+                    "memory": memory_usage,
+                })
+
+    def context(self):
+        """Returns the stage collector of the report running in this thread, or None."""
+        return getattr(self._local, "stages", None)
+
+    @contextmanager
+    def attach(self, stages):
+        """Records stages timed in this thread against another thread's report (from context())."""
+        previous = getattr(self._local, "stages", None)
+        self._local.stages = stages
+        try:
+            yield
+        finally:
+            self._local.stages = previous
+
+    def summary(self):
+        """Returns aggregate timings per stage (count, total, mean, p50, p95, max) for the run so far."""
+        with self._lock:
+            totals = {name: sorted(durations) for name, durations in self._totals.items()}
+            reports = sorted(self._reports)
+
+        def percentile(values, pct):
+            return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+        stages = {}
+        for name, durations in totals.items():
+            stages[name] = {
+                "count": len(durations),
+                "total_seconds": round(sum(durations), 4),
+                "mean_seconds": round(sum(durations) / len(durations), 4),
+                "p50_seconds": round(percentile(durations, 50), 4),
+                "p95_seconds": round(percentile(durations, 95), 4),
+                "max_seconds": round(durations[-1], 4),
+            }
+        return {
+            "event": "run_summary",
+            "reports": len(reports),
+            "report_p50_seconds": round(percentile(reports, 50), 4) if reports else None,
+            "report_p95_seconds": round(percentile(reports, 95), 4) if reports else None,
+            "stages": stages,
+        }
+
+    def emit_summary(self):
+        """Emits the aggregate summary and resets the totals for the next run."""
+        if not self.emitting:
+            return
+        self.emit(self.summary())
+        with self._lock:
+            self._totals = {}
+            self._reports = []
+
+    def emit(self, record):
+        line = json.dumps(record, default=str)
+        if self._trace_file:
+            with self._lock, open(self._trace_file, "a") as f:
+                f.write(line + "\n")
+        else:
+            logger.info(line)
+
+
+# Define the tracer
+tracer = Tracer()
@@ -0,0 +1,126 @@
+import gc
+import os
+import socket
+import threading
+import multiprocessing
+from multiprocessing.connection import wait
+from main.utils.logger_utils import logger
+from main.utils.memory_utils import rss_bytes
+
+# Exit status of a worker that stopped to be replaced by a fresh process (EX_TEMPFAIL)
+RECYCLE_EXIT_CODE = 75
+
+
+class WorkerRecycler:
+    """
+    Decides when a long-lived worker should hand over to a fresh process: after <PREFIX>_MAX_TASKS tasks, or
+    once its RSS is still above <PREFIX>_MAX_RSS_MB after a garbage collection (0 disables either limit).
+    Batch workers use the WORKER_ prefix and the report viewer the VIEW_ prefix.
+    """
+
+    def __init__(self, prefix="WORKER", max_tasks=None, max_rss_mb=None):
+        self.max_tasks = int(max_tasks if max_tasks is not None else os.environ.get(f"{prefix}_MAX_TASKS", 0))
+        self.max_rss_mb = float(max_rss_mb if max_rss_mb is not None else os.environ.get(f"{prefix}_MAX_RSS_MB", 0))
+        self.tasks = 0
+        self.reason = None
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.max_tasks > 0 or self.max_rss_mb > 0
+
+    def task_done(self):
+        """Counts a finished task and returns the reason to recycle, or None to carry on."""
+        with self._lock:
+            self.tasks += 1
+            if self.reason is None:
+                self.reason = self._check()
+                if self.reason:
+                    logger.info(f"Recycling worker {os.getpid()}: {self.reason}")
+            return self.reason
+
+    def _check(self):
+        if self.max_tasks and self.tasks >= self.max_tasks:
+            return f"{self.tasks} tasks done"
+        if self.max_rss_mb:
+            limit = self.max_rss_mb * 1024 ** 2
+            rss = rss_bytes()
+            if rss is not None and rss > limit:
+                # Only recycle for memory the worker actually holds on to
+                gc.collect()
+                rss = rss_bytes()
+                if rss > limit:
+                    return f"RSS {rss / 1024 ** 2:.0f} MB above {self.max_rss_mb:g} MB"
+        return None
+
+
+def run_supervised(name, count, target, args=(), context=multiprocessing):
+    """
+    Runs count processes of target(*args) and replaces each one that exits with RECYCLE_EXIT_CODE,
+    until every process has finished. Returns the names of the processes that failed.
+    """
+    generations = {}
+
+    def start(slot):
+        generations[slot] = generations.get(slot, -1) + 1
+        process = context.Process(target=target, args=args, name=f"{name}-{slot}.{generations[slot]}")
+        process.start()
+        return process
+
+    running = {slot: start(slot) for slot in range(count)}
+    failed = []
+    while running:
+        wait([process.sentinel for process in running.values()])
+        for slot, process in list(running.items()):
+            if process.is_alive():
+                continue
+            process.join()
+            if process.exitcode == RECYCLE_EXIT_CODE:
+                logger.info(f"{process.name} recycled; starting a replacement.")
+                running[slot] = start(slot)
+                continue
+            del running[slot]
+            if process.exitcode != 0:
+                failed.append(process.name)
+    return failed
+
+
+def _serve_until_recycled(app, host, fd):
+    from werkzeug.serving import make_server
+    from werkzeug.wsgi import ClosingIterator
+
+    recycler = WorkerRecycler("VIEW")
+    server = make_server(host, 0, app, threaded=True, fd=fd)
+    # Let requests in flight finish when the server closes
+    server.daemon_threads = False
+    server.block_on_close = True
+
+    def request_done():
+        if recycler.task_done():
+            # Stop accepting from another thread; serve_forever returns and the socket stays open in the parent
+            threading.Thread(target=server.shutdown, daemon=True).start()
+
+    def recycling_app(environ, start_response):
+        return ClosingIterator(app(environ, start_response), request_done)
+
+    server.app = recycling_app
+    logger.info(f"Report viewer worker {os.getpid()} serving on {host}:{server.port}")
+    server.serve_forever()
+    server.server_close()
+    if recycler.reason:
+        raise SystemExit(RECYCLE_EXIT_CODE)
+
+
+def serve_recycled(app, host, port, workers=1):
+    """
+    Serves app from worker processes that share one listening socket, recycling each worker once the
+    VIEW_MAX_TASKS / VIEW_MAX_RSS_MB policy asks for it. A recycling worker stops accepting, finishes the
+    requests it has, and exits; connections that arrive meanwhile wait in the socket backlog for its replacement.
+    """
+    listener = socket.create_server((host, port), backlog=128)
+    try:
+        # Forked, so the workers inherit the app and the listening socket
+        return not run_supervised("view-worker", workers, _serve_until_recycled, (app, host, listener.fileno()),
+                                  multiprocessing.get_context("fork"))
+    finally:
+        listener.close()
@@ -0,0 +1,119 @@
+"""
+Tests for reading the RAG endpoint's event stream, against a local fake SSE server.
+Run from the repository root: python -m pytest tests
+"""
+import json
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from main.utils.rag_utils import RagUtils
+
+
+class FakeSseHandler(BaseHTTPRequestHandler):
+    """Streams server.script, a list of (delay in seconds, text), as a chunked event stream."""
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        try:
+            for delay, text in self.server.script:
+                time.sleep(delay)
+                body = text.encode("utf-8")
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(body), body))
+                self.wfile.flush()
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def sse_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeSseHandler)
+    server.daemon_threads = True
+    server.script = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def rag(sse_server, tmp_path, monkeypatch):
+    def make(deadline_seconds=5, read_timeout=5):
+        monkeypatch.setenv("RAG_ENDPOINT", f"http://127.0.0.1:{sse_server.server_port}/rag")
+        monkeypatch.setenv("RAG_DEADLINE_SECONDS", str(deadline_seconds))
+        monkeypatch.setenv("RAG_READ_TIMEOUT", str(read_timeout))
+        return RagUtils(cache_file=str(tmp_path / "rag_cache.pkl"))
+    return make
+
+
+def data(payload):
+    return f"data: {json.dumps(payload)}\n\n"
+
+
+def test_stops_at_finish_event(sse_server, rag):
+    # The server would keep the stream open for another 10s after the finish event
+    sse_server.script = [(0, data({"answer": "partial"})), (0, data({"answer": "final", "conversation_id": "c1"})),
+                         (0, "event: end\n\n"), (10, data({"answer": "too late"}))]
+    started = time.monotonic()
+    status_code, result = rag()._post_question({"prompt": "q"})
+    assert status_code == 200
+    assert result == {"answer": "final", "conversation_id": "c1"}
+    assert time.monotonic() - started < 5
+
+
+def test_keeps_the_answer_carried_by_the_finish_event(sse_server, rag):
+    sse_server.script = [(0, data({"answer": "partial"})),
+                         (0, f"event: end\ndata: {json.dumps({'answer': 'final'})}\n\n"),
+                         (10, data({"answer": "too late"}))]
+    started = time.monotonic()
+    assert rag()._post_question({"prompt": "q"})[1] == {"answer": "final"}
+    assert time.monotonic() - started < 5
+
+
+def test_stops_at_done_marker_in_data(sse_server, rag):
+    sse_server.script = [(0, data({"answer": "final"})), (0, data({"done": True})), (10, data({"answer": "too late"}))]
+    assert rag()._post_question({"prompt": "q"})[1] == {"answer": "final"}
+
+
+def test_skips_malformed_data_lines(sse_server, rag):
+    sse_server.script = [(0, "data: {not json\n\n"), (0, data({"answer": "kept"})), (0, "data: [1, 2\n\n"),
+                         (0, data(["not", "an", "answer"])), (0, "event: end\n\n")]
+    assert rag()._post_question({"prompt": "q"})[1] == {"answer": "kept"}
+
+
+def test_deadline_returns_latest_answer(sse_server, rag):
+    # Keep-alive lines keep arriving, so only the overall deadline ends the stream
+    sse_server.script = [(0, data({"answer": "latest"}))] + [(0.2, ": keep-alive\n\n")] * 50
+    started = time.monotonic()
+    status_code, result = rag(deadline_seconds=1, read_timeout=1)._post_question({"prompt": "q"})
+    assert result == {"answer": "latest"}
+    assert time.monotonic() - started < 3
+
+
+def test_stalled_stream_returns_latest_answer_after_read_timeout(sse_server, rag):
+    sse_server.script = [(0, data({"answer": "latest"})), (10, data({"answer": "too late"}))]
+    started = time.monotonic()
+    status_code, result = rag(deadline_seconds=30, read_timeout=0.5)._post_question({"prompt": "q"})
+    assert result == {"answer": "latest"}
+    assert time.monotonic() - started < 5
+
+
+def test_stalled_stream_without_answer_raises(sse_server, rag):
+    import requests
+
+    sse_server.script = [(0, ": keep-alive\n\n"), (10, data({"answer": "too late"}))]
+    with pytest.raises(requests.RequestException):
+        rag(deadline_seconds=30, read_timeout=0.5)._post_question({"prompt": "q"})